@@ -4,72 +4,195 @@ Multimodal RAG Application
 Main entry point for the multimodal retrieval-augmented generation system.
 """
 import os
+import json
+import time
 import argparse
 from utils.auth import setup_google_auth
-from modules.extraction import extract_from_pdf
-from modules.embedding import create_embeddings
-from modules.retrieval import save_index, load_index
-from modules.generation import query_rag_system, show_query_result
+from modules.pipeline import ingest_pdf, format_stats
+from modules.retrieval import index_exists, delete_document, list_documents, compact_index, build_ann_index
+from modules.index_cache import get_index
+from modules.generation import stream_rag_system, query_batch, show_matches
+from modules.query_cache import load_questions, warm_up
+from modules.context import describe_context_stats
 import config
 
-def process_pdf(pdf_path):
+def process_pdf(pdf_path, document_id=None):
     """Process a PDF document and create embeddings."""
-    # Extract content from PDF
-    print("Extracting content from the paper...")
-    extracted_items = extract_from_pdf(pdf_path)
+    # Extract, embed and index the document as one streaming pipeline
+    pipeline = ingest_pdf(pdf_path, document_id=document_id)
+    print(format_stats(pipeline.stats()))
 
-    # Generate embeddings
-    print("Generating embeddings...")
-    indexed_items = create_embeddings(extracted_items)
+    # Load the written index for querying
+    return get_index(pipeline.index_path)
 
-    # Save the index
-    save_index(indexed_items)
-    
-    return indexed_items
+def parse_pages(value):
+    """Parse a 1-based page number or range ("3" or "3-7") into a 0-based inclusive (first, last) pair."""
+    first, _, last = value.partition("-")
+    try:
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid page range '{value}', expected e.g. 3 or 3-7")
+    if first < 1 or last < first:
+        raise argparse.ArgumentTypeError(f"invalid page range '{value}'")
+    return first - 1, last - 1
 
-def process_query(question, indexed_items=None):
-    """Process a question against the indexed items."""
+def process_query(question, indexed_items=None, filters=None, mode=None):
+    """Process a question against the indexed items, optionally only those matching filters."""
     # Load index if not provided
     if indexed_items is None:
-        if not os.path.exists(os.path.join(config.INDEX_DIR, "rag_index.json")):
+        if not index_exists():
             raise ValueError("No index found. Please process a PDF first.")
-        indexed_items = load_index()
+        indexed_items = get_index()
         
-    # Query the system
-    result = query_rag_system(question, indexed_items)
+    # Query the system, showing the evidence first and the answer as it is generated
+    result = None
+    for event in stream_rag_system(question, indexed_items, filters=filters, mode=mode):
+        if event["type"] == "evidence":
+            print(f"Question: {question}\n")
+            print(show_matches(event["top_matches"]))
+            print("\nAnswer:")
+        elif event["type"] == "token":
+            print(event["text"], end="", flush=True)
+        else:
+            result = event["result"]
     
-    # Show results
-    print(show_query_result(result))
+    # Show timings
+    print()
+    if result.get("cached"):
+        print(f"(Answer reused from the answer cache: {result['cached']} match)")
+    timings = result["timings"]
+    print(f"\nRetrieval: {timings['retrieval_seconds']:.2f}s, first token: {timings['first_token_seconds']:.2f}s, "
+          f"total: {timings['total_seconds']:.2f}s")
+    if result.get("context_stats"):
+        print(describe_context_stats(result["context_stats"]))
     
     return result
 
+def read_questions(path):
+    """Yield questions from a JSONL file: one {"question": ..., "id": ...} object or JSON string per line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"question": record}
+            record.setdefault("id", line_number)
+            yield record
+
+def answer_record(result):
+    """JSON-serializable answer with its sources."""
+    record = {"id": result["id"], "question": result["question"], "answer": result["answer"]}
+    if result.get("error"):
+        record["error"] = result["error"]
+    record["sources"] = [
+        {
+            "id": match["id"],
+            "type": match["type"],
+            "document": match.get("document"),
+            "page": match["page"] + 1,
+            "similarity": match["similarity"],
+            "bbox": match.get("bbox"),
+        }
+        for match in result["top_matches"]
+    ]
+    return record
+
+def process_batch(questions_path, answers_path=None, indexed_items=None, filters=None, mode=None, concurrency=None):
+    """Answer every question of a JSONL file, writing one JSON answer per line as each finishes."""
+    if indexed_items is None:
+        if not index_exists():
+            raise ValueError("No index found. Please process a PDF first.")
+        indexed_items = get_index()
+    if answers_path is None:
+        answers_path = os.path.splitext(questions_path)[0] + "_answers.jsonl"
+
+    start = time.perf_counter()
+    count = 0
+    with open(answers_path, "w", encoding="utf-8") as out:
+        for result in query_batch(read_questions(questions_path), indexed_items, filters=filters, mode=mode,
+                                  concurrency=concurrency or config.GENERATION_CONCURRENCY):
+            out.write(json.dumps(answer_record(result)) + "\n")
+            out.flush()
+            count += 1
+            print(f"\rAnswered {count} questions", end="", flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"\nWrote {count} answers to {answers_path} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} questions/s)")
+    return answers_path
+
 def main():
     """Main function to parse arguments and run the application."""
     parser = argparse.ArgumentParser(description="Multimodal RAG System")
     parser.add_argument("--pdf", type=str, help="Path to PDF file to process")
     parser.add_argument("--query", type=str, help="Question to ask about the document")
     parser.add_argument("--key", type=str, help="Path to Google Cloud credentials JSON file")
+    parser.add_argument("--document", type=str, help="Document id for --pdf (defaults to the file name)")
+    parser.add_argument("--delete", type=str, metavar="DOCUMENT", help="Remove a document from the index")
+    parser.add_argument("--list-documents", action="store_true", help="List the documents in the index")
+    parser.add_argument("--compact", action="store_true", help="Merge index segments and drop deleted items")
+    parser.add_argument("--build-ann", action="store_true", help="Build the approximate nearest-neighbour index")
+    parser.add_argument("--questions", type=str, metavar="JSONL", help="Answer every question in a JSONL file")
+    parser.add_argument("--answers", type=str, metavar="JSONL", help="Output file for --questions "
+                        "(defaults to <questions>_answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, help="Concurrent answer generation calls for --questions")
+    parser.add_argument("--warmup", type=str, metavar="FILE", default=config.WARMUP_QUESTIONS_PATH,
+                        help="Pre-embed expected questions (.jsonl or one per line) before querying")
+    parser.add_argument("--type", choices=["text", "image"], help="Search only text chunks or only images")
+    parser.add_argument("--pages", type=parse_pages, metavar="N[-M]", help="Search only pages N to M (1-based)")
+    parser.add_argument("--in-document", type=str, metavar="DOCUMENT", help="Search only one document")
+    parser.add_argument("--mode", choices=["vector", "lexical", "hybrid"],
+                        help="Retrieval mode (default: RETRIEVAL_MODE, lexical needs no embedding call)")
     
     args = parser.parse_args()
     
+    # Index maintenance needs no model access
+    if args.delete or args.list_documents or args.compact or args.build_ann:
+        if not index_exists():
+            raise ValueError("No index found. Please process a PDF first.")
+        if args.delete:
+            delete_document(args.delete)
+        if args.compact:
+            compact_index()
+        if args.build_ann:
+            build_ann_index()
+        if args.list_documents:
+            for document_id, count in sorted(list_documents().items()):
+                print(f"{document_id}: {count} items")
+        return
+    
+    filters = {"type": args.type, "pages": args.pages, "document": args.in_document}
+
     # Set up Google Cloud authentication
     if args.key:
         setup_google_auth(args.key)
     else:
         setup_google_auth(config.KEY_PATH)
     
+    # Pre-embed expected questions so they need no embedding call later
+    if args.warmup:
+        warm_up(load_questions(args.warmup))
+    
     # Process PDF if provided
     if args.pdf:
-        indexed_items = process_pdf(args.pdf)
+        indexed_items = process_pdf(args.pdf, document_id=args.document)
         
         # If query is also provided, process it
         if args.query:
-            process_query(args.query, indexed_items)
+            process_query(args.query, indexed_items, filters=filters, mode=args.mode)
+        if args.questions:
+            process_batch(args.questions, args.answers, indexed_items, filters=filters, mode=args.mode,
+                          concurrency=args.concurrency)
     # Otherwise, just process the query if provided
-    elif args.query:
-        process_query(args.query)
+    elif args.query or args.questions:
+        if args.query:
+            process_query(args.query, filters=filters, mode=args.mode)
+        if args.questions:
+            process_batch(args.questions, args.answers, filters=filters, mode=args.mode, concurrency=args.concurrency)
     else:
-        print("Please provide either a PDF file to process (--pdf) or a question to ask (--query).")
+        print("Please provide a PDF file to process (--pdf), a question to ask (--query) "
+              "or a JSONL file of questions (--questions).")
         
 if __name__ == "__main__":
     main()
\ No newline at end of file
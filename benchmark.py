@@ -0,0 +1,497 @@
+"""
+Benchmarks for the Multimodal RAG system
+----------------------------------------
+Offline benchmarks on synthetic data and local fake models, no API calls.
+
+    python benchmark.py embed --items 200 --latency 0.05
+    python benchmark.py ann --items 100000 --nprobe 4 8 16 32
+    python benchmark.py store --items 100000
+    python benchmark.py items --items 100000
+    python benchmark.py hybrid --items 20000
+    python benchmark.py batch --items 100000 --queries 1000
+    python benchmark.py images --pages 50 --images-per-page 4
+    python benchmark.py chunk --chars 100000 1000000 4000000
+"""
+import os
+import argparse
+import time
+import tracemalloc
+
+# Benchmarks never call the real APIs
+os.environ.setdefault("RAG_FAKE_MODELS", "1")
+
+def synthetic_text_items(count, words=80, seed=0):
+    """Create text items with random word content."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+
+    items = []
+    for i in range(count):
+        content = " ".join(rng.choice(vocabulary, size=words))
+        items.append({
+            "id": f"text_{i // 10}_{i % 10}",
+            "type": "text",
+            "content": content,
+            "page": i // 10,
+            "path": ""
+        })
+    return items
+
+def blank_items(count):
+    """Minimal items to pair with a synthetic embedding matrix."""
+    return [{"id": f"item_{i}", "type": "text", "content": "", "page": 0, "path": ""} for i in range(count)]
+
+def bench_embed(args):
+    """Embedding throughput against a fake model with fixed per-call latency."""
+    from modules.embedding import create_embeddings
+    from modules.models import FakeEmbeddingModel, set_model_factory
+
+    set_model_factory("embedding", lambda name, **config: FakeEmbeddingModel(latency=args.latency))
+
+    rows = []
+    for concurrency in args.concurrency:
+        items = synthetic_text_items(args.items)
+        start = time.perf_counter()
+        create_embeddings(items, concurrency=concurrency, cache=False)
+        elapsed = time.perf_counter() - start
+        rows.append((concurrency, args.items / elapsed))
+
+    print("\nconcurrency   items/s   speedup")
+    for concurrency, throughput in rows:
+        print(f"{concurrency:11d}  {throughput:8.1f}   x{throughput / rows[0][1]:.2f}")
+
+def synthetic_embeddings(count, dim=1408, clusters=256, queries=100, seed=0):
+    """Clustered random vectors (like real embeddings) plus queries near them."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+
+    matrix = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 10000):
+        stop = min(count, start + 10000)
+        labels = rng.integers(0, clusters, size=stop - start)
+        matrix[start:stop] = centers[labels] + 0.8 * rng.standard_normal((stop - start, dim)).astype(np.float32)
+
+    query_rows = rng.choice(count, size=queries, replace=False)
+    query_matrix = matrix[query_rows] + 0.5 * rng.standard_normal((queries, dim)).astype(np.float32)
+    return matrix, query_matrix
+
+def timed_queries(search, queries):
+    """Run search per query and return (results, mean latency in ms)."""
+    start = time.perf_counter()
+    results = [search(query) for query in queries]
+    return results, 1000 * (time.perf_counter() - start) / len(queries)
+
+def recall_at_k(results, truth):
+    """Share of the exact top-k rows found, averaged over queries."""
+    hits = sum(len({row for row, _ in found} & {row for row, _ in exact}) for found, exact in zip(results, truth))
+    return hits / sum(len(exact) for exact in truth)
+
+def bench_ann(args):
+    """IVF recall@k and latency against exact search."""
+    from modules.retrieval import VectorIndex
+
+    matrix, queries = synthetic_embeddings(args.items, args.dim, queries=args.queries)
+    index = VectorIndex(blank_items(args.items), matrix=matrix)
+
+    truth, exact_ms = timed_queries(lambda q: index.top_k(q, args.top_k), queries)
+
+    start = time.perf_counter()
+    ann = index.build_ann(n_lists=args.nlist or None)
+    build_seconds = time.perf_counter() - start
+
+    print(f"\n{args.items} items x {args.dim} dims, {ann.n_lists} lists (built in {build_seconds:.1f}s)")
+    print(f"exact search: {exact_ms:7.2f} ms/query")
+    print("nprobe   ms/query   speedup   recall@" + str(args.top_k))
+    for nprobe in args.nprobe:
+        results, ms = timed_queries(lambda q: index.top_k(q, args.top_k, nprobe=nprobe), queries)
+        print(f"{nprobe:6d}  {ms:9.2f}   x{exact_ms / ms:7.1f}   {recall_at_k(results, truth):.3f}")
+
+def bench_store(args):
+    """Memory, latency and recall of each compressed embedding store."""
+    from modules.retrieval import VectorIndex
+
+    matrix, queries = synthetic_embeddings(args.items, args.dim, queries=args.queries)
+    index = VectorIndex(blank_items(args.items), matrix=matrix)
+    truth, exact_ms = timed_queries(lambda q: index.top_k(q, args.top_k), queries)
+
+    print(f"\n{args.items} items x {args.dim} dims, recall@{args.top_k} against exact float32 search")
+    print("mode      rerank      MB   reduction   ms/query   recall")
+    print(f"float32   {'-':>6}  {matrix.nbytes / 2**20:6.1f}   x{1:8.1f}   {exact_ms:8.2f}   1.000")
+    for mode in args.modes:
+        store = index.compress(mode, subspaces=args.subspaces)
+        for rerank in (0, args.rerank):
+            results, ms = timed_queries(lambda q: index.top_k(q, args.top_k, rerank=rerank), queries)
+            print(f"{mode:<8}  {rerank:6d}  {store.nbytes / 2**20:6.1f}   x{matrix.nbytes / store.nbytes:8.1f}"
+                  f"   {ms:8.2f}   {recall_at_k(results, truth):.3f}")
+    index.store = None
+
+def bench_items(args):
+    """Memory and allocations of item dicts against the columnar ItemStore."""
+    import numpy as np
+    from modules.item_store import ItemStore
+
+    items = synthetic_text_items(args.items, words=args.words)
+    for item in items:
+        item["path"] = f"text/doc/page_{item['page']}.txt"
+        item["document"] = "doc"
+    columns = {
+        "ids": [item["id"] for item in items],
+        "types": [item["type"] for item in items],
+        "pages": [item["page"] for item in items],
+        "paths": [item["path"] for item in items],
+        "documents": [item["document"] for item in items],
+    }
+    encoded = [item["content"].encode("utf-8") for item in items]
+    columns["lengths"] = [len(text) for text in encoded]
+    columns["offsets"] = np.concatenate([[0], np.cumsum(columns["lengths"])[:-1]]).tolist()
+    matrix = np.zeros((args.items, 1), dtype=np.float32)
+
+    def measure(build):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, current, seconds
+
+    # Both paths start from the text buffer as read from content.bin, so the
+    # totals include the decoded strings for dicts and the kept buffer for the store
+    def read_content():
+        return b"".join(encoded)
+
+    # Loading: rebuild every dict (as before) or wrap the columns
+    def load_dicts():
+        content = read_content()
+        return [{"id": columns["ids"][i], "type": columns["types"][i],
+                 "content": content[columns["offsets"][i]:columns["offsets"][i] + columns["lengths"][i]].decode("utf-8"),
+                 "page": columns["pages"][i], "path": columns["paths"][i], "document": columns["documents"][i]}
+                for i in range(args.items)]
+
+    dicts, dict_bytes, dict_seconds = measure(load_dicts)
+    store, store_bytes, store_seconds = measure(lambda: ItemStore.from_columns(columns, read_content(), matrix))
+
+    # Results: copy dicts (as before) or return views
+    rows = list(range(0, args.items, max(1, args.items // 1000)))
+    _, copy_bytes, copy_seconds = measure(lambda: [dict(dicts[row], similarity=0.0) for row in rows])
+    _, view_bytes, view_seconds = measure(lambda: [store.view(row, similarity=0.0) for row in rows])
+
+    # Reading fields: plain dict lookups vs views decoding on access
+    fields = ("id", "content", "page", "document")
+    start = time.perf_counter()
+    for item in dicts:
+        for field in fields:
+            item[field]
+    dict_access = (time.perf_counter() - start) / (len(dicts) * len(fields))
+    start = time.perf_counter()
+    for row in range(args.items):
+        item = store.view(row)
+        for field in fields:
+            item[field]
+    view_access = (time.perf_counter() - start) / (args.items * len(fields))
+
+    print(f"\n{args.items} items, {args.words} words each")
+    print("              dicts        store")
+    print(f"load MB   {dict_bytes / 2**20:9.1f}    {store_bytes / 2**20:9.1f}   (text buffer {len(store.content) / 2**20:.1f} MB)")
+    print(f"load s    {dict_seconds:9.2f}    {store_seconds:9.2f}")
+    print(f"B/item    {dict_bytes / args.items:9.0f}    {store_bytes / args.items:9.0f}")
+    print(f"field us  {1e6 * dict_access:9.2f}    {1e6 * view_access:9.2f}   (views decode on every access)")
+    print(f"{len(rows)} results: {copy_bytes / 1024:.0f} KB copied dicts vs {view_bytes / 1024:.0f} KB views "
+          f"({1e6 * copy_seconds / len(rows):.2f} vs {1e6 * view_seconds / len(rows):.2f} us each)")
+
+def synthetic_corpus(count, dim=256, vocabulary=5000, words=80, queries=200, query_words=5, synonym_rate=0.5, seed=0):
+    """Text items with bag-of-word-vector embeddings, plus queries that paraphrase one item.
+
+    Every word has a synonym with a nearby vector, so a paraphrased query is easy for
+    embeddings and hard for exact term matching. Returns (items, matrix, questions, query matrix, targets).
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    word_vectors = rng.standard_normal((vocabulary, dim)).astype(np.float32)
+    synonym_vectors = word_vectors + 0.3 * rng.standard_normal((vocabulary, dim)).astype(np.float32)
+
+    word_ids = rng.integers(0, vocabulary, size=(count, words))
+    items = [{"id": f"text_{i}", "type": "text", "content": " ".join(f"w{w}" for w in word_ids[i]), "page": i // 10,
+              "path": ""} for i in range(count)]
+    matrix = np.stack([word_vectors[ids].mean(axis=0) for ids in word_ids])
+
+    targets = rng.choice(count, size=queries, replace=False)
+    questions, query_matrix = [], np.empty((queries, dim), dtype=np.float32)
+    for q, target in enumerate(targets):
+        chosen = rng.choice(word_ids[target], size=query_words, replace=False)
+        synonym = rng.random(query_words) < synonym_rate
+        questions.append(" ".join(f"s{w}" if syn else f"w{w}" for w, syn in zip(chosen, synonym)))
+        query_matrix[q] = np.where(synonym[:, None], synonym_vectors[chosen], word_vectors[chosen]).mean(axis=0)
+    return items, matrix, questions, query_matrix, targets
+
+def bench_hybrid(args):
+    """Latency and quality of lexical, vector and hybrid retrieval on paraphrased queries."""
+    from modules.retrieval import VectorIndex
+
+    items, matrix, questions, query_matrix, targets = synthetic_corpus(
+        args.items, queries=args.queries, synonym_rate=args.synonym_rate)
+    index = VectorIndex(items, matrix=matrix)
+
+    start = time.perf_counter()
+    index.build_lexical()
+    print(f"\n{args.items} items, BM25 index with {len(index.lexical)} terms built in {time.perf_counter() - start:.2f}s")
+    print(f"{args.queries} paraphrased queries, {args.synonym_rate:.0%} of query words swapped for synonyms, "
+          f"embedding call modelled as {1000 * args.latency:.0f} ms")
+    print("mode      search ms   with embed ms   recall@" + f"{args.top_k}   MRR")
+
+    for mode in ("lexical", "vector", "hybrid"):
+        ranks = []
+        start = time.perf_counter()
+        for question, query, target in zip(questions, query_matrix, targets):
+            matches = index.search(query, top_k=args.top_k, query_text=question, mode=mode)
+            found = [match.row for match in matches]
+            ranks.append(found.index(target) + 1 if target in found else None)
+        ms = 1000 * (time.perf_counter() - start) / len(questions)
+
+        # Only vector and hybrid retrieval need the question embedded first
+        total_ms = ms + (0 if mode == "lexical" else 1000 * args.latency)
+        recall = sum(rank is not None for rank in ranks) / len(ranks)
+        mrr = sum(1 / rank for rank in ranks if rank) / len(ranks)
+        print(f"{mode:<8}  {ms:9.2f}   {total_ms:13.2f}   {recall:8.3f}   {mrr:.3f}")
+
+def bench_batch(args):
+    """Exact search of many questions one by one vs one matrix-matrix product per block."""
+    from modules.retrieval import VectorIndex
+
+    matrix, queries = synthetic_embeddings(args.items, args.dim, queries=args.queries)
+    index = VectorIndex(blank_items(args.items), matrix=matrix)
+
+    single, single_ms = timed_queries(lambda q: index.top_k(q, args.top_k), queries)
+    start = time.perf_counter()
+    batched = index.top_k_batch(queries, args.top_k)
+    batch_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    same = all([row for row, _ in a] == [row for row, _ in b] for a, b in zip(single, batched))
+    print(f"\n{args.items} items x {args.dim} dims, {args.queries} queries")
+    print(f"one by one: {single_ms:7.2f} ms/query")
+    print(f"batched:    {batch_ms:7.2f} ms/query   x{single_ms / batch_ms:.1f}   same results: {same}")
+
+def image_heavy_pdf(path, pages, images_per_page, size=(480, 360), seed=0):
+    """Write a PDF whose pages hold a line of text and several noisy (incompressible) PNG images."""
+    import io
+    import numpy as np
+    import pymupdf
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    with pymupdf.open() as doc:
+        for page_num in range(pages):
+            page = doc.new_page(width=width + 144, height=(height + 36) * images_per_page + 144)
+            page.insert_text((72, 48), f"Figures of page {page_num}")
+            for i in range(images_per_page):
+                pixels = (rng.random((height, width, 3)) * 255).astype(np.uint8)
+                png = io.BytesIO()
+                Image.fromarray(pixels).save(png, format="PNG")
+                top = 72 + i * (height + 36)
+                page.insert_image(pymupdf.Rect(72, top, 72 + width, top + height), stream=png.getvalue())
+        doc.save(path)
+
+def bench_images(args):
+    """Memory of extracted image items with eager base64 content (as before) vs lazy handles."""
+    import base64
+    import tempfile
+    from modules.extraction import extract_from_pdf
+    from modules.blob_store import image_handle
+    from modules.index_cache import get_prompt_image, clear_caches
+    from config import CONTEXT_IMAGE_MAX_PIXELS
+
+    pdf_path = args.pdf
+    if pdf_path is None:
+        pdf_path = os.path.join(tempfile.mkdtemp(), "images.pdf")
+        image_heavy_pdf(pdf_path, args.pages, args.images_per_page)
+
+    def measure(build):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, current, peak, seconds
+
+    # Lazy: items keep a handle, the bytes stay in the blob store
+    items, lazy_bytes, lazy_peak, lazy_seconds = measure(
+        lambda: extract_from_pdf(pdf_path, workers=1, document_id="benchmark_images"))
+    images = [item for item in items if item["type"] == "image"]
+    image_bytes = sum(image_handle(item).nbytes for item in images)
+
+    # Eager: every image also held as base64 in item["content"], as extraction and loading used to do
+    def encode_all():
+        return [base64.b64encode(image_handle(item).read()).decode("utf-8") for item in images]
+
+    encoded, eager_extra, _, encode_seconds = measure(encode_all)
+    del encoded
+
+    # Prompt images: first use downsizes and re-encodes, repeats are LRU hits
+    clear_caches()
+    handles = [image_handle(item) for item in images[:args.retrieved]]
+    start = time.perf_counter()
+    for handle in handles:
+        get_prompt_image(handle, CONTEXT_IMAGE_MAX_PIXELS)
+    cold_ms = 1000 * (time.perf_counter() - start) / max(len(handles), 1)
+    start = time.perf_counter()
+    for handle in handles:
+        get_prompt_image(handle, CONTEXT_IMAGE_MAX_PIXELS)
+    warm_ms = 1000 * (time.perf_counter() - start) / max(len(handles), 1)
+
+    print(f"\n{len(images)} images, {image_bytes / 2**20:.1f} MB of image bytes, {len(items) - len(images)} text items")
+    print("                       eager base64     lazy handles")
+    print(f"items in memory MB   {(lazy_bytes + eager_extra) / 2**20:13.1f}    {lazy_bytes / 2**20:13.1f}")
+    print(f"B/image              {(lazy_bytes + eager_extra) / len(images):13.0f}    {lazy_bytes / len(images):13.0f}")
+    print(f"encode s             {encode_seconds:13.2f}    {0.0:13.2f}")
+    print(f"extraction: {lazy_seconds:.2f}s, peak {lazy_peak / 2**20:.1f} MB traced")
+    print(f"prompt image ({len(handles)} images): {cold_ms:.1f} ms first use, {warm_ms:.3f} ms cached")
+
+def synthetic_document(chars, seed=0):
+    """Text with paragraphs, sentences of varied length, runs of spaces and a few very long words."""
+    import random
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" * rng.randint(1, 4) for i in range(3000)]
+    parts, size = [], 0
+    while size < chars:
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(3, 40))]
+        if rng.random() < 0.01:
+            words.append("x" * rng.randint(500, 3000))
+        sentence = " ".join(words) + rng.choice([". ", "? ", ", ", ".\n", "  "])
+        if rng.random() < 0.1:
+            sentence += "\n\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:chars]
+
+def legacy_chunk_text(text, chunk_size=800, overlap=100):
+    """The chunker extraction used before modules.chunking, kept for comparison."""
+    chunks = []
+    current_chunk = ""
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > chunk_size:
+            for sentence in paragraph.replace(". ", ".|").split("|"):
+                if len(sentence) > chunk_size:
+                    for i in range(0, len(sentence), chunk_size // 2):
+                        if sentence[i:i + chunk_size // 2]:
+                            chunks.append(sentence[i:i + chunk_size // 2])
+                elif len(current_chunk) + len(sentence) + 2 > chunk_size:
+                    if current_chunk:
+                        chunks.append(current_chunk)
+                    current_chunk = sentence
+                else:
+                    current_chunk = current_chunk + " " + sentence if current_chunk else sentence
+        elif len(current_chunk) + len(paragraph) + 2 > chunk_size and current_chunk:
+            chunks.append(current_chunk)
+            words = current_chunk.split()
+            overlap_words = min(len(words), overlap // 10)
+            overlap_text = " ".join(words[-overlap_words:]) if overlap_words > 0 else ""
+            current_chunk = overlap_text + " " + paragraph
+        else:
+            current_chunk = current_chunk + "\n\n" + paragraph if current_chunk else paragraph
+    if current_chunk:
+        chunks.append(current_chunk)
+    final_chunks = []
+    for chunk in chunks:
+        if len(chunk) <= 1000:
+            final_chunks.append(chunk)
+        else:
+            final_chunks.extend(chunk[i:i + 900] for i in range(0, len(chunk), 900))
+    return final_chunks
+
+def bench_chunk(args):
+    """Throughput of the offset-based chunker against the previous one (best of --repeat runs)."""
+    from modules.chunking import chunk_text
+
+    print("      chars    legacy MB/s    chars MB/s   tokens MB/s    chunks (legacy/chars/tokens)")
+    for chars in args.chars:
+        text = synthetic_document(chars)
+        row = []
+        for chunker in (lambda: legacy_chunk_text(text, args.size, args.overlap),
+                        lambda: chunk_text(text, args.size, args.overlap, "chars"),
+                        lambda: chunk_text(text, args.tokens, args.token_overlap, "tokens")):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = chunker()
+                best = min(best, time.perf_counter() - start)
+            row.append((len(text) / 2**20 / best, len(result)))
+        print(f"{chars:11,} {row[0][0]:14.1f} {row[1][0]:13.1f} {row[2][0]:13.1f}    "
+              f"{row[0][1]:,}/{row[1][1]:,}/{row[2][1]:,}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Multimodal RAG benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    embed_parser = subparsers.add_parser("embed", help="Embedding throughput vs concurrency")
+    embed_parser.add_argument("--items", type=int, default=200)
+    embed_parser.add_argument("--latency", type=float, default=0.05, help="Fake API latency in seconds")
+    embed_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    embed_parser.set_defaults(func=bench_embed)
+
+    ann_parser = subparsers.add_parser("ann", help="IVF recall@k vs latency against exact search")
+    ann_parser.add_argument("--items", type=int, default=100000)
+    ann_parser.add_argument("--dim", type=int, default=1408)
+    ann_parser.add_argument("--queries", type=int, default=100)
+    ann_parser.add_argument("--top-k", type=int, default=5)
+    ann_parser.add_argument("--nlist", type=int, default=0, help="Number of clusters (0 = about 4*sqrt(items))")
+    ann_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    ann_parser.set_defaults(func=bench_ann)
+
+    store_parser = subparsers.add_parser("store", help="Memory, latency and recall of compressed embedding stores")
+    store_parser.add_argument("--items", type=int, default=100000)
+    store_parser.add_argument("--dim", type=int, default=1408)
+    store_parser.add_argument("--queries", type=int, default=100)
+    store_parser.add_argument("--top-k", type=int, default=5)
+    store_parser.add_argument("--modes", nargs="+", default=["float16", "int8", "pq"])
+    store_parser.add_argument("--subspaces", type=int, default=64, help="PQ subspaces (bytes per vector)")
+    store_parser.add_argument("--rerank", type=int, default=32, help="Re-rank factor for the second run")
+    store_parser.set_defaults(func=bench_store)
+
+    items_parser = subparsers.add_parser("items", help="Memory of item dicts vs the columnar item store")
+    items_parser.add_argument("--items", type=int, default=100000)
+    items_parser.add_argument("--words", type=int, default=80)
+    items_parser.set_defaults(func=bench_items)
+
+    hybrid_parser = subparsers.add_parser("hybrid", help="Lexical vs vector vs hybrid retrieval latency and quality")
+    hybrid_parser.add_argument("--items", type=int, default=20000)
+    hybrid_parser.add_argument("--queries", type=int, default=200)
+    hybrid_parser.add_argument("--top-k", type=int, default=5)
+    hybrid_parser.add_argument("--synonym-rate", type=float, default=0.5, help="Share of query words paraphrased")
+    hybrid_parser.add_argument("--latency", type=float, default=0.1, help="Modelled embedding API latency in seconds")
+    hybrid_parser.set_defaults(func=bench_hybrid)
+
+    batch_parser = subparsers.add_parser("batch", help="Per-query vs batched exact search")
+    batch_parser.add_argument("--items", type=int, default=100000)
+    batch_parser.add_argument("--dim", type=int, default=1408)
+    batch_parser.add_argument("--queries", type=int, default=1000)
+    batch_parser.add_argument("--top-k", type=int, default=5)
+    batch_parser.set_defaults(func=bench_batch)
+
+    images_parser = subparsers.add_parser("images", help="Memory of eager base64 images vs lazy image handles")
+    images_parser.add_argument("--pdf", help="Image-heavy PDF to extract (default: a generated one)")
+    images_parser.add_argument("--pages", type=int, default=50)
+    images_parser.add_argument("--images-per-page", type=int, default=4)
+    images_parser.add_argument("--retrieved", type=int, default=20, help="Images prepared for prompts")
+    images_parser.set_defaults(func=bench_images)
+
+    chunk_parser = subparsers.add_parser("chunk", help="Chunker throughput against the previous chunker")
+    chunk_parser.add_argument("--chars", type=int, nargs="+", default=[100000, 1000000, 4000000])
+    chunk_parser.add_argument("--size", type=int, default=800, help="chunk size in characters")
+    chunk_parser.add_argument("--overlap", type=int, default=100, help="overlap in characters")
+    chunk_parser.add_argument("--tokens", type=int, default=200, help="chunk size in tokens")
+    chunk_parser.add_argument("--token-overlap", type=int, default=25)
+    chunk_parser.add_argument("--repeat", type=int, default=5, help="runs per chunker, the fastest is reported")
+    chunk_parser.set_defaults(func=bench_chunk)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,119 @@ LOCATION = "us-central1"
 # Base directory is relative to the application
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Model settings
+EMBEDDING_MODEL = "multimodalembedding@001"
+EMBEDDING_DIM = 1408  # Standard dimension for this model
+LLM_MODEL = "gemini-pro-vision"
+
+# Embedding throughput: parallel API calls, requests per second (0 = unlimited), retries
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", 8))
+EMBEDDING_RATE_LIMIT = float(os.environ.get("EMBEDDING_RATE_LIMIT", 0))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 5))
+
+# PDF extraction: worker processes and pages handed to each worker at a time
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 1))
+EXTRACTION_PAGES_PER_TASK = int(os.environ.get("EXTRACTION_PAGES_PER_TASK", 8))
+# Text extraction mode: plain (page.get_text() as is) or layout (blocks in reading order, image
+# captions and bounding boxes); both take a few ms per page. Switching changes chunk text and ids,
+# so re-index existing documents after changing it. EXTRACTION_TABLES=1 also detects
+# tables in layout mode and chunks them as units, at about 120-190 ms more per page
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "plain")
+EXTRACTION_TABLES = os.environ.get("EXTRACTION_TABLES", "0") == "1"
+
+# Text chunking: budget and overlap in CHUNK_UNIT units (chars, or tokens: words and punctuation
+# marks), with chunks also capped at CHUNK_MAX_CHARS for the embedding API. CHUNK_SPAN_PAGES=1
+# chunks the document as one text, so chunks can run across page breaks
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 800))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 100))
+CHUNK_UNIT = os.environ.get("CHUNK_UNIT", "chars")
+CHUNK_MAX_CHARS = int(os.environ.get("CHUNK_MAX_CHARS", 1000))
+CHUNK_SPAN_PAGES = os.environ.get("CHUNK_SPAN_PAGES", "0") == "1"
+
+# Image filtering at extraction (IMAGE_FILTER=0 keeps every image): images smaller than this are
+# skipped, repeated xrefs and images whose perceptual hashes differ by at most IMAGE_HASH_DISTANCE
+# bits (of 64) reuse the first image's blob and embedding
+IMAGE_FILTER_ENABLED = os.environ.get("IMAGE_FILTER", "1") == "1"
+IMAGE_MIN_WIDTH = int(os.environ.get("IMAGE_MIN_WIDTH", 32))
+IMAGE_MIN_HEIGHT = int(os.environ.get("IMAGE_MIN_HEIGHT", 32))
+IMAGE_MIN_BYTES = int(os.environ.get("IMAGE_MIN_BYTES", 512))
+IMAGE_HASH_DISTANCE = int(os.environ.get("IMAGE_HASH_DISTANCE", 4))
+
+# Items buffered between ingestion pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 64))
+
+# Index compaction: merge segments past this count or once this share of rows is deleted
+COMPACT_MAX_SEGMENTS = int(os.environ.get("COMPACT_MAX_SEGMENTS", 8))
+COMPACT_DELETED_RATIO = float(os.environ.get("COMPACT_DELETED_RATIO", 0.3))
+
+# Approximate (IVF) search for large indexes: set ANN=0 to always search exactly.
+# ANN_N_LISTS=0 picks about 4 * sqrt(items) clusters, ANN_NPROBE clusters are scored per query
+ANN_ENABLED = os.environ.get("ANN", "1") == "1"
+ANN_MIN_ITEMS = int(os.environ.get("ANN_MIN_ITEMS", 50000))
+ANN_N_LISTS = int(os.environ.get("ANN_N_LISTS", 0))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 16))
+
+# Compressed embeddings scored at query time: float32 (off), float16, int8 or pq.
+# RERANK_FACTOR * top_k candidates are re-ranked exactly (0 = no re-ranking)
+EMBEDDING_STORE = os.environ.get("EMBEDDING_STORE", "float32")
+PQ_SUBSPACES = int(os.environ.get("PQ_SUBSPACES", 64))
+RERANK_FACTOR = int(os.environ.get("RERANK_FACTOR", 32))
+
+# Retrieval mode: vector (embeddings), lexical (BM25, no embedding call) or hybrid
+# (both, fused by reciprocal rank). HYBRID_DEPTH results of each are fused
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "vector")
+HYBRID_DEPTH = int(os.environ.get("HYBRID_DEPTH", 50))
+RRF_K = int(os.environ.get("RRF_K", 60))
+BM25_K1 = float(os.environ.get("BM25_K1", 1.2))
+BM25_B = float(os.environ.get("BM25_B", 0.75))
+
+# Batch querying: concurrent answer generation calls, questions embedded and scored together
+GENERATION_CONCURRENCY = int(os.environ.get("GENERATION_CONCURRENCY", 4))
+QUERY_BATCH_SIZE = int(os.environ.get("QUERY_BATCH_SIZE", 64))
+
+# Context packing: prompt text budget (CONTEXT_MAX_TOKENS, if set, also caps it at about 4
+# characters per token), word-shingle overlap above which a passage is a duplicate, and the
+# pixel budget images are downsized to before they are sent
+CONTEXT_MAX_CHARS = int(os.environ.get("CONTEXT_MAX_CHARS", 6000))
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 0))
+CONTEXT_DEDUPE_THRESHOLD = float(os.environ.get("CONTEXT_DEDUPE_THRESHOLD", 0.8))
+CONTEXT_IMAGE_MAX_PIXELS = int(os.environ.get("CONTEXT_IMAGE_MAX_PIXELS", 1024 * 1024))
+
+# Async query path: threads for blocking calls (embedding API, SQLite, large searches), retries of
+# a generation call that fails before its first token, and the index size from which retrieval
+# leaves the event loop
+ASYNC_WORKERS = int(os.environ.get("ASYNC_WORKERS", 32))
+GENERATION_MAX_RETRIES = int(os.environ.get("GENERATION_MAX_RETRIES", 3))
+ASYNC_RETRIEVAL_MIN_ITEMS = int(os.environ.get("ASYNC_RETRIEVAL_MIN_ITEMS", 20000))
+
+# Question embeddings kept in memory (LRU), also persisted in the embedding cache unless
+# QUERY_CACHE_PERSIST=0. WARMUP_QUESTIONS names a .jsonl or text file of questions embedded at startup
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 4096))
+QUERY_CACHE_PERSIST = os.environ.get("QUERY_CACHE_PERSIST", "1") == "1"
+WARMUP_QUESTIONS_PATH = os.environ.get("WARMUP_QUESTIONS")
+
+# Answer cache (stored under INDEX_DIR), set ANSWER_CACHE=0 to disable. A question reuses a
+# cached answer when it retrieves the same context and its cosine similarity is >= the threshold
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 10000))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 7 * 24 * 3600))  # seconds, 0 = never expire
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+
+# Persistent embedding cache (stored under INDEX_DIR), set EMBEDDING_CACHE=0 to disable
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MB", 1024)) * 1024 * 1024
+
+# Set RAG_FAKE_MODELS=1 to use local fake models (offline benchmarks)
+FAKE_MODELS = os.environ.get("RAG_FAKE_MODELS", "0") == "1"
+
 # Storage directories
 DATA_DIR = os.path.join(BASE_DIR, "data")
 CREDENTIALS_DIR = os.path.join(BASE_DIR, "credentials")
 OUTPUT_DIR = os.path.join(BASE_DIR, "static")
 INDEX_DIR = os.path.join(OUTPUT_DIR, "index")
+# Packed image bytes, one data file and offset table per document
+BLOB_DIR = os.path.join(OUTPUT_DIR, "blobs")
+# One file per chunk and per image, the layout of older versions (their indexes point here)
 TEXT_DIR = os.path.join(OUTPUT_DIR, "text")
 IMAGE_DIR = os.path.join(OUTPUT_DIR, "images")
 
@@ -33,8 +141,20 @@ PDF_PATH = os.environ.get(
 )
 
 # Ensure all necessary directories exist
-for dir_path in [DATA_DIR, CREDENTIALS_DIR, INDEX_DIR, TEXT_DIR, IMAGE_DIR]:
+for dir_path in [DATA_DIR, CREDENTIALS_DIR, INDEX_DIR, BLOB_DIR]:
     os.makedirs(dir_path, exist_ok=True)
 
-# Default index file
-DEFAULT_INDEX_PATH = os.path.join(INDEX_DIR, "rag_index.json")
\ No newline at end of file
+# Embedding cache database
+EMBEDDING_CACHE_PATH = os.path.join(INDEX_DIR, "embedding_cache.sqlite")
+
+# Answer cache database
+ANSWER_CACHE_PATH = os.path.join(INDEX_DIR, "answer_cache.sqlite")
+
+# Default index directory (legacy rag_index.json files are migrated on load)
+DEFAULT_INDEX_PATH = os.path.join(INDEX_DIR, "rag_index")
+
+# In-memory cache budgets, shared by every Streamlit session in the process
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MB", 1024)) * 1024 * 1024
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MB", 256)) * 1024 * 1024
+# Downsized, re-encoded images ready to send, kept for images that are retrieved often
+PROMPT_IMAGE_CACHE_MAX_BYTES = int(os.environ.get("PROMPT_IMAGE_CACHE_MB", 128)) * 1024 * 1024
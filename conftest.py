@@ -0,0 +1,4 @@
+import os
+
+# Tests never call the real APIs
+os.environ.setdefault("RAG_FAKE_MODELS", "1")
@@ -0,0 +1,118 @@
+"""
+Approximate nearest-neighbour search
+------------------------------------
+An IVF (inverted file) index in pure NumPy. Spherical k-means splits the
+normalized embeddings into `n_lists` clusters; a query scores the centroids,
+then scores exactly only the rows of its `nprobe` closest clusters.
+"""
+import numpy as np
+
+# Rows scored at a time while training and assigning, to bound memory
+ASSIGN_CHUNK_ROWS = 65536
+
+def _normalized(matrix, inv_norms):
+    return np.asarray(matrix, dtype=np.float32) * inv_norms[:, None]
+
+def _nearest_centroids(matrix, inv_norms, centroids):
+    """Index of the most similar centroid for every row, computed in chunks."""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_CHUNK_ROWS):
+        stop = start + ASSIGN_CHUNK_ROWS
+        block = _normalized(matrix[start:stop], inv_norms[start:stop])
+        assignments[start:stop] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def default_n_lists(count):
+    """Rule of thumb: about 4 * sqrt(n) lists."""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+def train_centroids(matrix, inv_norms, n_lists, iterations=10, sample_size=None, seed=0):
+    """Spherical k-means on a sample of the normalized rows."""
+    rng = np.random.default_rng(seed)
+    count = len(matrix)
+    if sample_size is None:
+        sample_size = min(count, max(n_lists * 64, 10000))
+
+    sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+    sample = _normalized(matrix[sample_rows], inv_norms[sample_rows])
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+
+        # New centroid = normalized mean of its members
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1)
+
+        # Re-seed empty clusters from random sample rows
+        empty = norms == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / np.maximum(norms, 1e-12)[:, None]
+
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """Cluster centroids plus, per cluster, the rows assigned to it."""
+
+    def __init__(self, centroids, list_offsets, list_rows, fingerprint=""):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.fingerprint = fingerprint
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, inv_norms, n_lists=None, iterations=10, sample_size=None, seed=0, fingerprint=""):
+        """Train centroids and assign every row to its nearest one."""
+        if n_lists is None or n_lists <= 0:
+            n_lists = default_n_lists(len(matrix))
+        n_lists = min(n_lists, len(matrix))
+
+        centroids = train_centroids(matrix, inv_norms, n_lists, iterations, sample_size, seed)
+        assignments = _nearest_centroids(matrix, inv_norms, centroids)
+
+        # Rows grouped by list, with offsets into the grouped array (CSR layout)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=n_lists)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        return cls(centroids, list_offsets, list_rows, fingerprint)
+
+    def candidates(self, query, nprobe):
+        """Rows in the nprobe clusters closest to a normalized query."""
+        nprobe = min(nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.n_lists)
+
+        return np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+
+    def save(self, path):
+        """Write the index to an .npz file."""
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+                fingerprint=np.array(self.fingerprint),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()."""
+        with np.load(path) as data:
+            return cls(
+                data["centroids"],
+                data["list_offsets"],
+                data["list_rows"],
+                str(data["fingerprint"]),
+            )
@@ -0,0 +1,210 @@
+"""
+Answer cache
+------------
+Persistent cache of generated answers in SQLite, in two tiers:
+  exact     the normalized question was already answered against the same
+            index version with the same retrieval settings
+  semantic  a different question retrieved exactly the same context and its
+            embedding is within ANSWER_CACHE_THRESHOLD (cosine) of a cached one
+
+Entries expire after ANSWER_CACHE_TTL seconds and the least recently used are
+evicted past ANSWER_CACHE_MAX_ENTRIES. Any write to an index changes its
+version, so answers are never served from stale context.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_PATH,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_THRESHOLD,
+)
+
+def normalize_question(question):
+    """Canonical form of a question: NFKC, lowercase, single spaces, no trailing punctuation."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        part = part.encode("utf-8")
+        # Length-prefix each part so boundaries are unambiguous
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+def answer_scope(mode, filters=None, top_k=5, model_name="", settings=None):
+    """Retrieval and generation settings an answer depends on besides the question.
+
+    With the index version they determine the retrieved context, which is what lets the
+    exact tier answer before retrieval: settings holds whatever else changes the ranking
+    or the packed prompt (scoring store, ANN probes, re-ranking, context budget).
+    """
+    filters = {key: value for key, value in (filters or {}).items() if value is not None}
+    return json.dumps({"mode": mode, "filters": filters, "top_k": top_k, "model": model_name,
+                       "settings": settings or {}}, sort_keys=True, default=list)
+
+def context_fingerprint(matches):
+    """Hash of the retrieved items, in prompt order."""
+    return _digest(*(f"{match.get('document', '')}/{match['id']}" for match in matches))
+
+class AnswerCache:
+    """SQLite-backed answer store with exact and semantic lookup, TTL and LRU eviction."""
+
+    def __init__(self, path=ANSWER_CACHE_PATH, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 threshold=ANSWER_CACHE_THRESHOLD):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, context_key TEXT NOT NULL, embedding BLOB, record TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_created ON answers (created)")
+        self._conn.commit()
+
+    def _expire(self, now):
+        if self.ttl > 0:
+            removed = self._conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,)).rowcount
+            self.expirations += removed
+
+    def _touch(self, key, now):
+        self._conn.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._conn.commit()
+
+    def get_exact(self, index_version, scope, question):
+        """Return the cached record for the same normalized question, or None."""
+        key = _digest(index_version, scope, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            row = self._conn.execute("SELECT record FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.exact_hits += 1
+            self._touch(key, now)
+        return json.loads(row[0])
+
+    def get_similar(self, index_version, scope, context, embedding):
+        """Return the record of the closest question with the same retrieved context, or None.
+
+        Counts a miss when nothing is close enough (or there is no embedding, e.g. lexical search).
+        """
+        if embedding is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        context_key = _digest(index_version, scope, context)
+        with self._lock:
+            self._expire(time.time())
+            rows = self._conn.execute(
+                "SELECT key, embedding, record FROM answers WHERE context_key = ? AND embedding IS NOT NULL",
+                (context_key,)
+            ).fetchall()
+            if rows and query_norm > 0:
+                vectors = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                # Stored embeddings are normalized
+                similarities = vectors @ (query / query_norm)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.semantic_hits += 1
+                    self._touch(rows[best][0], time.time())
+                    record = json.loads(rows[best][2])
+                    record["question_similarity"] = float(similarities[best])
+                    return record
+            self.misses += 1
+        return None
+
+    def put(self, index_version, scope, question, context, embedding, record):
+        """Store an answer record, evicting the least recently used entries over budget."""
+        key = _digest(index_version, scope, normalize_question(question))
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = (vector / norm if norm > 0 else vector).tobytes()
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, context_key, embedding, record, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, _digest(index_version, scope, context), vector, json.dumps(record), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self.evictions += excess
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def stats(self):
+        """Return this process's hit/miss counters per tier, plus usage and lifetime hits of stored answers."""
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        with self._lock:
+            entries, stored_hits = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers").fetchone()
+        return {
+            "entries": entries,
+            "stored_hits": stored_hits,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """Return the shared answer cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
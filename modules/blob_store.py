@@ -0,0 +1,217 @@
+"""
+Blob store
+----------
+Image bytes of a document packed into one append-only data file,
+BLOB_DIR/<document>.blob, with an offset table next to it,
+BLOB_DIR/<document>.offsets, holding one "sha256<TAB>offset<TAB>length" line
+per blob. Bytes are written before their line, so an interrupted write
+leaves at most unreferenced bytes at the end of the data file.
+
+Blobs are keyed by the sha256 of their bytes and items point at them with an
+immutable reference, "blob:<document>/<sha256>", stored in item["path"]: ingesting
+a document of the same name again (into this index or another one) appends new
+blobs under new keys and never changes the bytes behind an existing reference.
+Identical images are stored once. Items expose an ImageHandle as item["image"].
+Reads return zero-copy memoryview slices of a memory map of the data file.
+References keyed by item id, written by earlier versions, still resolve through
+their "key<TAB>offset<TAB>length<TAB>sha256" table lines (the last line of a key wins). Paths that are not references
+belong to the one-file-per-image layout of older indexes and are read from disk
+as before.
+"""
+import hashlib
+import mmap
+import os
+import re
+import threading
+
+from config import BLOB_DIR
+
+BLOB_SCHEME = "blob:"
+
+def blob_ref(document_id, key):
+    """Reference to a blob (its key being the sha256 of its bytes), stored in item["path"]."""
+    return f"{BLOB_SCHEME}{document_id}/{key}"
+
+def is_blob_ref(path):
+    return path.startswith(BLOB_SCHEME)
+
+def _split_ref(ref):
+    document_id, _, key = ref[len(BLOB_SCHEME):].rpartition("/")
+    return document_id, key
+
+def blob_paths(document_id, blob_dir=BLOB_DIR):
+    """(data file, offset table) of a document."""
+    stem = re.sub(r"[^A-Za-z0-9_.-]", "_", document_id) or "document"
+    return os.path.join(blob_dir, f"{stem}.blob"), os.path.join(blob_dir, f"{stem}.offsets")
+
+def _parse_table(text, table):
+    """Add the complete lines of an offset table to table. Returns the length parsed."""
+    parsed = 0
+    for line in text.splitlines(keepends=True):
+        # A line without its newline is still being written
+        if not line.endswith("\n"):
+            break
+        parsed += len(line.encode("utf-8"))
+        fields = line.rstrip("\n").split("\t")
+        key, offset, length = fields[:3]
+        # Blobs keyed by their sha256 have no separate digest column
+        table[key] = (int(offset), int(length), fields[3] if len(fields) > 3 else key)
+    return parsed
+
+class BlobWriter:
+    """Appends the blobs of one document; a blob already stored (same sha256) is not rewritten."""
+
+    def __init__(self, document_id, blob_dir=BLOB_DIR):
+        os.makedirs(blob_dir, exist_ok=True)
+        self.document_id = document_id
+        self.data_path, self.table_path = blob_paths(document_id, blob_dir)
+        self.table = {}
+        if os.path.isfile(self.table_path):
+            with open(self.table_path, "r", encoding="utf-8") as f:
+                _parse_table(f.read(), self.table)
+        self._data = open(self.data_path, "ab")
+        self._offsets = open(self.table_path, "a", encoding="utf-8")
+        self.written = 0
+        self.reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def put(self, data):
+        """Store the bytes of a blob and return its reference, keyed by their sha256."""
+        digest = hashlib.sha256(data).hexdigest()
+        entry = self.table.get(digest)
+        if entry is not None and entry[1] == len(data):
+            self.reused += 1
+            return blob_ref(self.document_id, digest)
+
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(data)
+        # The bytes must be readable before the table points at them
+        self._data.flush()
+        self._offsets.write(f"{digest}\t{offset}\t{len(data)}\n")
+        self._offsets.flush()
+        self.table[digest] = (offset, len(data), digest)
+        self.written += 1
+        return blob_ref(self.document_id, digest)
+
+    def close(self):
+        """Make the document's blobs durable, one fsync per file."""
+        if self._data.closed:
+            return
+        for f in (self._data, self._offsets):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+class BlobReader:
+    """Memory-mapped reads of one document's blobs, following appends made after opening."""
+
+    def __init__(self, data_path, table_path):
+        self.data_path = data_path
+        self.table_path = table_path
+        self._table = {}
+        self._table_state = None
+        self._parsed = 0
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        stat = os.stat(self.table_path)
+        state = (stat.st_ino, stat.st_size)
+        if state == self._table_state:
+            return
+        if self._table_state is None or stat.st_ino != self._table_state[0] or stat.st_size < self._parsed:
+            # First read, or the files were replaced
+            self._table, self._parsed, self._map = {}, 0, None
+        with open(self.table_path, "rb") as f:
+            f.seek(self._parsed)
+            self._parsed += _parse_table(f.read().decode("utf-8"), self._table)
+        self._table_state = state
+
+    def entry(self, key):
+        """(offset, length, sha256) of a blob."""
+        with self._lock:
+            self._refresh()
+            return self._table[key]
+
+    def read(self, key):
+        """Return a blob as a memoryview of the mapped data file."""
+        with self._lock:
+            self._refresh()
+            offset, length, _ = self._table[key]
+            if self._map is None or offset + length > len(self._map):
+                # The file grew since it was mapped; views of the old map stay valid
+                with open(self.data_path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._map)[offset:offset + length]
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+def get_reader(document_id, blob_dir=BLOB_DIR):
+    """Return the shared reader of a document's blobs."""
+    paths = blob_paths(document_id, blob_dir)
+    with _readers_lock:
+        reader = _readers.get(paths)
+        if reader is None:
+            reader = _readers[paths] = BlobReader(*paths)
+        return reader
+
+def read_blob(ref, blob_dir=BLOB_DIR):
+    """Bytes of a blob reference, as a zero-copy memoryview."""
+    document_id, key = _split_ref(ref)
+    try:
+        return get_reader(document_id, blob_dir).read(key)
+    except (KeyError, FileNotFoundError):
+        raise FileNotFoundError(f"No blob {ref}") from None
+
+def blob_version(ref, blob_dir=BLOB_DIR):
+    """Identifies the bytes of a reference: its (offset, length, sha256)."""
+    document_id, key = _split_ref(ref)
+    return get_reader(document_id, blob_dir).entry(key)
+
+def read_file(path):
+    """Legacy reader for the one-file-per-image layout."""
+    with open(path, "rb") as f:
+        return f.read()
+
+def read_image(path):
+    """Bytes of an image item's path: a memoryview for blob references, bytes for legacy files."""
+    return read_blob(path) if is_blob_ref(path) else read_file(path)
+
+class ImageHandle:
+    """Lazy handle to an image's bytes. Nothing is read until read(); bytes are copied
+    (and base64 encoded by the SDK) only when an API request is built."""
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """The image bytes: a memoryview for blob references, bytes for legacy files."""
+        return read_image(self.path)
+
+    @property
+    def nbytes(self):
+        """Size of the image without reading it."""
+        if is_blob_ref(self.path):
+            return blob_version(self.path)[1]
+        return os.path.getsize(self.path)
+
+    def __eq__(self, other):
+        return isinstance(other, ImageHandle) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"ImageHandle({self.path!r})"
+
+def image_handle(item):
+    """The image handle of an image item, also for items created before handles existed."""
+    return item.get("image") or ImageHandle(item["path"])
@@ -0,0 +1,211 @@
+"""
+Text chunking
+-------------
+Single-pass chunker working on offsets into the text: a chunk is a (start, end)
+span, sliced once, never built up by concatenation. Budgets are counted in
+characters or in tokens (runs of word characters and single punctuation marks,
+an approximation of model tokens); every chunk also stays within max_chars, the
+limit of the embedding API.
+
+A chunk ends at the last paragraph break within its budget, else the last
+sentence end, else the last space, preferably not in the first half of the
+budget. Only a single word longer than the budget is cut. The next chunk starts `overlap`
+units before the end, moved forward to the start of a word, so consecutive
+chunks share exactly text[next_start:end] and never more than the overlap.
+
+Breaks are only looked for inside the window of the chunk being built, with
+one str.rfind() per kind of break in a copy of the text where sentence ends and
+spaces are normalized. In tokens mode the text is tokenized once up front and the
+token budget and the overlap are found by bisecting the token offsets. The text
+is scanned about once (plus the overlap) and chunking is linear in its length. PageChunker feeds pages through the same engine so chunks can run
+across page breaks.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import numpy as np
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_UNIT, CHUNK_MAX_CHARS
+
+UNITS = ("chars", "tokens")
+
+_WORD_START = re.compile(r"\s\S")
+_NON_SPACE = re.compile(r"\S")
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_TOKEN_SPLIT = re.compile(r"(\w+|[^\w\s])")
+# Class of each ASCII character as _TOKEN sees it: 0 space, 1 word, 2 punctuation
+_ASCII_CLASSES = np.array([0 if re.match(r"\s", chr(c)) else 1 if re.match(r"\w", chr(c)) else 2
+                           for c in range(128)], dtype=np.uint8)
+
+# Pages are joined by a paragraph break when chunks span pages
+PAGE_SEPARATOR = "\n\n"
+
+def count_tokens(text):
+    """Number of tokens in a text, as counted by the token budget."""
+    return len(_TOKEN.findall(text))
+
+def _token_offsets(text):
+    """(starts, ends) of every token of a text, in order."""
+    if not text.isascii():
+        # split() alternates the text between tokens and the gaps around them, so
+        # the running total of the part lengths gives both offsets
+        bounds = list(accumulate(map(len, _TOKEN_SPLIT.split(text))))
+        return bounds[:-1:2], bounds[1::2]
+    # ASCII text is classified per character, several times faster than the regex
+    classes = _ASCII_CLASSES[np.frombuffer(text.encode("ascii"), dtype=np.uint8)]
+    word = classes == 1
+    punctuation = classes == 2
+    first = np.ones(len(text), dtype=bool)
+    first[1:] = ~word[:-1]
+    last = np.ones(len(text), dtype=bool)
+    last[:-1] = ~word[1:]
+    starts = np.flatnonzero(punctuation | (word & first)).astype(np.int64)
+    ends = np.flatnonzero(punctuation | (word & last)).astype(np.int64) + 1
+    # Bisected like lists, but built with one copy instead of an int object per token
+    return array("q", starts.tobytes()), array("q", ends.tobytes())
+
+_SPACED = str.maketrans("?!\n\t", "..  ")
+
+def _spaced(text):
+    """Copy of a text, with the same offsets, where every sentence end reads ". " and every space " "."""
+    # translate() is only fast on ASCII text
+    if text.isascii():
+        return text.translate(_SPACED)
+    return text.replace("?", ".").replace("!", ".").replace("\n", " ").replace("\t", " ")
+
+def chunk_spans(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT, max_chars=CHUNK_MAX_CHARS):
+    """Return the (start, end) offsets of the chunks of a text."""
+    if unit not in UNITS:
+        raise ValueError(f"Unknown chunk unit '{unit}', expected one of: {', '.join(UNITS)}")
+    if chunk_size < 1 or not 0 <= overlap < chunk_size:
+        raise ValueError("chunk_size must be positive and overlap smaller than chunk_size")
+
+    text_end = len(text.rstrip())
+    first = _NON_SPACE.search(text)
+    start = first.start() if first else text_end
+    spaced = _spaced(text)
+    tokens = unit == "tokens"
+    # Characters a chunk may hold before the token budget is counted
+    budget = max_chars or len(text)
+    if tokens:
+        token_starts, token_ends = _token_offsets(text)
+    else:
+        budget = min(budget, chunk_size)
+    # Bound methods, looked up once for the whole loop
+    find_paragraph, find_break, find_space = text.rfind, spaced.rfind, spaced.find
+    spans = []
+    add_span = spans.append
+    while start < text_end:
+        limit = start + budget if start + budget < text_end else text_end
+        if tokens:
+            # A chunk starts inside its first token (a word cut by max_chars counts as one)
+            last = bisect_right(token_starts, start) + chunk_size - 2
+            if last < len(token_ends) and token_ends[last] <= limit:
+                limit = token_ends[last]
+            else:
+                # Fewer tokens fit: end with the last one starting before the limit, cut at it
+                last = bisect_left(token_starts, limit) - 1
+                if token_ends[last] < limit:
+                    limit = token_ends[last]
+
+        if limit >= text_end:
+            end = text_end
+        else:
+            # The last paragraph break, else sentence end, else space, in the second half of
+            # the budget; the last space of the first half before cutting a word
+            floor = start + (limit - start) // 2
+            end = find_paragraph("\n\n", floor + 1, limit + 2)
+            if end <= floor:
+                end = find_break(". ", floor, limit + 1) + 1
+                if end <= floor:
+                    end = find_break(" ", start + 1, limit + 1)
+            if end > start:
+                while end > start + 1 and text[end - 1].isspace():
+                    end -= 1
+            else:
+                end = limit
+        add_span((start, end))
+        if end >= text_end:
+            break
+
+        # Step back by the overlap, then forward to a word start so no word is split
+        if not tokens:
+            back = end - overlap
+        elif overlap:
+            # The start of the overlap-th token back from the end, a cut word counting as one;
+            # all of a chunk shorter than the overlap
+            first = bisect_left(token_starts, end) - overlap
+            back = token_starts[first] if first >= 0 and token_starts[first] > start else start
+        else:
+            back = end
+        low = back - 1 if back > start else start
+        space = find_space(" ", low, end - 1)
+        if space >= 0 and not text[space + 1].isspace():
+            start = space + 1
+        elif word := _WORD_START.search(text, low, end):
+            # After a run of spaces, or other whitespace
+            start = word.start() + 1
+        elif text[end].isspace():
+            start = _NON_SPACE.search(text, end).start()
+        else:
+            # A word longer than the budget was cut, continue right after the cut
+            start = end
+    return spans
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT, max_chars=CHUNK_MAX_CHARS):
+    """Split text into overlapping chunks within a character or token budget."""
+    return [text[start:end] for start, end in chunk_spans(text, chunk_size, overlap, unit, max_chars)]
+
+class PageChunker:
+    """Chunks pages fed in order as one text, so a chunk can run from one page into the next.
+
+    A chunk belongs to the page it starts on. Only the unfinished tail (the last
+    chunk, which more text could extend) is kept and re-chunked with the next page.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, unit=CHUNK_UNIT, max_chars=CHUNK_MAX_CHARS):
+        self.params = (chunk_size, overlap, unit, max_chars)
+        self._text = ""
+        self._page_offsets = []
+        self._page_numbers = []
+        self._counts = {}
+
+    def _page_of(self, offset):
+        return self._page_numbers[bisect_right(self._page_offsets, offset) - 1]
+
+    def _emit(self, spans):
+        chunks = []
+        for start, end in spans:
+            page_num = self._page_of(start)
+            index = self._counts.get(page_num, 0)
+            self._counts[page_num] = index + 1
+            chunks.append((page_num, index, self._text[start:end]))
+        return chunks
+
+    def feed(self, page_num, text):
+        """Add a page and return the (page, index, text) chunks that are complete."""
+        if self._text:
+            self._text += PAGE_SEPARATOR
+        self._page_offsets.append(len(self._text))
+        self._page_numbers.append(page_num)
+        self._text += text
+
+        spans = chunk_spans(self._text, *self.params)
+        if len(spans) < 2:
+            return []
+        chunks = self._emit(spans[:-1])
+
+        # Keep the text from the last chunk on, with the pages it touches
+        tail = spans[-1][0]
+        first_page = bisect_right(self._page_offsets, tail) - 1
+        self._page_offsets = [max(offset - tail, 0) for offset in self._page_offsets[first_page:]]
+        self._page_numbers = self._page_numbers[first_page:]
+        self._text = self._text[tail:]
+        return chunks
+
+    def finish(self):
+        """Return the remaining chunks."""
+        chunks = self._emit(chunk_spans(self._text, *self.params))
+        self._text, self._page_offsets, self._page_numbers = "", [], []
+        return chunks
@@ -0,0 +1,235 @@
+"""
+Context packing
+---------------
+Turns retrieved matches into the context sent to the model:
+  merge     chunks of the same page that are consecutive or overlap (chunk_text
+            carries the last words of a chunk into the next) become one passage
+  dedupe    passages whose word shingles are mostly contained in a higher ranked
+            passage are dropped, as are repeated images
+  budget    passages are added in rank order until CONTEXT_MAX_CHARS is reached,
+            the one that crosses it is cut at a sentence or word boundary
+  images    are downsized to CONTEXT_IMAGE_MAX_PIXELS and re-encoded
+
+The stats of a packed context report the prompt size before and after packing.
+"""
+import hashlib
+import re
+
+from config import (
+    CONTEXT_MAX_CHARS,
+    CONTEXT_MAX_TOKENS,
+    CONTEXT_DEDUPE_THRESHOLD,
+    CONTEXT_IMAGE_MAX_PIXELS,
+)
+from modules.blob_store import image_handle
+from modules.index_cache import get_image_bytes, get_prompt_image
+
+# Rough size of a token, for budgets and reports
+CHARS_PER_TOKEN = 4
+
+# Chunks are named text_<page>_<position>
+_CHUNK_ID = re.compile(r"^text_(\d+)_(\d+)$")
+_WORD = re.compile(r"\S+")
+
+# Carry-over between chunks that is looked for, in words (shorter repeats are coincidence)
+_MAX_OVERLAP_WORDS = 64
+_MIN_OVERLAP_WORDS = 3
+
+# A passage cut shorter than this is left out instead
+_MIN_TRUNCATED_CHARS = 200
+
+def source_label(match):
+    """Describe where a match comes from, e.g. "page 3 of paper"."""
+    if match.get("document"):
+        return f"page {match['page']+1} of {match['document']}"
+    return f"page {match['page']+1}"
+
+def estimate_tokens(chars):
+    """Approximate token count of a text of the given length."""
+    return -(-chars // CHARS_PER_TOKEN)
+
+def _chunk_position(item_id):
+    match = _CHUNK_ID.match(item_id)
+    return int(match.group(2)) if match else None
+
+def _overlap_end(previous, text):
+    """Offset in text just past the words it repeats from the end of previous, or 0."""
+    previous_words = previous.split()[-_MAX_OVERLAP_WORDS:]
+    words = list(_WORD.finditer(text[:len(" ".join(previous_words)) * 2 + 1]))
+    for count in range(min(len(previous_words), len(words)), _MIN_OVERLAP_WORDS - 1, -1):
+        if [word.group() for word in words[:count]] == previous_words[-count:]:
+            return words[count - 1].end()
+    return 0
+
+def _merge_run(texts):
+    """Join consecutive chunks, dropping the words each one repeats from the previous."""
+    merged = texts[0]
+    for text in texts[1:]:
+        end = _overlap_end(merged, text)
+        rest = text[end:].lstrip()
+        if rest:
+            merged += ("\n\n" if end == 0 else " ") + rest
+    return merged
+
+def _shingles(text, size=3):
+    words = text.lower().split()
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _truncate(text, limit):
+    """Cut text to at most limit characters, at the last sentence end or else word break."""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    sentence = max(cut.rfind(". "), cut.rfind(".\n"))
+    if sentence >= limit // 2:
+        return cut[:sentence + 1]
+    cut = text[:limit - 4]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + " ..."
+
+def merge_passages(text_matches):
+    """Group text matches into passages, merging consecutive or overlapping chunks of a page.
+
+    Passages keep the rank of their best match; each is a dict with "document", "page",
+    "ids", "similarity" and "text".
+    """
+    groups = {}
+    for rank, match in enumerate(text_matches):
+        key = (match.get("document"), match["page"])
+        groups.setdefault(key, []).append((rank, match))
+
+    passages = []
+    for (document, page), members in groups.items():
+        members.sort(key=lambda member: (_chunk_position(member[1]["id"]) is None,
+                                         _chunk_position(member[1]["id"]) or 0, member[0]))
+        runs = [[members[0]]]
+        for member in members[1:]:
+            last = runs[-1][-1][1]
+            previous_position, position = _chunk_position(last["id"]), _chunk_position(member[1]["id"])
+            consecutive = previous_position is not None and position == previous_position + 1
+            if consecutive or _overlap_end(last["content"], member[1]["content"]):
+                runs[-1].append(member)
+            else:
+                runs.append([member])
+
+        for run in runs:
+            best_rank, best = min(run, key=lambda member: member[0])
+            passages.append({
+                "rank": best_rank,
+                "document": document,
+                "page": page,
+                "ids": [match["id"] for _, match in run],
+                "similarity": best.get("similarity"),
+                "text": _merge_run([match["content"] for _, match in run]),
+            })
+
+    passages.sort(key=lambda passage: passage["rank"])
+    return passages
+
+def dedupe_passages(passages, threshold=CONTEXT_DEDUPE_THRESHOLD):
+    """Drop passages whose shingles are at least threshold contained in a higher ranked passage.
+
+    Only the passage being checked is measured: a longer passage that contains a
+    higher ranked short one adds text and is kept.
+    """
+    kept, kept_shingles = [], []
+    for passage in passages:
+        shingles = _shingles(passage["text"])
+        duplicate = any(
+            len(shingles & other) >= threshold * len(shingles)
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+def pack_context(top_matches, max_chars=CONTEXT_MAX_CHARS, max_tokens=CONTEXT_MAX_TOKENS,
+                 dedupe_threshold=CONTEXT_DEDUPE_THRESHOLD, image_max_pixels=CONTEXT_IMAGE_MAX_PIXELS):
+    """Build the prompt context of retrieved matches.
+
+    Returns {"text_context", "passages", "images", "stats"}: images are
+    {"path", "page", "data", "mime_type"} dicts ready to send, stats the prompt size
+    (characters, approximate tokens, image bytes) before and after packing.
+    """
+    if max_tokens:
+        max_chars = min(max_chars, max_tokens * CHARS_PER_TOKEN) if max_chars else max_tokens * CHARS_PER_TOKEN
+
+    text_matches = [match for match in top_matches if match["type"] == "text"]
+    image_matches = [match for match in top_matches if match["type"] == "image"]
+
+    # Size of the context as it was built before packing: every chunk in full
+    chars_before = len("\n\n".join(
+        f"[Content from {source_label(match)}]\n{match['content']}" for match in text_matches
+    ))
+
+    merged = merge_passages(text_matches)
+    passages = dedupe_passages(merged, dedupe_threshold)
+
+    blocks = []
+    used = 0
+    truncated = 0
+    kept = []
+    for passage in passages:
+        block = f"[Content from {source_label(passage)}]\n{passage['text']}"
+        separator = 2 if blocks else 0
+        remaining = max_chars - used - separator if max_chars else len(block)
+        if len(block) > remaining:
+            if remaining < _MIN_TRUNCATED_CHARS and blocks:
+                break
+            block = _truncate(block, remaining)
+            truncated += 1
+        blocks.append(block)
+        kept.append(passage)
+        used += separator + len(block)
+        if truncated:
+            break
+    text_context = "\n\n".join(blocks)
+
+    images = []
+    seen = set()
+    image_bytes_before = 0
+    for match in image_matches:
+        handle = image_handle(match)
+        try:
+            original = get_image_bytes(handle)
+            image_bytes_before += len(original)
+            digest = hashlib.sha256(original).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            # Downsized bytes of often retrieved images come from an LRU; they are only copied at the API call
+            data, mime_type = get_prompt_image(handle, image_max_pixels)
+            images.append({"path": handle.path, "page": match["page"] + 1, "data": data, "mime_type": mime_type})
+        except Exception as e:
+            print(f"Error loading image {handle.path}: {e}")
+
+    stats = {
+        "chunks": len(text_matches),
+        "passages": len(kept),
+        "merged": len(text_matches) - len(merged),
+        "duplicates": len(merged) - len(passages),
+        "truncated": truncated,
+        "dropped": len(passages) - len(kept),
+        "chars_before": chars_before,
+        "chars_after": len(text_context),
+        "tokens_before": estimate_tokens(chars_before),
+        "tokens_after": estimate_tokens(len(text_context)),
+        "images_before": len(image_matches),
+        "images_after": len(images),
+        "image_bytes_before": image_bytes_before,
+        "image_bytes_after": sum(len(image["data"]) for image in images),
+    }
+    return {"text_context": text_context, "passages": kept, "images": images, "stats": stats}
+
+def describe_context_stats(stats):
+    """One-line summary of how much packing shrank a prompt."""
+    line = (f"Context: {stats['chunks']} chunks -> {stats['passages']} passages, "
+            f"{stats['chars_before']:,} -> {stats['chars_after']:,} chars "
+            f"(~{stats['tokens_before']:,} -> ~{stats['tokens_after']:,} tokens)")
+    if stats["images_before"]:
+        line += (f", {stats['images_before']} -> {stats['images_after']} images, "
+                 f"{stats['image_bytes_before'] / 1024:,.0f} -> {stats['image_bytes_after'] / 1024:,.0f} KB")
+    return line
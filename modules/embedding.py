@@ -1,48 +1,146 @@
 import numpy as np
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from tqdm import tqdm
 from vertexai.vision_models import Image as VertexImage
-from vertexai.vision_models import MultiModalEmbeddingModel
 
-def create_embeddings(items):
-    """Generate embeddings for all items using Google's multimodal embedding model."""
-    print("Generating embeddings...")
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_DIM,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_RATE_LIMIT,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_CACHE_ENABLED,
+)
+from modules.models import get_embedding_model
+from modules.embedding_cache import embedding_key, get_embedding_cache
+from modules.blob_store import image_handle
+from utils.concurrency import retry_call, shared_limiter
+
+def embedding_request(item):
+    """Return the (payload, context) an item is embedded from."""
+    if item["type"] == "text":
+        return item["content"], ""
+
+    elif item["type"] == "image":
+        # Read lazily: a memoryview of the blob store, or the file of a legacy per-file layout
+        image_bytes = image_handle(item).read()
+
+        # The figure caption found by layout extraction, else the page, for better relevance
+        context = item.get("caption") or f"Image from page {item['page']+1} of the document"
+        return image_bytes, context
 
-    # Load the embedding model
-    model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-    embedding_dim = 1408  # Standard dimension for this model
+    raise ValueError(f"Unknown item type: {item['type']}")
 
-    # Process each item
-    for item in tqdm(items, desc="Embedding items"):
+def embed_item(model, item, payload, context, embedding_dim=EMBEDDING_DIM):
+    """Generate the embedding of a single text or image item."""
+    if item["type"] == "text":
+        # Generate text embedding
+        result = model.get_embeddings(
+            image=None,
+            contextual_text=payload,
+            dimension=embedding_dim
+        )
+        return np.array(result.text_embedding)
+
+    # Generate image embedding
+    result = model.get_embeddings(
+        image=VertexImage(image_bytes=payload),
+        contextual_text=context,
+        dimension=embedding_dim
+    )
+    return np.array(result.image_embedding)
+
+def _resolve_cache(cache):
+    """Use the shared cache by default, or none when cache=False."""
+    if cache is None:
+        return get_embedding_cache() if EMBEDDING_CACHE_ENABLED else None
+    if cache is False:
+        return None
+    return cache
+
+def iter_embeddings(items, concurrency=EMBEDDING_CONCURRENCY, rate_limit=EMBEDDING_RATE_LIMIT,
+                    max_retries=EMBEDDING_MAX_RETRIES, model=None, cache=None):
+    """Embed items on a thread pool, yielding them in input order with "embedding" set (None on failure)."""
+    if model is None:
+        model = get_embedding_model()
+    cache = _resolve_cache(cache)
+    limiter = shared_limiter("embedding", rate_limit)
+
+    def embed(item):
         try:
-            if item["type"] == "text":
-                # Generate text embedding
-                result = model.get_embeddings(
-                    image=None,
-                    contextual_text=item["content"],
-                    dimension=embedding_dim
-                )
-                item["embedding"] = np.array(result.text_embedding)
-
-            elif item["type"] == "image":
-                # Generate image embedding
-                img = VertexImage.load_from_file(item["path"])
-
-                # Use page context for better relevance
-                context = f"Image from page {item['page']+1} of the document"
-
-                result = model.get_embeddings(
-                    image=img,
-                    contextual_text=context,
-                    dimension=embedding_dim
-                )
-                item["embedding"] = np.array(result.image_embedding)
+            payload, context = embedding_request(item)
+
+            # A cache hit skips the API call entirely
+            key = None
+            if cache is not None:
+                key = embedding_key(EMBEDDING_MODEL, EMBEDDING_DIM, item["type"], payload, context)
+                embedding = cache.get(key)
+                if embedding is not None:
+                    item["embedding"] = embedding
+                    return item
 
+            item["embedding"] = retry_call(
+                lambda: embed_item(model, item, payload, context),
+                max_retries=max_retries,
+                limiter=limiter
+            )
+            if cache is not None:
+                cache.put(key, item["embedding"])
         except Exception as e:
             print(f"Error generating embedding for {item['id']}: {e}")
             item["embedding"] = None
+        return item
+
+    # Duplicate images reuse the embedding of the image they refer to, which comes first
+    image_embeddings = {}
+
+    def finish(item):
+        if "duplicate_of" in item:
+            item["embedding"] = image_embeddings.get(item["duplicate_of"])
+        elif item["type"] == "image" and item.get("embedding") is not None:
+            image_embeddings[item["id"]] = item["embedding"]
+        return item
+
+    # Keep a bounded number of calls in flight so items can be streamed in
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            if "duplicate_of" in item:
+                # No API call, resolved when its turn comes
+                future = Future()
+                future.set_result(item)
+            else:
+                future = executor.submit(embed, item)
+            pending.append(future)
+            if len(pending) >= concurrency * 2:
+                yield finish(pending.popleft().result())
+
+        while pending:
+            yield finish(pending.popleft().result())
+
+def create_embeddings(items, concurrency=EMBEDDING_CONCURRENCY, rate_limit=EMBEDDING_RATE_LIMIT, cache=None):
+    """Generate embeddings for all items using Google's multimodal embedding model."""
+    print("Generating embeddings...")
+    cache = _resolve_cache(cache)
+    if cache is not None:
+        hits_before, misses_before = cache.hits, cache.misses
+
+    # Process items concurrently, results come back in order
+    # Pass the resolved cache on, False (not None, which means the shared cache) when caching is off
+    embedded = iter_embeddings(items, concurrency=concurrency, rate_limit=rate_limit,
+                               cache=cache if cache is not None else False)
+    for _ in tqdm(embedded, total=len(items), desc="Embedding items"):
+        pass
+
+    reused = sum(1 for item in items if "duplicate_of" in item)
+    if reused:
+        print(f"Reused {reused} embeddings of duplicate images")
 
     # Keep only items with valid embeddings
     valid_items = [item for item in items if item.get("embedding") is not None]
     print(f"Successfully embedded {len(valid_items)} out of {len(items)} items")
+    if cache is not None:
+        print(f"Embedding cache: {cache.hits - hits_before} hits, {cache.misses - misses_before} misses")
 
-    return valid_items
\ No newline at end of file
+    return valid_items
@@ -0,0 +1,150 @@
+"""
+Embedding cache
+---------------
+Persistent, content-addressed cache of embeddings in SQLite. Entries are keyed
+by a hash of the model, dimension, item type, payload (chunk text or image
+bytes) and context string, so re-ingesting unchanged content never calls the
+embedding API again.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES
+
+# Hits whose last_used update is held back; written together on put, close or past this many
+TOUCH_BATCH = 1024
+
+def embedding_key(model_name, dimension, item_type, payload, context=""):
+    """Content hash identifying one embedding request."""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
+    digest = hashlib.sha256()
+    for part in (model_name.encode("utf-8"), str(dimension).encode("utf-8"),
+                 item_type.encode("utf-8"), payload, context.encode("utf-8")):
+        # Length-prefix each part so boundaries are unambiguous
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.hexdigest()
+
+class EmbeddingCache:
+    """SQLite-backed embedding store with least-recently-used eviction."""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        # key -> time of the last hit not yet written
+        self._touched = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get(self, key):
+        """Return a cached embedding, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # A hit only reorders eviction, it is not worth a write and a commit of its own
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_BATCH:
+                self._flush_touched()
+                self._conn.commit()
+
+        return np.frombuffer(row[0], dtype=np.float32).copy()
+
+    def put(self, key, embedding):
+        """Store an embedding, evicting the least recently used entries over budget."""
+        vector = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            # Eviction below must see the latest hits
+            self._flush_touched()
+            old = self._conn.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, vector, len(vector), time.time())
+            )
+            self.total_bytes += len(vector)
+            self._evict()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self):
+        """Write the last_used times of pending hits."""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.evictions += 1
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """Return the shared embedding cache, opening it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
@@ -1,151 +1,250 @@
 import os
+import re
 import pymupdf
-import base64
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 
-from config import TEXT_DIR, IMAGE_DIR
+from config import (
+    EXTRACTION_WORKERS,
+    EXTRACTION_PAGES_PER_TASK,
+    CHUNK_MAX_CHARS,
+    CHUNK_SPAN_PAGES,
+    EXTRACTION_MODE,
+)
+from modules.blob_store import BlobWriter, ImageHandle
+from modules.chunking import chunk_text, PageChunker
+from modules.item_store import IMAGE_PLACEHOLDER
+from modules.image_filter import ImageFilter, large_enough_dimensions, image_hashes, format_filter_stats
+from modules.layout import page_blocks, blocks_text, chunk_blocks, image_bboxes, image_captions
 
-def extract_from_pdf(pdf_path):
-    """Extract text and images from PDF."""
-    print(f"Processing PDF: {pdf_path}")
-    doc = pymupdf.open(pdf_path)
+def document_id_for(pdf_path):
+    """Default document id: the PDF file name without extension, safe for paths."""
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name) or "document"
+
+EXTRACTION_MODES = ("layout", "plain")
+
+# Item carrying a page's whole text from extract_page to the PageChunker, when chunks span pages
+PAGE_TEXT = "page_text"
+
+def text_item(page_num, i, chunk, document_id, bbox=None):
+    """Item of a text chunk, or None for a chunk with (almost) no text."""
+    if len(chunk.strip()) <= 10:  # Skip empty chunks
+        return None
+    # The text is stored inline in the index, no file is needed
+    item = {
+        "id": f"text_{page_num}_{i}",
+        "type": "text",
+        "content": chunk,
+        "page": page_num,
+        "path": "",
+        "document": document_id
+    }
+    if bbox is not None:
+        item["bbox"] = bbox
+    return item
+
+def extract_page(doc, page, page_num, document_id, span_pages=CHUNK_SPAN_PAGES, mode=EXTRACTION_MODE,
+                 min_size=None, hash_images=False):
+    """Extract text chunks and images from a single page.
 
+    Nothing is written to disk here: image items carry their bytes in "data" until
+    store_images() moves them to the document's blob store and gives them an "image" handle.
+    With span_pages the page text is returned whole, as a PAGE_TEXT item, for chunk_pages().
+    In layout mode items also get a "bbox" and images the "caption" of their figure.
+    Images under min_size (width, height) are left for the filter without extracting
+    their bytes; hash_images adds the perceptual hashes it compares (ImageFilter.extract_options).
+    """
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode '{mode}', expected one of: {', '.join(EXTRACTION_MODES)}")
     items = []
+    layout = mode == "layout"
 
-    # Process each page
-    for page_num, page in enumerate(tqdm(doc, desc="Processing pages")):
-        # Extract text
+    # Extract text
+    if layout:
+        blocks = page_blocks(page)
+        bboxes = image_bboxes(page)
+        captions = image_captions(page, blocks, bboxes)
+        text = blocks_text(blocks)
+    else:
         text = page.get_text()
 
-        # Chunk the text
-        chunks = chunk_text(text)
-
-        for i, chunk in enumerate(chunks):
-            if len(chunk.strip()) > 10:  # Skip empty chunks
-                item_id = f"text_{page_num}_{i}"
-                file_path = os.path.join(TEXT_DIR, f"{item_id}.txt")
-
-                # Save to file
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(chunk)
-
-                items.append({
-                    "id": item_id,
-                    "type": "text",
-                    "content": chunk,
-                    "page": page_num,
-                    "path": file_path
-                })
-
-        # Extract images
-        images = page.get_images(full=True)
-
-        for i, img_info in enumerate(images):
-            xref = img_info[0]
-
-            try:
-                # Extract image
-                base_img = doc.extract_image(xref)
-
-                if base_img:
-                    item_id = f"image_{page_num}_{i}"
-                    file_path = os.path.join(IMAGE_DIR, f"{item_id}.png")
-
-                    # Save image
-                    with open(file_path, "wb") as f:
-                        f.write(base_img["image"])
-
-                    # Store base64 for API calls
-                    img_base64 = base64.b64encode(base_img["image"]).decode("utf-8")
-
-                    items.append({
-                        "id": item_id,
-                        "type": "image",
-                        "content": img_base64,
-                        "page": page_num,
-                        "path": file_path
-                    })
-            except Exception as e:
-                print(f"Error extracting image {xref} on page {page_num}: {e}")
+    if span_pages:
+        # Chunks running across pages get no bbox
+        items.append({"type": PAGE_TEXT, "page": page_num, "content": text})
+    else:
+        chunks = chunk_blocks(blocks) if layout else [(chunk, None) for chunk in chunk_text(text)]
+        for i, (chunk, bbox) in enumerate(chunks):
+            item = text_item(page_num, i, chunk, document_id, bbox)
+            if item is not None:
+                items.append(item)
+
+    # Extract images
+    images = page.get_images(full=True)
+
+    for i, img_info in enumerate(images):
+        xref, width, height = img_info[0], img_info[2], img_info[3]
+        item = {
+            "id": f"image_{page_num}_{i}",
+            "type": "image",
+            "content": IMAGE_PLACEHOLDER,
+            "page": page_num,
+            "path": "",
+            "document": document_id,
+            "xref": xref,
+            "width": width,
+            "height": height,
+            "data": b""
+        }
+        if layout:
+            if xref in bboxes:
+                item["bbox"] = bboxes[xref]
+            if xref in captions:
+                item["caption"] = captions[xref]
+
+        # Too small to keep: the filter only needs the dimensions to skip it
+        if min_size is not None and not large_enough_dimensions(width, height, *min_size):
+            items.append(item)
+            continue
+
+        try:
+            # Extract image
+            base_img = doc.extract_image(xref)
+
+            if base_img:
+                # No base64 copy is kept, the bytes are only encoded when an API request is built
+                item["data"] = base_img["image"]
+                if hash_images:
+                    # Hashed here so decoding runs in the extraction workers
+                    item["hashes"] = image_hashes(base_img["image"])
+                items.append(item)
+        except Exception as e:
+            print(f"Error extracting image {xref} on page {page_num}: {e}")
 
-    print(f"Extracted {len(items)} items ({len([i for i in items if i['type']=='text'])} text chunks and {len([i for i in items if i['type']=='image'])} images)")
     return items
 
-def chunk_text(text, chunk_size=800, overlap=100):
-    """Split text into chunks with overlap, ensuring no chunk exceeds 1024 characters."""
-    # First split by paragraphs
-    paragraphs = text.split('\n\n')
-    
+def store_images(items, blobs, image_filter):
+    """Filter image items and move the bytes of the kept ones into a blob store, leaving a lazy handle on them.
+
+    Skipped images are dropped; duplicates are left pointing at the image they repeat.
+    """
+    kept = []
+    for item in items:
+        if item["type"] == "image":
+            if not image_filter.admit(item):
+                continue
+            data = item.pop("data", None)
+            if data is not None:
+                item["path"] = blobs.put(data)
+                item["image"] = ImageHandle(item["path"])
+        kept.append(item)
+    return kept
+
+def chunk_pages(items, chunker, document_id, last_page=False):
+    """Replace the PAGE_TEXT item of a page by the chunks the PageChunker completes with it.
+
+    A chunk that starts on an earlier page is returned with this page's items but keeps its own page.
+    """
+    texts, others = [], []
+    for item in items:
+        (texts if item["type"] == PAGE_TEXT else others).append(item)
     chunks = []
-    current_chunk = ""
-    
-    for paragraph in paragraphs:
-        paragraph = paragraph.strip()
-        if not paragraph:
-            continue
-            
-        # If this paragraph alone is too big, split it by sentences
-        if len(paragraph) > chunk_size:
-            # Split into sentences (simple split by period)
-            sentences = paragraph.replace('. ', '.|').split('|')
-            for sentence in sentences:
-                if len(sentence) > chunk_size:
-                    # If even a sentence is too big, split by a fixed length
-                    for i in range(0, len(sentence), chunk_size // 2):
-                        sub_chunk = sentence[i:i + chunk_size // 2]
-                        if sub_chunk:
-                            chunks.append(sub_chunk)
-                elif len(current_chunk) + len(sentence) + 2 > chunk_size:
-                    # Save current chunk and start a new one
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = sentence
-                else:
-                    # Add to current chunk
-                    if current_chunk:
-                        current_chunk += " " + sentence
-                    else:
-                        current_chunk = sentence
-        # If adding this paragraph exceeds chunk size, save current chunk and start a new one
-        elif len(current_chunk) + len(paragraph) + 2 > chunk_size and current_chunk:
-            chunks.append(current_chunk)
-            
-            # Keep some overlap from the previous chunk
-            words = current_chunk.split()
-            overlap_words = min(len(words), overlap//10)  # Approximately 10 chars per word
-            overlap_text = " ".join(words[-overlap_words:]) if overlap_words > 0 else ""
-            current_chunk = overlap_text + " " + paragraph
-        else:
-            if current_chunk:
-                current_chunk += "\n\n" + paragraph
-            else:
-                current_chunk = paragraph
-    
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    # Final safety check - ensure all chunks are under 1000 chars
-    final_chunks = []
-    for chunk in chunks:
-        if len(chunk) <= 1000:
-            final_chunks.append(chunk)
-        else:
-            # Split into smaller chunks
-            for i in range(0, len(chunk), 900):  # Use 900 to be safe
-                sub_chunk = chunk[i:i + 900]
-                if sub_chunk:
-                    final_chunks.append(sub_chunk)
-    
-    return final_chunks
+    for item in texts:
+        chunks.extend(chunker.feed(item["page"], item["content"]))
+    if last_page:
+        chunks.extend(chunker.finish())
+    chunk_items = [text_item(page_num, i, chunk, document_id) for page_num, i, chunk in chunks]
+    return [item for item in chunk_items if item is not None] + others
+
+def _extract_page_range(pdf_path, start, stop, document_id, span_pages=CHUNK_SPAN_PAGES, image_options=None):
+    """Extract pages [start, stop) in a worker process with its own document handle."""
+    with pymupdf.open(pdf_path) as doc:
+        return [extract_page(doc, doc[page_num], page_num, document_id, span_pages, **(image_options or {}))
+                for page_num in range(start, stop)]
+
+def iter_extract_pages(pdf_path, workers=EXTRACTION_WORKERS, pages_per_task=EXTRACTION_PAGES_PER_TASK, document_id=None,
+                       image_filter=None, span_pages=CHUNK_SPAN_PAGES):
+    """Yield (page_num, items) in page order, extracting page ranges on a process pool.
+
+    Images go through image_filter (a new ImageFilter by default), pass one in to read its stats.
+    With span_pages, text is chunked here across page breaks.
+    """
+    if document_id is None:
+        document_id = document_id_for(pdf_path)
+    if image_filter is None:
+        image_filter = ImageFilter()
+    chunker = PageChunker() if span_pages else None
+    image_options = image_filter.extract_options()
+
+    def finish_page(page_num, page_items, blobs):
+        page_items = store_images(page_items, blobs, image_filter)
+        if chunker is not None:
+            page_items = chunk_pages(page_items, chunker, document_id, last_page=page_num == page_count - 1)
+        return page_items
+
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+        # Small documents are not worth starting worker processes for
+        if workers <= 1 or page_count <= pages_per_task:
+            with BlobWriter(document_id) as blobs:
+                for page_num in range(page_count):
+                    page_items = extract_page(doc, doc[page_num], page_num, document_id, span_pages, **image_options)
+                    yield page_num, finish_page(page_num, page_items, blobs)
+            return
+
+    ranges = [(start, min(start + pages_per_task, page_count))
+              for start in range(0, page_count, pages_per_task)]
+
+    # Workers return image bytes, this process appends them to the document's single data file
+    with ProcessPoolExecutor(max_workers=workers) as executor, BlobWriter(document_id) as blobs:
+        # Keep a bounded number of ranges in flight and yield them in order
+        pending = deque()
+        for start, stop in ranges:
+            pending.append((start, executor.submit(_extract_page_range, pdf_path, start, stop, document_id, span_pages,
+                                                       image_options)))
+            if len(pending) >= workers * 2:
+                first_page, future = pending.popleft()
+                for page_num, page_items in enumerate(future.result(), start=first_page):
+                    yield page_num, finish_page(page_num, page_items, blobs)
+
+        while pending:
+            first_page, future = pending.popleft()
+            for page_num, page_items in enumerate(future.result(), start=first_page):
+                yield page_num, finish_page(page_num, page_items, blobs)
+
+def iter_extract_from_pdf(pdf_path, workers=EXTRACTION_WORKERS, document_id=None):
+    """Yield extracted items in page order as soon as each page range is done."""
+    for _, page_items in iter_extract_pages(pdf_path, workers=workers, document_id=document_id):
+        yield from page_items
+
+def extract_from_pdf(pdf_path, workers=EXTRACTION_WORKERS, document_id=None):
+    """Extract text and images from PDF."""
+    print(f"Processing PDF: {pdf_path}")
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    items = []
+    image_filter = ImageFilter()
+
+    # Process each page
+    pages = iter_extract_pages(pdf_path, workers=workers, document_id=document_id, image_filter=image_filter)
+    for _, page_items in tqdm(pages, total=page_count, desc="Processing pages"):
+        items.extend(page_items)
+
+    print(f"Extracted {len(items)} items ({len([i for i in items if i['type']=='text'])} text chunks and {len([i for i in items if i['type']=='image'])} images)")
+    if image_filter.enabled:
+        print(format_filter_stats(image_filter.stats()))
+    return items
 
-def verify_chunk_sizes(items):
-    """Check text chunks to ensure they're under 1024 characters."""
+def verify_chunk_sizes(items, max_chars=CHUNK_MAX_CHARS):
+    """Return the (id, length) of text chunks longer than max_chars, the embedding API limit."""
     too_large = []
     for item in items:
         if item['type'] == 'text':
             length = len(item['content'])
-            if length > 1000:  # Checking against a slightly lower threshold to be safe
+            if length > max_chars:
                 too_large.append((item['id'], length))
     
     if too_large:
@@ -1,47 +1,206 @@
-import os
-from vertexai.vision_models import MultiModalEmbeddingModel
-from vertexai.generative_models import GenerativeModel, Content, Part
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from vertexai.generative_models import Content, Part
 
-from modules.retrieval import find_similar_items
+from config import (
+    LLM_MODEL,
+    EMBEDDING_MODEL,
+    RETRIEVAL_MODE,
+    ANN_NPROBE,
+    RERANK_FACTOR,
+    HYBRID_DEPTH,
+    CONTEXT_MAX_CHARS,
+    CONTEXT_MAX_TOKENS,
+    CONTEXT_DEDUPE_THRESHOLD,
+    GENERATION_CONCURRENCY,
+    QUERY_BATCH_SIZE,
+    ANSWER_CACHE_ENABLED,
+    GENERATION_MAX_RETRIES,
+    ASYNC_RETRIEVAL_MIN_ITEMS,
+)
+from modules.answer_cache import answer_scope, context_fingerprint, get_answer_cache
+from modules.models import get_llm_model
+from modules.query_cache import aembed_question, embed_questions
+from modules.retrieval import VectorIndex, find_similar_items
+from modules.context import pack_context
+from utils.concurrency import TRANSIENT_ERRORS, backoff_delay, iter_sync, run_blocking, run_sync
 
-def query_rag_system(question, indexed_items):
-    """Query the RAG system with a question."""
+def _resolve_answer_cache(cache):
+    """Use the shared answer cache by default, or none when cache=False."""
+    if cache is None:
+        return get_answer_cache() if ANSWER_CACHE_ENABLED else None
+    if cache is False:
+        return None
+    return cache
+
+def _answer_settings(indexed_items):
+    """Settings besides the index version that change what a question retrieves and how it is packed."""
+    ann = getattr(indexed_items, "ann", None)
+    store = getattr(indexed_items, "store", None)
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "ann_nprobe": ANN_NPROBE if ann is not None else None,
+        "store": store.mode if store is not None else None,
+        "rerank": RERANK_FACTOR if store is not None else None,
+        "hybrid_depth": HYBRID_DEPTH,
+        "context": [CONTEXT_MAX_CHARS, CONTEXT_MAX_TOKENS, CONTEXT_DEDUPE_THRESHOLD],
+    }
+
+def _cached_result(question, record, top_matches, tier):
+    return {
+        "question": question,
+        "answer": record["answer"],
+        "top_matches": top_matches,
+        "text_context": record["text_context"],
+        "cached": tier
+    }
+
+def _replay(result):
+    """Events for an answer that needs no generation."""
+    yield {"type": "evidence", "top_matches": result["top_matches"]}
+    yield {"type": "token", "text": result["answer"]}
+    yield {"type": "done", "result": result}
+
+async def astream_rag_system(question, indexed_items, filters=None, mode=None, cache=None, top_k=5):
+    """Async stream_rag_system, the implementation behind every query.
+
+    Embedding calls and cache reads and writes run on the shared thread pool, retrieval
+    too once the index has ASYNC_RETRIEVAL_MIN_ITEMS items, and the answer is streamed
+    from the model's async API, so one event loop can serve many concurrent questions.
+    """
     print(f"Processing question: '{question}'")
+    mode = mode or RETRIEVAL_MODE
+    start = time.perf_counter()
+
+    def timed(result, retrieval_seconds, first_token_seconds):
+        total_seconds = time.perf_counter() - start
+        result["timings"] = {
+            "retrieval_seconds": retrieval_seconds,
+            # An empty answer has no first token
+            "first_token_seconds": total_seconds if first_token_seconds is None else first_token_seconds,
+            "total_seconds": total_seconds,
+        }
+        return result
+
+    # Cached answers are tied to an index version, which only indexes loaded from disk have.
+    # The exact tier is checked before retrieval: the version (manifest fingerprint) and the
+    # scope fix the context a question retrieves, so it stands in for the context fingerprint
+    version = getattr(indexed_items, "version", None)
+    cache = _resolve_answer_cache(cache) if version else None
+    if cache is not None:
+        scope = answer_scope(mode, filters, top_k=top_k, model_name=LLM_MODEL, settings=_answer_settings(indexed_items))
+        record = await run_blocking(cache.get_exact, version, scope, question)
+        if record is not None:
+            top_matches = [indexed_items.items.view(row, similarity=sim) for row, sim in record["matches"]]
+            elapsed = time.perf_counter() - start
+            for event in _replay(timed(_cached_result(question, record, top_matches, "exact"), elapsed, elapsed)):
+                yield event
+            return
     
-    # Load models
-    embedding_model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-    llm_model = GenerativeModel("gemini-pro-vision")
-    
-    # Get question embedding
-    question_result = embedding_model.get_embeddings(
-        image=None,
-        contextual_text=question,
-        dimension=1408
-    )
-    question_embedding = question_result.text_embedding
-    
-    # Find similar items
-    top_matches = find_similar_items(question_embedding, indexed_items, top_k=5)
+    # Get the shared model
+    llm_model = get_llm_model()
     
-    # Prepare context
-    text_parts = []
-    image_files = []
+    # Get question embedding, cached for repeated questions (lexical search needs none)
+    question_embedding = None
+    if mode != "lexical":
+        question_embedding = await aembed_question(question)
     
-    for match in top_matches:
-        if match["type"] == "text":
-            text_parts.append(f"[Content from page {match['page']+1}]\n{match['content']}")
-        elif match["type"] == "image":
-            # Just keep track of the image file paths
-            image_files.append({
-                "path": match["path"],
-                "page": match["page"]+1,
+    # Find similar items, off the event loop when scoring takes long enough to stall other queries
+    search = functools.partial(find_similar_items, question_embedding, indexed_items, top_k=top_k, filters=filters,
+                               query_text=question, mode=mode)
+    if len(indexed_items) >= ASYNC_RETRIEVAL_MIN_ITEMS:
+        top_matches = await run_blocking(search)
+    else:
+        top_matches = search()
+    retrieval_seconds = time.perf_counter() - start
+
+    # A close enough question that retrieved the same context has the same answer
+    if cache is not None:
+        context = context_fingerprint(top_matches)
+        record = await run_blocking(cache.get_similar, version, scope, context, question_embedding)
+        if record is not None:
+            elapsed = time.perf_counter() - start
+            for event in _replay(timed(_cached_result(question, record, top_matches, "semantic"),
+                                       retrieval_seconds, elapsed)):
+                yield event
+            return
+
+    # Evidence goes out before generation starts
+    yield {"type": "evidence", "top_matches": top_matches}
+
+    first_token_seconds = None
+    async for event in astream_answer(question, top_matches, llm_model):
+        if event["type"] == "token":
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - start
+            yield event
+            continue
+
+        result = timed(event["result"], retrieval_seconds, first_token_seconds)
+        if cache is not None and not result.get("error"):
+            await run_blocking(cache.put, version, scope, question, context, question_embedding, {
+                "question": question,
+                "answer": result["answer"],
+                "text_context": result["text_context"],
+                "matches": [[match.row, match["similarity"]] for match in top_matches],
             })
-    
-    # Combine text context
-    text_context = "\n\n".join(text_parts)
-    
-    # Create prompt
-    prompt = f"""
+        yield {"type": "done", "result": result}
+
+def stream_rag_system(question, indexed_items, filters=None, mode=None, cache=None, top_k=5):
+    """Streaming query_rag_system that yields events as they happen:
+
+      {"type": "evidence", "top_matches": [...]}  once, right after retrieval
+      {"type": "token", "text": "..."}            answer text as it is generated
+      {"type": "done", "result": {...}}           the full result, with "timings"
+
+    timings holds retrieval_seconds, first_token_seconds (time to first token) and
+    total_seconds, all measured from the start of the query. Runs astream_rag_system
+    on the shared event loop.
+    """
+    return iter_sync(astream_rag_system(question, indexed_items, filters=filters, mode=mode, cache=cache,
+                                        top_k=top_k))
+
+async def aquery_rag_system(question, indexed_items, filters=None, mode=None, cache=None, top_k=5):
+    """Async query_rag_system."""
+    async for event in astream_rag_system(question, indexed_items, filters=filters, mode=mode, cache=cache,
+                                          top_k=top_k):
+        if event["type"] == "done":
+            return event["result"]
+
+def query_rag_system(question, indexed_items, filters=None, mode=None, cache=None, top_k=5):
+    """Query the RAG system with a question, optionally searching only items matching filters.
+
+    mode is "vector", "lexical" or "hybrid" (defaults to RETRIEVAL_MODE). Answers are reused
+    from the answer cache for repeated or near-duplicate questions (cache=False disables it).
+    """
+    return run_sync(aquery_rag_system(question, indexed_items, filters=filters, mode=mode, cache=cache,
+                                      top_k=top_k))
+
+async def _astream_text(llm_model, content, max_retries=GENERATION_MAX_RETRIES):
+    """Yield the text of each streamed response chunk, retrying transient errors before the first one."""
+    for attempt in range(max_retries + 1):
+        started = False
+        try:
+            async for chunk in await llm_model.generate_content_async(content, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text (e.g. only safety ratings)
+                    continue
+                if text:
+                    started = True
+                    yield text
+            return
+        except TRANSIENT_ERRORS:
+            # Text already shown cannot be generated again
+            if started or attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+
+def _build_prompt(question, text_context):
+    return f"""
     Answer the following question about the document based on the provided context and images:
     
     QUESTION: {question}
@@ -52,23 +211,21 @@ def query_rag_system(question, indexed_items):
     Provide a comprehensive answer based solely on the information in the context.
     If the information isn't available in the context, please state that clearly.
     """
+
+async def astream_answer(question, top_matches, llm_model=None):
+    """Generate an answer from retrieved matches, yielding {"type": "token"} events and a final {"type": "done"}."""
+    if llm_model is None:
+        llm_model = get_llm_model()
+
+    # Merge, dedupe and trim the matches to the context budget, downsize images (cached after first use)
+    packed = await run_blocking(pack_context, top_matches)
+    text_context = packed["text_context"]
+    prompt = _build_prompt(question, text_context)
     
-    # Create message content parts
+    # Create message content parts, images in the same message
     message_parts = [Part.from_text(prompt)]
-    
-    # Add images to the same message
-    for img_info in image_files:
-        try:
-            # Load image file
-            with open(img_info["path"], "rb") as f:
-                image_bytes = f.read()
-            
-            # Create Part from image bytes
-            img_part = Part.from_data(mime_type="image/png", data=image_bytes)
-            message_parts.append(img_part)
-            
-        except Exception as e:
-            print(f"Error loading image {img_info['path']}: {e}")
+    message_parts.extend(Part.from_data(mime_type=image["mime_type"], data=bytes(image["data"]))
+                         for image in packed["images"])
     
     # Create a single content item with user role
     content = [
@@ -78,37 +235,144 @@ def query_rag_system(question, indexed_items):
         )
     ]
     
-    # Generate answer
+    # Stream the answer
+    chunks = []
+    error = None
     try:
-        response = llm_model.generate_content(content)
-        answer = response.text
+        async for text in _astream_text(llm_model, content):
+            chunks.append(text)
+            yield {"type": "token", "text": text}
+        note = None
     except Exception as e:
         print(f"Error generating response: {e}")
-        # Fallback to text-only response
-        text_only_content = [Content(role="user", parts=[Part.from_text(prompt)])]
-        try:
-            response = llm_model.generate_content(text_only_content)
-            answer = response.text + "\n\n[Note: Images could not be processed due to an error]"
-        except Exception as e2:
-            answer = f"Error generating response: {e2}\n\nRetrieved context:\n{text_context[:500]}..."
+        if chunks:
+            # Text already shown cannot be taken back
+            note = "\n\n[Note: The answer was cut short by an error]"
+            error = str(e)
+        else:
+            # Fallback to text-only response
+            text_only_content = [Content(role="user", parts=[Part.from_text(prompt)])]
+            try:
+                async for text in _astream_text(llm_model, text_only_content):
+                    chunks.append(text)
+                    yield {"type": "token", "text": text}
+                note = "\n\n[Note: Images could not be processed due to an error]"
+            except Exception as e2:
+                note = f"Error generating response: {e2}\n\nRetrieved context:\n{text_context[:500]}..."
+                error = str(e2)
+    if note:
+        chunks.append(note)
+        yield {"type": "token", "text": note}
     
-    return {
+    result = {
         "question": question,
-        "answer": answer,
+        "answer": "".join(chunks),
         "top_matches": top_matches,
-        "text_context": text_context
+        "text_context": text_context,
+        "context_stats": packed["stats"]
     }
+    if error:
+        result["error"] = error
+    yield {"type": "done", "result": result}
 
-def show_query_result(result):
-    """Return a text representation of query results (non-display version)."""
-    output = []
-    output.append(f"Question: {result['question']}")
-    output.append(f"\nAnswer:\n{result['answer']}")
+def stream_answer(question, top_matches, llm_model=None):
+    """Sync astream_answer, run on the shared event loop."""
+    return iter_sync(astream_answer(question, top_matches, llm_model))
+
+async def agenerate_answer(question, top_matches, llm_model=None):
+    """Async generate_answer."""
+    async for event in astream_answer(question, top_matches, llm_model):
+        if event["type"] == "done":
+            return event["result"]
+
+def generate_answer(question, top_matches, llm_model=None):
+    """Generate an answer to a question from its retrieved matches."""
+    return run_sync(agenerate_answer(question, top_matches, llm_model))
+
+def _question_batches(questions, batch_size):
+    """Group questions (strings or {"question", "id"} dicts) into lists of (id, question)."""
+    batch = []
+    for position, question in enumerate(questions):
+        if isinstance(question, dict):
+            batch.append((question.get("id", position), question["question"]))
+        else:
+            batch.append((position, question))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    output.append("\nTop Matching Items:")
-    for i, match in enumerate(result["top_matches"]):
+def query_batch(questions, indexed_items, filters=None, mode=None, top_k=5,
+                concurrency=GENERATION_CONCURRENCY, batch_size=QUERY_BATCH_SIZE):
+    """Answer many questions against one index, yielding results as they finish (not in input order).
+
+    questions are strings or {"question", "id"} dicts; every result carries the "id"
+    (the input position by default). Each batch of questions is embedded concurrently and
+    scored against the index together, while earlier batches are still being answered.
+    """
+    mode = mode or RETRIEVAL_MODE
+    llm_model = get_llm_model()
+    # Build the matrix once, not per batch, when given a plain list of items
+    if not isinstance(indexed_items, VectorIndex):
+        indexed_items = VectorIndex(indexed_items)
+
+    def answer(question_id, question, top_matches):
+        result = generate_answer(question, top_matches, llm_model)
+        result["id"] = question_id
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for batch in _question_batches(questions, batch_size):
+            texts = [question for _, question in batch]
+
+            # Embed the batch concurrently (lexical search needs no embeddings)
+            embeddings = [None] * len(batch)
+            if mode != "lexical":
+                embeddings = embed_questions(texts)
+
+            embedded = [i for i, embedding in enumerate(embeddings) if embedding is not None or mode == "lexical"]
+            for i in sorted(set(range(len(batch))) - set(embedded)):
+                yield {"id": batch[i][0], "question": texts[i], "answer": None, "top_matches": [],
+                       "text_context": "", "error": "Question could not be embedded"}
+
+            # Score every question of the batch against the index in one pass
+            matches = indexed_items.search_batch(
+                [embeddings[i] for i in embedded] if mode != "lexical" else None,
+                top_k=top_k,
+                filters=filters,
+                query_texts=[texts[i] for i in embedded],
+                mode=mode
+            )
+            for i, top_matches in zip(embedded, matches):
+                pending.add(executor.submit(answer, batch[i][0], texts[i], top_matches))
+
+            # Stream out finished answers; keep at most one batch queued beyond the running calls
+            while pending:
+                done = {future for future in pending if future.done()}
+                if not done:
+                    if len(pending) <= batch_size + concurrency:
+                        break
+                    done = wait(pending, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+
+        while pending:
+            done = wait(pending, return_when=FIRST_COMPLETED).done
+            for future in done:
+                pending.remove(future)
+                yield future.result()
+
+def show_matches(top_matches):
+    """Return a text representation of retrieved matches."""
+    output = ["Top Matching Items:"]
+    for i, match in enumerate(top_matches):
         output.append(f"\n--- Match {i+1} (similarity: {match['similarity']:.4f}) ---")
         output.append(f"Type: {match['type']}")
+        if match.get("document"):
+            output.append(f"Document: {match['document']}")
         output.append(f"Page: {match['page']+1}")
 
         if match["type"] == "text":
@@ -120,4 +384,15 @@ def show_query_result(result):
         else:
             output.append(f"Image path: {match['path']}")
             
-    return "\n".join(output)
\ No newline at end of file
+    return "\n".join(output)
+
+def show_query_result(result):
+    """Return a text representation of query results (non-display version)."""
+    output = []
+    output.append(f"Question: {result['question']}")
+    output.append(f"\nAnswer:\n{result['answer']}")
+    if result.get("cached"):
+        output.append(f"(Answer reused from the answer cache: {result['cached']} match)")
+
+    output.append("\n" + show_matches(result["top_matches"]))
+    return "\n".join(output)
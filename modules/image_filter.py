@@ -0,0 +1,181 @@
+"""
+Image filtering
+---------------
+Decides at extraction time which images are worth an embedding call:
+  small       images under IMAGE_MIN_WIDTH x IMAGE_MIN_HEIGHT pixels or
+              IMAGE_MIN_BYTES bytes (icons, bullets, rules) are skipped
+  repeated    an xref already seen in the document (a logo or header drawn on
+              every page) becomes a reference to its first occurrence
+  similar     an image whose average hash and difference hash are both within
+              IMAGE_HASH_DISTANCE bits of a kept image of similar shape (the same
+              picture re-encoded or rescaled) also becomes a reference
+
+A reference keeps its own item (page, id) but points at the first image's blob
+and reuses its embedding, so it costs neither storage nor an API call. Searches
+return only the best ranked row of an image (VectorIndex.collapse_images), so
+references never fill the top k; a page filter still finds the page's own row.
+"""
+import io
+import numpy as np
+from PIL import Image as PILImage
+
+from config import (
+    IMAGE_FILTER_ENABLED,
+    IMAGE_MIN_WIDTH,
+    IMAGE_MIN_HEIGHT,
+    IMAGE_MIN_BYTES,
+    IMAGE_HASH_DISTANCE,
+)
+from modules.blob_store import ImageHandle
+
+# Aspect ratios of near-duplicates differ by at most this factor
+_MAX_ASPECT_RATIO = 1.05
+
+def large_enough_dimensions(width, height, min_width=IMAGE_MIN_WIDTH, min_height=IMAGE_MIN_HEIGHT):
+    """Size check that needs no image bytes, done before an image is extracted."""
+    return width >= min_width and height >= min_height
+
+def large_enough(width, height, nbytes, min_width=IMAGE_MIN_WIDTH, min_height=IMAGE_MIN_HEIGHT,
+                 min_bytes=IMAGE_MIN_BYTES):
+    return large_enough_dimensions(width, height, min_width, min_height) and nbytes >= min_bytes
+
+def _bits(values):
+    """Pack booleans into an int, first value as the highest bit."""
+    return int.from_bytes(np.packbits(values).tobytes(), "big")
+
+def _thumbnail(image, size):
+    return np.asarray(image.convert("L").resize(size, PILImage.LANCZOS), dtype=np.int16)
+
+def average_hash(image):
+    """64-bit aHash: which pixels of an 8x8 grayscale thumbnail are brighter than its mean."""
+    pixels = _thumbnail(image, (8, 8))
+    return _bits(pixels > pixels.mean())
+
+def difference_hash(image):
+    """64-bit dHash: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour."""
+    pixels = _thumbnail(image, (9, 8))
+    return _bits(pixels[:, :-1] > pixels[:, 1:])
+
+def image_hashes(image_bytes):
+    """(aHash, dHash) of encoded image bytes, or None if the image cannot be decoded."""
+    try:
+        with PILImage.open(io.BytesIO(image_bytes)) as image:
+            image.draft("L", (64, 64))
+            return average_hash(image), difference_hash(image)
+    except Exception:
+        return None
+
+def _hamming(a, b):
+    return (a ^ b).bit_count()
+
+def _bands(max_distance):
+    """(shift, mask) of the slices an aHash is bucketed by.
+
+    Two hashes within max_distance bits agree on at least one of max_distance + 1
+    slices, so only images sharing a slice need comparing.
+    """
+    count = min(max_distance + 1, 64)
+    bounds = [round(64 * n / count) for n in range(count + 1)]
+    return [(64 - stop, (1 << (stop - start)) - 1) for start, stop in zip(bounds, bounds[1:])]
+
+class ImageFilter:
+    """Per-document filter applied to extracted image items in page order."""
+
+    def __init__(self, enabled=IMAGE_FILTER_ENABLED, min_width=IMAGE_MIN_WIDTH, min_height=IMAGE_MIN_HEIGHT,
+                 min_bytes=IMAGE_MIN_BYTES, max_distance=IMAGE_HASH_DISTANCE):
+        self.enabled = enabled
+        self.min_width = min_width
+        self.min_height = min_height
+        self.min_bytes = min_bytes
+        self.max_distance = max_distance
+        self._by_xref = {}
+        self._kept = []
+        self._bands = _bands(max_distance)
+        self._buckets = {}
+        self.images = 0
+        self.small = 0
+        self.repeated = 0
+        self.similar = 0
+
+    def extract_options(self):
+        """Keyword arguments for extract_page, so it applies this filter's size check and hashes images."""
+        if not self.enabled:
+            return {"min_size": None, "hash_images": False}
+        return {"min_size": (self.min_width, self.min_height), "hash_images": True}
+
+    def _band_keys(self, ahash):
+        return [(n, (ahash >> shift) & mask) for n, (shift, mask) in enumerate(self._bands)]
+
+    def _find_similar(self, hashes, aspect):
+        # From 64 bits on every hash matches and bands cannot rule any out
+        if self.max_distance >= 64:
+            candidates = range(len(self._kept))
+        else:
+            candidates = sorted({n for key in self._band_keys(hashes[0]) for n in self._buckets.get(key, ())})
+        for n in candidates:
+            kept_hashes, kept_aspect, item = self._kept[n]
+            if max(aspect, kept_aspect) > _MAX_ASPECT_RATIO * min(aspect, kept_aspect):
+                continue
+            if (_hamming(hashes[0], kept_hashes[0]) <= self.max_distance
+                    and _hamming(hashes[1], kept_hashes[1]) <= self.max_distance):
+                return item
+        return None
+
+    def _refer(self, item, original):
+        item.pop("data", None)
+        item["duplicate_of"] = original["id"]
+        item["path"] = original["path"]
+        item["image"] = ImageHandle(original["path"])
+
+    def admit(self, item):
+        """Return False to skip an image item. Duplicates are turned into references to the
+        first occurrence, which must already be stored (items are admitted in order)."""
+        xref = item.pop("xref", None)
+        width, height = item.pop("width", 0), item.pop("height", 0)
+        hashes = item.pop("hashes", None)
+        if not self.enabled:
+            return True
+        self.images += 1
+
+        if not large_enough(width, height, len(item["data"]), self.min_width, self.min_height, self.min_bytes):
+            self.small += 1
+            return False
+
+        original = self._by_xref.get(xref)
+        if original is not None:
+            self.repeated += 1
+            self._refer(item, original)
+            return True
+
+        # Images of unknown shape (no height) are never compared by hash
+        aspect = width / height if height else None
+        comparable = hashes is not None and aspect is not None
+        original = self._find_similar(hashes, aspect) if comparable else None
+        if original is not None:
+            self.similar += 1
+            self._refer(item, original)
+        elif comparable:
+            for key in self._band_keys(hashes[0]):
+                self._buckets.setdefault(key, []).append(len(self._kept))
+            self._kept.append((hashes, aspect, item))
+        self._by_xref[xref] = original or item
+        return True
+
+    @property
+    def saved_calls(self):
+        """Embedding calls avoided: skipped images plus references."""
+        return self.small + self.repeated + self.similar
+
+    def stats(self):
+        return {
+            "images": self.images,
+            "small": self.small,
+            "repeated": self.repeated,
+            "similar": self.similar,
+            "saved_calls": self.saved_calls,
+        }
+
+def format_filter_stats(stats):
+    """One-line summary of an ImageFilter's work."""
+    return (f"Images: {stats['images']} found, {stats['small']} too small, {stats['repeated']} repeated, "
+            f"{stats['similar']} near-duplicates; saved {stats['saved_calls']} embedding calls")
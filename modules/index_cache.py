@@ -0,0 +1,95 @@
+"""
+Index registry
+--------------
+Process-wide, thread-safe cache of loaded indexes and image bytes, shared by
+every Streamlit session. Indexes are keyed by path and reloaded only when
+their manifest changes on disk.
+"""
+import os
+import threading
+
+from config import INDEX_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_BYTES, PROMPT_IMAGE_CACHE_MAX_BYTES
+from modules.index_format import MANIFEST_FILE
+from modules.blob_store import is_blob_ref, read_blob, blob_version, read_file
+from modules.retrieval import load_index, resolve_index_path
+from utils.cache import LRUCache
+from utils.helpers import downsize_image
+
+# path -> (manifest mtime, index)
+_index_cache = LRUCache(max_bytes=INDEX_CACHE_MAX_BYTES, sizeof=lambda entry: entry[1].memory_bytes())
+# (path, mtime, size) -> bytes of a legacy image file
+_image_cache = LRUCache(max_bytes=IMAGE_CACHE_MAX_BYTES, sizeof=len)
+# (path, version, max pixels) -> (bytes, mime type) of a downsized image
+_prompt_image_cache = LRUCache(max_bytes=PROMPT_IMAGE_CACHE_MAX_BYTES, sizeof=lambda value: len(value[0]))
+_load_lock = threading.Lock()
+
+def get_index(filename=None):
+    """Return a loaded index, reusing the cached copy while its files are unchanged."""
+    path = resolve_index_path(filename)
+    mtime = os.path.getmtime(os.path.join(path, MANIFEST_FILE))
+
+    entry = _index_cache.get(path)
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+
+    # Load each index once even when several sessions ask at the same time
+    with _load_lock:
+        entry = _index_cache.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        index = load_index(path)
+        _index_cache.put(path, (mtime, index))
+        # A BM25, ANN or compressed store attached later counts against the budget too
+        index.on_resize = lambda: _index_cache.resize(path)
+        return index
+
+def get_image_bytes(path):
+    """Return the bytes of an image item's path (or ImageHandle).
+
+    Blob store references are served as memoryviews of the mapped data file (the
+    OS page cache is their cache); legacy image files are read once and cached.
+    """
+    path = getattr(path, "path", path)
+    if is_blob_ref(path):
+        return read_blob(path)
+
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+
+    data = _image_cache.get(key)
+    if data is None:
+        data = read_file(path)
+        _image_cache.put(key, data)
+
+    return data
+
+def get_prompt_image(path, max_pixels):
+    """Return (bytes, mime type) of an image (path or ImageHandle) downsized for a prompt, converted on first use."""
+    path = getattr(path, "path", path)
+    if is_blob_ref(path):
+        key = (path, blob_version(path), max_pixels)
+    else:
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, max_pixels)
+
+    prepared = _prompt_image_cache.get(key)
+    if prepared is None:
+        prepared = downsize_image(get_image_bytes(path), max_pixels)
+        _prompt_image_cache.put(key, prepared)
+
+    return prepared
+
+def clear_caches():
+    """Drop every cached index and image."""
+    _index_cache.clear()
+    _image_cache.clear()
+    _prompt_image_cache.clear()
+
+def cache_stats():
+    """Return usage counters for the index and image caches."""
+    return {
+        "indexes": _index_cache.stats(),
+        "images": _image_cache.stats(),
+        "prompt_images": _prompt_image_cache.stats(),
+    }
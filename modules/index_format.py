@@ -0,0 +1,455 @@
+"""
+Binary index format
+-------------------
+An index is a directory holding a manifest.json that lists immutable segments,
+one subdirectory each. Adding a document writes a new segment, deleting one
+only rewrites the manifest, and compaction merges segments and drops deleted
+rows. A segment holds:
+  segment.json    item count, dimension, dtype and per-document item counts
+  embeddings.npy  (count, dim) matrix, opened with np.memmap on load
+  norms.npy       float32 row norms, so loading never scans the matrix
+  items.json      columnar metadata: ids, types, pages, paths, documents, content offsets
+                  and bounding boxes
+  content.bin     UTF-8 text of all items (captions of images) concatenated
+
+Version 1 indexes (a single segment with its own manifest.json) are read as a
+one-segment index and upgraded on the first write.
+"""
+import os
+import json
+import hashlib
+import shutil
+import time
+from array import array
+import numpy as np
+
+from config import COMPACT_MAX_SEGMENTS, COMPACT_DELETED_RATIO
+from modules.item_store import ItemStore, DEFAULT_DOCUMENT
+
+INDEX_FORMAT = "rag-index"
+INDEX_FORMAT_VERSION = 2
+SEGMENT_FORMAT = "rag-index-segment"
+SEGMENT_FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+SEGMENT_FILE = "segment.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+NORMS_FILE = "norms.npy"
+ITEMS_FILE = "items.json"
+CONTENT_FILE = "content.bin"
+ANN_FILE = "ann_ivf.npz"
+LEXICAL_FILE = "lexical_bm25.npz"
+
+# Rows copied at a time when finishing a streamed index
+COPY_CHUNK_ROWS = 65536
+
+def is_index_dir(path):
+    """Check whether a path is a binary index directory."""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+def _replace_file(path, write):
+    """Write a file next to its destination and move it into place."""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class IndexWriter:
+    """Streams items into a new segment directory, keeping only their metadata in memory."""
+
+    def __init__(self, path, dtype="float32"):
+        self._created = not os.path.isdir(path)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self.dim = None
+        self.documents = {}
+
+        # Columnar metadata with byte offsets into the content buffer
+        self.columns = {"ids": [], "types": [], "pages": [], "paths": [], "documents": [], "offsets": [], "lengths": [],
+                        "bboxes": []}
+        self._norms = array("f")
+        self._raw_path = os.path.join(path, EMBEDDINGS_FILE + ".raw")
+        self._raw = open(self._raw_path, "wb")
+        self._content_path = os.path.join(path, CONTENT_FILE + ".tmp")
+        self._content = open(self._content_path, "wb")
+        self._content_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, item, embedding):
+        """Append one item and its embedding."""
+        self.add_many([item], np.asarray(embedding).reshape(1, -1))
+
+    def add_many(self, items, matrix):
+        """Append items (dicts or an ItemStore) and the matching rows of an embedding matrix."""
+        matrix = np.ascontiguousarray(matrix, dtype=self.dtype)
+        if len(items) == 0:
+            return
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match index dimension {self.dim}")
+
+        self._raw.write(matrix.tobytes())
+        self._norms.extend(np.linalg.norm(matrix.astype(np.float32), axis=1).tolist())
+
+        for item in items:
+            # Image bytes are never stored here, the blob store (or a legacy file) holds them; only a caption is
+            text = (item.get("caption") or "") if item["type"] == "image" else item.get("content", "")
+            encoded = text.encode("utf-8")
+            document = item.get("document", DEFAULT_DOCUMENT)
+
+            self.columns["ids"].append(item["id"])
+            self.columns["types"].append(item["type"])
+            self.columns["pages"].append(item["page"])
+            self.columns["paths"].append(item["path"])
+            self.columns["documents"].append(document)
+            self.columns["offsets"].append(self._content_size)
+            self.columns["lengths"].append(len(encoded))
+            bbox = item.get("bbox")
+            self.columns["bboxes"].append([float(v) for v in bbox] if bbox is not None else None)
+            self._content.write(encoded)
+            self._content_size += len(encoded)
+            self.documents[document] = self.documents.get(document, 0) + 1
+
+        self.count += len(items)
+
+    def close(self):
+        """Finish the segment files and publish them with the segment manifest."""
+        self._raw.close()
+        self._content.close()
+        dim = self.dim or 0
+
+        def write_matrix(tmp_path):
+            if self.count == 0:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, np.zeros((0, dim), dtype=self.dtype))
+                return
+
+            # Copy the raw rows into an .npy file in bounded chunks
+            raw = np.memmap(self._raw_path, dtype=self.dtype, mode="r", shape=(self.count, dim))
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(self.count, dim))
+            for start in range(0, self.count, COPY_CHUNK_ROWS):
+                out[start:start + COPY_CHUNK_ROWS] = raw[start:start + COPY_CHUNK_ROWS]
+            out.flush()
+            del out, raw
+
+        def write_norms(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.frombuffer(self._norms, dtype=np.float32))
+
+        def write_items(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.columns, f)
+
+        def write_segment_manifest(tmp_path):
+            manifest = {
+                "format": SEGMENT_FORMAT,
+                "version": SEGMENT_FORMAT_VERSION,
+                "count": self.count,
+                "dim": dim,
+                "dtype": str(self.dtype),
+                "documents": self.documents,
+            }
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+
+        _replace_file(os.path.join(self.path, EMBEDDINGS_FILE), write_matrix)
+        os.remove(self._raw_path)
+        _replace_file(os.path.join(self.path, NORMS_FILE), write_norms)
+        _replace_file(os.path.join(self.path, ITEMS_FILE), write_items)
+        os.replace(self._content_path, os.path.join(self.path, CONTENT_FILE))
+        # The segment manifest goes last so a partial segment is never loaded
+        _replace_file(os.path.join(self.path, SEGMENT_FILE), write_segment_manifest)
+
+    def abort(self):
+        """Discard everything written so far."""
+        self._raw.close()
+        self._content.close()
+        if self._created:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        for tmp_path in (self._raw_path, self._content_path):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def segment_entry(self):
+        """Manifest entry describing the finished segment."""
+        return {"name": self.name, "count": self.count, "documents": dict(self.documents)}
+
+def read_segment(path):
+    """Read one segment directory into an ItemStore, memory-mapping the embeddings."""
+    # Version 1 indexes are a single segment described by manifest.json
+    segment_file = os.path.join(path, SEGMENT_FILE)
+    if not os.path.isfile(segment_file):
+        segment_file = os.path.join(path, MANIFEST_FILE)
+    with open(segment_file, "r") as f:
+        manifest = json.load(f)
+
+    # Memory-map the embeddings so nothing is copied on load
+    if manifest["count"] > 0:
+        matrix = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        norms = np.load(os.path.join(path, NORMS_FILE), mmap_mode="r")
+    else:
+        matrix = np.zeros((0, manifest["dim"]), dtype=manifest["dtype"])
+        norms = np.zeros(0, dtype=np.float32)
+
+    with open(os.path.join(path, ITEMS_FILE), "r", encoding="utf-8") as f:
+        columns = json.load(f)
+    # Text stays in one buffer and is decoded only when a row is read
+    with open(os.path.join(path, CONTENT_FILE), "rb") as f:
+        content = f.read()
+
+    return ItemStore.from_columns(columns, content, matrix, norms)
+
+def _segment_path(path, name):
+    # A version 1 index is its own (only) segment
+    return path if name == "." else os.path.join(path, name)
+
+def new_segment_name():
+    """Return a fresh segment name; names sort in creation order."""
+    return f"seg_{time.time_ns():020d}"
+
+def read_manifest(path):
+    """Read and validate the manifest of an index directory."""
+    with open(os.path.join(path, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format") != INDEX_FORMAT:
+        raise ValueError(f"Not a RAG index: {path}")
+
+    # Present a version 1 index as a single segment
+    if manifest.get("version") == 1:
+        return {
+            "format": INDEX_FORMAT,
+            "version": INDEX_FORMAT_VERSION,
+            "segments": [{"name": ".", "count": manifest["count"], "documents": {DEFAULT_DOCUMENT: manifest["count"]}}],
+            "deleted": {},
+        }
+    if manifest.get("version") != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {manifest.get('version')} in {path}")
+
+    return manifest
+
+def manifest_fingerprint(path):
+    """Hash of the manifest, which changes with every write to the index."""
+    with open(os.path.join(path, MANIFEST_FILE), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _empty_manifest():
+    return {"format": INDEX_FORMAT, "version": INDEX_FORMAT_VERSION, "segments": [], "deleted": {}}
+
+def _write_manifest(path, manifest):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+
+    _replace_file(os.path.join(path, MANIFEST_FILE), write)
+
+def _upgrade_v1(path):
+    """Move a version 1 index into a segment subdirectory before it is modified."""
+    with open(os.path.join(path, MANIFEST_FILE), "r") as f:
+        old = json.load(f)
+    if old.get("version") != 1:
+        return
+
+    name = new_segment_name()
+    segment_path = os.path.join(path, name)
+    os.makedirs(segment_path)
+    for filename in (EMBEDDINGS_FILE, NORMS_FILE, ITEMS_FILE, CONTENT_FILE):
+        os.replace(os.path.join(path, filename), os.path.join(segment_path, filename))
+
+    documents = {DEFAULT_DOCUMENT: old["count"]} if old["count"] else {}
+    segment = dict(old, format=SEGMENT_FORMAT, version=SEGMENT_FORMAT_VERSION, documents=documents)
+    with open(os.path.join(segment_path, SEGMENT_FILE), "w") as f:
+        json.dump(segment, f)
+
+    manifest = _empty_manifest()
+    manifest["segments"].append({"name": name, "count": old["count"], "documents": documents})
+    _write_manifest(path, manifest)
+
+def _load_manifest_for_update(path):
+    if not is_index_dir(path):
+        os.makedirs(path, exist_ok=True)
+        return _empty_manifest()
+    _upgrade_v1(path)
+    return read_manifest(path)
+
+def _remove_segments(path, names):
+    for name in names:
+        if name != ".":
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def _mark_deleted(manifest, document_ids):
+    """Tombstone documents in the manifest. Returns segments left with no live rows."""
+    dropped = []
+    for segment in list(manifest["segments"]):
+        deleted = set(manifest["deleted"].get(segment["name"], []))
+        deleted.update(doc for doc in document_ids if doc in segment["documents"])
+        if not deleted:
+            continue
+
+        if deleted >= set(segment["documents"]):
+            # Nothing live is left, drop the whole segment
+            manifest["segments"].remove(segment)
+            manifest["deleted"].pop(segment["name"], None)
+            dropped.append(segment["name"])
+        else:
+            manifest["deleted"][segment["name"]] = sorted(deleted)
+    return dropped
+
+def live_documents(manifest):
+    """Return {document id: item count} for documents that are not deleted."""
+    documents = {}
+    for segment in manifest["segments"]:
+        deleted = set(manifest["deleted"].get(segment["name"], []))
+        for doc, count in segment["documents"].items():
+            if doc not in deleted:
+                documents[doc] = documents.get(doc, 0) + count
+    return documents
+
+def needs_compaction(manifest):
+    """Check whether there are too many segments or too many deleted rows."""
+    total = sum(segment["count"] for segment in manifest["segments"])
+    live = sum(live_documents(manifest).values())
+    return (len(manifest["segments"]) > COMPACT_MAX_SEGMENTS
+            or (total > 0 and (total - live) / total > COMPACT_DELETED_RATIO))
+
+def new_segment_writer(path, dtype="float32"):
+    """Return an IndexWriter for a new segment of the index at path."""
+    return IndexWriter(os.path.join(path, new_segment_name()), dtype=dtype)
+
+def commit_segment(path, writer, replace=True, documents=None):
+    """Add a finished segment to the index, replacing earlier versions of its documents."""
+    manifest = _load_manifest_for_update(path)
+
+    # Earlier versions are replaced even when the new version has no items
+    documents = set(writer.documents) | set(documents or [])
+    dropped = _mark_deleted(manifest, documents) if replace else []
+    if writer.count:
+        manifest["segments"].append(writer.segment_entry())
+    else:
+        dropped.append(writer.name)
+    _write_manifest(path, manifest)
+    _remove_segments(path, dropped)
+
+    if needs_compaction(manifest):
+        compact(path)
+
+def delete_documents(path, document_ids):
+    """Delete documents by rewriting only the manifest. Returns the number of items removed."""
+    manifest = _load_manifest_for_update(path)
+    before = live_documents(manifest)
+
+    dropped = _mark_deleted(manifest, document_ids)
+    _write_manifest(path, manifest)
+    _remove_segments(path, dropped)
+
+    removed = sum(count for doc, count in before.items() if doc in document_ids)
+    if needs_compaction(manifest):
+        compact(path)
+    return removed
+
+def compact(path, dtype=None):
+    """Merge all segments into one, dropping deleted rows."""
+    manifest = _load_manifest_for_update(path)
+    if not manifest["segments"]:
+        return
+
+    old_names = [segment["name"] for segment in manifest["segments"]]
+    writer = None
+    try:
+        for segment in manifest["segments"]:
+            store = read_segment(_segment_path(path, segment["name"]))
+            if writer is None:
+                writer = new_segment_writer(path, dtype=dtype or store.matrix.dtype)
+
+            store = store.take(~store.document_mask(manifest["deleted"].get(segment["name"], [])))
+            writer.add_many(store, store.matrix)
+        writer.close()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    manifest = _empty_manifest()
+    if writer.count:
+        manifest["segments"].append(writer.segment_entry())
+    else:
+        old_names.append(writer.name)
+    _write_manifest(path, manifest)
+    _remove_segments(path, old_names)
+
+    print(f"Compacted {len(old_names)} segments into {writer.count} items in {path}")
+
+def read_index_dir(path):
+    """Read every live item of an index directory into one ItemStore."""
+    manifest = read_manifest(path)
+
+    parts = []
+    for segment in manifest["segments"]:
+        store = read_segment(_segment_path(path, segment["name"]))
+        deleted = manifest["deleted"].get(segment["name"], [])
+        if deleted:
+            store = store.take(~store.document_mask(deleted))
+        parts.append(store)
+
+    if not parts:
+        return ItemStore.from_items([])
+    # Segments stay memory-mapped, deleted rows and several segments are only a view over them
+    if len(parts) == 1:
+        return parts[0]
+    return ItemStore.concatenate(parts)
+
+def write_index_dir(path, items, matrix, dtype="float32"):
+    """Replace the whole index at path with items and their embedding matrix."""
+    old_names = []
+    if is_index_dir(path):
+        manifest = _load_manifest_for_update(path)
+        old_names = [segment["name"] for segment in manifest["segments"]]
+    else:
+        os.makedirs(path, exist_ok=True)
+
+    with new_segment_writer(path, dtype=dtype) as writer:
+        writer.add_many(items, matrix)
+
+    manifest = _empty_manifest()
+    if writer.count:
+        manifest["segments"].append(writer.segment_entry())
+    else:
+        old_names.append(writer.name)
+    _write_manifest(path, manifest)
+    _remove_segments(path, old_names)
+
+def read_json_index(filename):
+    """Read a legacy rag_index.json file into items and an embedding matrix."""
+    with open(filename, "r") as f:
+        items = json.load(f)
+
+    items = [item for item in items if item.get("embedding") is not None]
+    if items:
+        matrix = np.array([item.pop("embedding") for item in items], dtype=np.float32)
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+
+    return items, matrix
+
+def migrate_index(filename, path=None, dtype="float32"):
+    """Convert a legacy JSON index into a binary index directory."""
+    if path is None:
+        path = os.path.splitext(filename)[0]
+
+    items, matrix = read_json_index(filename)
+    write_index_dir(path, items, matrix, dtype=dtype)
+
+    print(f"Migrated {len(items)} items from {filename} to {path}")
+    return path
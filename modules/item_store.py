@@ -0,0 +1,471 @@
+"""
+Columnar item store
+-------------------
+Indexed items held as columns instead of one dict per item:
+  matrix     (count, dim) embeddings, memory-mapped when loaded from disk; an index of
+             several segments or with deleted rows gets a SegmentedMatrix over them
+  norms      float32 row norms
+  types      uint8 codes into TYPES
+  pages      int32 page numbers
+  ids        interned id strings
+  paths      uint32 codes into a table of unique paths
+  documents  uint32 codes into a table of unique document ids
+  content    UTF-8 text of all items in one buffer, sliced by offset and length
+             (for image rows: their caption, if any)
+  bboxes     float32 (count, 4) rectangles on the page, NaN for rows without one
+
+Rows are read through ItemView, a small mapping that decodes fields on access,
+so code written for item dicts (match["content"], item.get("document")) still works.
+Image rows hold no bytes: their "image" field is a lazy ImageHandle on their path,
+and their "caption" field the figure caption found by layout extraction.
+
+Posting lists (sorted rows per type and per document, rows ordered by page) are
+built on the first filtered search and answer filters without scanning items.
+"""
+import sys
+from collections.abc import Mapping
+import numpy as np
+
+from modules.blob_store import ImageHandle
+
+TYPES = ("text", "image")
+FIELDS = ("id", "type", "content", "page", "path", "document", "image", "caption", "bbox")
+
+# Content of image items, whose bytes are read through item["image"] when needed
+IMAGE_PLACEHOLDER = "[BASE64_IMAGE]"
+
+# Document id for items indexed before documents were tracked
+DEFAULT_DOCUMENT = "default"
+
+_TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+def _intern_column(values):
+    """Encode strings as uint32 codes into a table of unique values."""
+    table = {}
+    codes = np.fromiter((table.setdefault(value, len(table)) for value in values), dtype=np.uint32, count=len(values))
+    return codes, list(table)
+
+def _remap(codes, table, merged):
+    """Re-encode codes of one table against a merged table."""
+    lookup = np.array([merged.setdefault(value, len(merged)) for value in table], dtype=np.uint32)
+    return lookup[codes] if len(table) else codes
+
+def _posting_lists(codes, count):
+    """Sorted rows of every code, from one stable argsort."""
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(count + 1))
+    return [order[bounds[i]:bounds[i + 1]] for i in range(count)]
+
+def _bbox_column(values):
+    """(count, 4) float32 rectangles, NaN where a value is None."""
+    missing = [float("nan")] * 4
+    return np.array([missing if value is None else value for value in values], dtype=np.float32).reshape(-1, 4)
+
+def _stored_content(item):
+    """Text stored for an item: its content, or for an image its caption."""
+    if item["type"] == "image":
+        return item.get("caption") or ""
+    return item.get("content", "")
+
+class SegmentedMatrix:
+    """Live rows of several matrices (memory-mapped segments) read as one matrix, without copying them.
+
+    parts are (matrix, rows) pairs, rows being the selected row numbers of that matrix or None
+    for all of them. Products score each whole part and keep its selected rows, indexing
+    gathers rows part by part; np.asarray() copies the rows into one array.
+    """
+
+    ndim = 2
+
+    def __init__(self, parts):
+        self.parts = [(matrix, rows) for matrix, rows in parts]
+        lengths = [len(matrix) if rows is None else len(rows) for matrix, rows in self.parts]
+        self._bounds = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self._bounds[1:])
+        self.dtype = self.parts[0][0].dtype
+        self.shape = (int(self._bounds[-1]), self.parts[0][0].shape[1])
+
+    @classmethod
+    def join(cls, matrices):
+        """One SegmentedMatrix over the rows of matrices and SegmentedMatrix objects, in order."""
+        parts = []
+        for matrix in matrices:
+            parts.extend(matrix.parts if isinstance(matrix, cls) else [(matrix, None)])
+        return cls(parts)
+
+    @property
+    def matrices(self):
+        return [matrix for matrix, _ in self.parts]
+
+    @property
+    def nbytes(self):
+        return self.shape[0] * self.shape[1] * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _locate(self, key):
+        """Row numbers of a slice, boolean mask or index array, and the part of each."""
+        if isinstance(key, slice):
+            rows = np.arange(*key.indices(len(self)))
+        else:
+            rows = np.asarray(key)
+            rows = np.flatnonzero(rows) if rows.dtype == bool else rows.astype(np.int64)
+            rows = np.where(rows < 0, rows + len(self), rows)
+        return rows, np.searchsorted(self._bounds, rows, side="right") - 1
+
+    def _part_rows(self, part, rows):
+        """Rows of the underlying matrix of a part for rows of this matrix."""
+        selected = self.parts[part][1]
+        local = rows - self._bounds[part]
+        return local if selected is None else selected[local]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self[np.array([key])][0]
+        rows, parts = self._locate(key)
+        out = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+        for part in np.unique(parts):
+            mask = parts == part
+            out[mask] = self.parts[part][0][self._part_rows(part, rows[mask])]
+        return out
+
+    def take_rows(self, key):
+        """A SegmentedMatrix of the selected rows, still over the same matrices."""
+        rows, parts = self._locate(key)
+        if np.any(np.diff(rows) < 0):
+            # Reordered rows do not keep the part order, gather them instead
+            return self[rows]
+        return SegmentedMatrix([(self.parts[part][0], self._part_rows(part, rows[parts == part]))
+                                for part in range(len(self.parts))])
+
+    def __matmul__(self, other):
+        other = np.asarray(other)
+        scores = []
+        for matrix, rows in self.parts:
+            part_scores = matrix @ other
+            scores.append(part_scores if rows is None else part_scores[rows])
+        return np.concatenate(scores)
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.concatenate([matrix if rows is None else matrix[rows] for matrix, rows in self.parts])
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+def _take_matrix(matrix, rows):
+    """Rows of a matrix; memory-mapped rows are selected through a view instead of copied."""
+    if isinstance(matrix, SegmentedMatrix):
+        return matrix.take_rows(rows)
+    if isinstance(matrix, np.memmap):
+        return SegmentedMatrix([(matrix, None)]).take_rows(rows)
+    return matrix[rows]
+
+def _as_list(value):
+    return [value] if isinstance(value, (str, int, np.integer)) else list(value)
+
+class ItemView(Mapping):
+    """Read-only view of one row; extra keys such as "similarity" live on the view."""
+
+    __slots__ = ("_store", "_row", "_extra")
+
+    def __init__(self, store, row, extra=None):
+        self._store = store
+        self._row = row
+        self._extra = extra
+
+    @property
+    def row(self):
+        return self._row
+
+    def __getitem__(self, key):
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        return self._store.field(self._row, key)
+
+    def __setitem__(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __iter__(self):
+        yield from FIELDS
+        if self._extra:
+            yield from (key for key in self._extra if key not in FIELDS)
+
+    def __len__(self):
+        return len(FIELDS) + sum(1 for key in (self._extra or ()) if key not in FIELDS)
+
+    def copy(self):
+        """Return a new view of the same row with its own extra keys."""
+        return ItemView(self._store, self._row, dict(self._extra) if self._extra else None)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class ItemStore:
+    """Items and their embeddings stored column by column."""
+
+    def __init__(self, ids, types, pages, paths, path_table, documents, document_table,
+                 content, offsets, lengths, matrix, norms=None, bboxes=None):
+        self.ids = ids
+        self.types = types
+        self.pages = pages
+        self.paths = paths
+        self.path_table = path_table
+        self.documents = documents
+        self.document_table = document_table
+        self.content = content
+        self.offsets = offsets
+        self.lengths = lengths
+        self.matrix = matrix
+        self.norms = norms
+        self.bboxes = bboxes if bboxes is not None else _bbox_column([None] * len(ids))
+        self._postings = None
+
+    @classmethod
+    def from_items(cls, items, matrix=None, norms=None):
+        """Build a store from item dicts. Without a matrix, items without an embedding are dropped."""
+        if matrix is None:
+            items = [item for item in items if item.get("embedding") is not None]
+            if items:
+                matrix = np.vstack([np.asarray(item["embedding"], dtype=np.float32) for item in items])
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            items = list(items)
+
+        encoded = [_stored_content(item).encode("utf-8") for item in items]
+        lengths = np.fromiter((len(text) for text in encoded), dtype=np.int64, count=len(encoded))
+        offsets = np.zeros(len(encoded), dtype=np.int64)
+        if len(encoded):
+            np.cumsum(lengths[:-1], out=offsets[1:])
+
+        paths, path_table = _intern_column([item["path"] for item in items])
+        documents, document_table = _intern_column([item.get("document", DEFAULT_DOCUMENT) for item in items])
+        return cls(
+            ids=np.array([sys.intern(item["id"]) for item in items], dtype=object),
+            types=np.array([_TYPE_CODES[item["type"]] for item in items], dtype=np.uint8),
+            pages=np.array([item["page"] for item in items], dtype=np.int32),
+            paths=paths,
+            path_table=path_table,
+            documents=documents,
+            document_table=document_table,
+            content=b"".join(encoded),
+            offsets=offsets,
+            lengths=lengths,
+            matrix=matrix,
+            norms=norms,
+            bboxes=_bbox_column([item.get("bbox") for item in items]),
+        )
+
+    @classmethod
+    def from_columns(cls, columns, content, matrix, norms=None):
+        """Build a store from the columnar metadata of a segment (items.json) and its content buffer."""
+        count = len(columns["ids"])
+        paths, path_table = _intern_column(columns["paths"])
+        documents, document_table = _intern_column(columns.get("documents") or [DEFAULT_DOCUMENT] * count)
+        return cls(
+            ids=np.array([sys.intern(item_id) for item_id in columns["ids"]], dtype=object),
+            types=np.array([_TYPE_CODES[item_type] for item_type in columns["types"]], dtype=np.uint8),
+            pages=np.array(columns["pages"], dtype=np.int32),
+            paths=paths,
+            path_table=path_table,
+            documents=documents,
+            document_table=document_table,
+            content=content,
+            offsets=np.array(columns["offsets"], dtype=np.int64),
+            lengths=np.array(columns["lengths"], dtype=np.int64),
+            matrix=matrix,
+            norms=norms,
+            # Indexes written before bounding boxes were recorded have none
+            bboxes=_bbox_column(columns.get("bboxes") or [None] * count),
+        )
+
+    @classmethod
+    def concatenate(cls, stores):
+        """Join stores into one, merging their string tables and content buffers."""
+        path_table, document_table = {}, {}
+        paths, documents, offsets = [], [], []
+        base = 0
+        for store in stores:
+            paths.append(_remap(store.paths, store.path_table, path_table))
+            documents.append(_remap(store.documents, store.document_table, document_table))
+            offsets.append(store.offsets + base)
+            base += len(store.content)
+
+        # Memory-mapped segments are kept as they are behind a SegmentedMatrix
+        matrices = [store.matrix for store in stores if len(store)]
+        mapped = any(isinstance(matrix, (np.memmap, SegmentedMatrix)) for matrix in matrices)
+        if len(matrices) > 1:
+            matrix = SegmentedMatrix.join(matrices) if mapped else np.concatenate(matrices)
+        else:
+            matrix = matrices[0] if matrices else stores[0].matrix
+        norms = [store.norms for store in stores]
+        return cls(
+            ids=np.concatenate([store.ids for store in stores]),
+            types=np.concatenate([store.types for store in stores]),
+            pages=np.concatenate([store.pages for store in stores]),
+            paths=np.concatenate(paths),
+            path_table=list(path_table),
+            documents=np.concatenate(documents),
+            document_table=list(document_table),
+            content=b"".join(bytes(store.content) for store in stores),
+            offsets=np.concatenate(offsets),
+            lengths=np.concatenate([store.lengths for store in stores]),
+            matrix=matrix,
+            norms=np.concatenate(norms) if all(n is not None for n in norms) else None,
+            bboxes=np.concatenate([store.bboxes for store in stores]),
+        )
+
+    def take(self, rows):
+        """Return a store of the selected rows (indices or a boolean mask), sharing the content buffer.
+
+        Memory-mapped embeddings are not copied, the store gets a SegmentedMatrix over them.
+        """
+        return ItemStore(
+            ids=self.ids[rows],
+            types=self.types[rows],
+            pages=self.pages[rows],
+            paths=self.paths[rows],
+            path_table=self.path_table,
+            documents=self.documents[rows],
+            document_table=self.document_table,
+            content=self.content,
+            offsets=self.offsets[rows],
+            lengths=self.lengths[rows],
+            matrix=_take_matrix(self.matrix, rows),
+            norms=self.norms[rows] if self.norms is not None else None,
+            bboxes=self.bboxes[rows],
+        )
+
+    def relabel(self, document_id):
+        """Return the same rows assigned to a single document."""
+        store = self.take(slice(None))
+        store.documents = np.zeros(len(self), dtype=np.uint32)
+        store.document_table = [document_id]
+        return store
+
+    def document_mask(self, document_ids):
+        """Boolean mask of the rows belonging to any of the given documents."""
+        document_ids = set(document_ids)
+        codes = [code for code, doc in enumerate(self.document_table) if doc in document_ids]
+        return np.isin(self.documents, codes)
+
+    def repeated_image_rows(self):
+        """Sorted image rows showing the same image (path) as an earlier row, e.g. references
+        to a logo repeated on every page; they share its embedding."""
+        image_rows = np.flatnonzero(self.types == _TYPE_CODES["image"])
+        # Images without a path have nothing to share
+        if "" in self.path_table:
+            image_rows = image_rows[self.paths[image_rows] != self.path_table.index("")]
+        _, first = np.unique(self.paths[image_rows], return_index=True)
+        return np.setdiff1d(image_rows, image_rows[first])
+
+    def postings(self):
+        """Posting lists for filtering, built once per store."""
+        if self._postings is None:
+            page_order = np.argsort(self.pages, kind="stable")
+            self._postings = {
+                "type": _posting_lists(self.types, len(TYPES)),
+                "document": dict(zip(self.document_table, _posting_lists(self.documents, len(self.document_table)))),
+                "page_order": page_order,
+                "sorted_pages": self.pages[page_order],
+            }
+        return self._postings
+
+    def filter_rows(self, filters=None):
+        """Sorted rows matching all filters, or None when nothing is filtered.
+
+        filters may hold "type" ("text"/"image" or a list), "document" (an id or a
+        list) and "pages" (a page number or an inclusive (first, last) pair, 0-based
+        like item["page"]).
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value is not None}
+        if not filters:
+            return None
+        unknown = set(filters) - {"type", "document", "pages"}
+        if unknown:
+            raise ValueError(f"Unknown filter: {', '.join(sorted(unknown))}")
+
+        postings = self.postings()
+        matches = []
+        if "type" in filters:
+            types = _as_list(filters["type"])
+            for item_type in types:
+                if item_type not in _TYPE_CODES:
+                    raise ValueError(f"Unknown item type '{item_type}', expected one of: {', '.join(TYPES)}")
+            matches.append(np.concatenate([postings["type"][_TYPE_CODES[t]] for t in types]))
+        if "document" in filters:
+            empty = np.zeros(0, dtype=np.int64)
+            matches.append(np.concatenate([postings["document"].get(doc, empty) for doc in _as_list(filters["document"])]))
+        if "pages" in filters:
+            pages = filters["pages"]
+            first, last = (pages, pages) if isinstance(pages, (int, np.integer)) else pages
+            lo, hi = np.searchsorted(postings["sorted_pages"], [first, last + 1])
+            matches.append(postings["page_order"][lo:hi])
+
+        # Intersect the smallest lists first
+        matches.sort(key=len)
+        rows = np.unique(matches[0])
+        for other in matches[1:]:
+            rows = np.intersect1d(rows, other)
+        return rows.astype(np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (ItemView(self, row) for row in range(len(self)))
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("item index out of range")
+        return ItemView(self, row)
+
+    def view(self, row, **extra):
+        """Return a view of a row carrying extra keys."""
+        return ItemView(self, row, extra or None)
+
+    def text(self, row):
+        """Decode the content of a row."""
+        offset = self.offsets[row]
+        return bytes(self.content[offset:offset + self.lengths[row]]).decode("utf-8")
+
+    def field(self, row, key):
+        """Value of one field of a row."""
+        if key == "content":
+            # Image bytes stay behind the "image" handle, the index keeps no base64 (only a caption)
+            if self.types[row] == _TYPE_CODES["image"]:
+                return IMAGE_PLACEHOLDER
+            return self.text(row)
+        if key == "id":
+            return self.ids[row]
+        if key == "type":
+            return TYPES[self.types[row]]
+        if key == "page":
+            return int(self.pages[row])
+        if key == "path":
+            return self.path_table[self.paths[row]]
+        if key == "document":
+            return self.document_table[self.documents[row]]
+        if key == "image":
+            if self.types[row] != _TYPE_CODES["image"]:
+                return None
+            return ImageHandle(self.path_table[self.paths[row]])
+        if key == "caption":
+            if self.types[row] != _TYPE_CODES["image"] or self.lengths[row] == 0:
+                return None
+            return self.text(row)
+        if key == "bbox":
+            bbox = self.bboxes[row]
+            return None if np.isnan(bbox[0]) else bbox.tolist()
+        raise KeyError(key)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the metadata (the embeddings are not counted)."""
+        arrays = (self.ids, self.types, self.pages, self.paths, self.documents, self.offsets, self.lengths, self.bboxes)
+        strings = sum(sys.getsizeof(value) for value in self.ids)
+        strings += sum(sys.getsizeof(value) for value in self.path_table + self.document_table)
+        return sum(array.nbytes for array in arrays) + strings + len(self.content)
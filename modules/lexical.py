@@ -0,0 +1,111 @@
+"""
+Lexical (BM25) search
+---------------------
+An inverted index over the text items of an ItemStore. Postings use a CSR
+layout: for term t, rows[offsets[t]:offsets[t + 1]] are the items containing
+it and impacts[...] their precomputed BM25 weights (idf and length
+normalization included), so a query is a gather-and-add over its terms.
+Image items have no text and never match.
+"""
+import re
+from collections import Counter
+import numpy as np
+
+from modules.item_store import TYPES
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text):
+    """Lowercased word tokens of a text."""
+    return _TOKEN.findall(text.lower())
+
+class BM25Index:
+    """Term -> (rows, impacts) postings of the text items of an index."""
+
+    def __init__(self, terms, offsets, rows, impacts, fingerprint=""):
+        self.terms = terms
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.impacts = impacts
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, items, k1=1.2, b=0.75, fingerprint=""):
+        """Index the text rows of an ItemStore."""
+        vocabulary = {}
+        term_ids, rows, tfs = [], [], []
+        lengths = np.zeros(len(items), dtype=np.float32)
+
+        text_rows = np.flatnonzero(items.types == TYPES.index("text"))
+        for row in text_rows:
+            tokens = tokenize(items.text(row))
+            lengths[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                rows.append(row)
+                tfs.append(tf)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        rows = np.array(rows, dtype=np.uint32)
+        tfs = np.array(tfs, dtype=np.float32)
+
+        # Group postings by term (rows stay ascending within a term)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, rows, tfs = term_ids[order], rows[order], tfs[order]
+        df = np.bincount(term_ids, minlength=len(vocabulary))
+        offsets = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+
+        # BM25 weight of every posting, computed once
+        n_docs = max(len(text_rows), 1)
+        avg_length = lengths[text_rows].mean() if len(text_rows) else 1.0
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths[rows] / avg_length)
+        impacts = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        return cls(list(vocabulary), offsets, rows, impacts, fingerprint)
+
+    def __len__(self):
+        return len(self.terms)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.rows.nbytes + self.impacts.nbytes + sum(len(t) + 50 for t in self.terms)
+
+    def scores(self, query_text, count):
+        """BM25 score of every row (count rows in total) for a query."""
+        scores = np.zeros(count, dtype=np.float32)
+        for term in set(tokenize(query_text)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            # Rows are unique within a term, so plain fancy-index addition is safe
+            scores[self.rows[start:stop]] += self.impacts[start:stop]
+        return scores
+
+    def save(self, path):
+        """Write the index to an .npz file."""
+        vocabulary = np.frombuffer("\n".join(self.terms).encode("utf-8"), dtype=np.uint8)
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                vocabulary=vocabulary,
+                offsets=self.offsets,
+                rows=self.rows,
+                impacts=self.impacts,
+                fingerprint=np.array(self.fingerprint),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()."""
+        with np.load(path) as data:
+            text = data["vocabulary"].tobytes().decode("utf-8")
+            return cls(
+                text.split("\n") if text else [],
+                data["offsets"],
+                data["rows"],
+                data["impacts"],
+                str(data["fingerprint"]),
+            )
@@ -0,0 +1,143 @@
+"""
+Model provider
+--------------
+Lazily created, cached model handles shared by every query and embedding run.
+Handles are keyed by model name and config. Factories can be swapped for
+local fakes so the pipeline can be benchmarked offline.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import numpy as np
+from vertexai.vision_models import MultiModalEmbeddingModel
+from vertexai.generative_models import GenerativeModel
+
+from config import EMBEDDING_MODEL, EMBEDDING_DIM, LLM_MODEL, FAKE_MODELS
+
+class _FakeEmbeddings:
+    def __init__(self, text_embedding=None, image_embedding=None):
+        self.text_embedding = text_embedding
+        self.image_embedding = image_embedding
+
+class FakeEmbeddingModel:
+    """Local stand-in for MultiModalEmbeddingModel with deterministic vectors."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, key, dimension):
+        seed = int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(dimension).tolist()
+
+    def get_embeddings(self, image=None, contextual_text=None, dimension=EMBEDDING_DIM):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        text_embedding = self._vector(f"text:{contextual_text}", dimension)
+        image_embedding = None
+        if image is not None:
+            image_bytes = getattr(image, "_image_bytes", None) or b""
+            image_embedding = self._vector(f"image:{hashlib.sha256(image_bytes).hexdigest()}", dimension)
+        return _FakeEmbeddings(text_embedding, image_embedding)
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeLLMModel:
+    """Local stand-in for GenerativeModel that answers after a fixed latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return self._stream(["[fake ", "answer]"])
+        if self.latency:
+            time.sleep(self.latency)
+        return _FakeResponse("[fake answer]")
+
+    def _stream(self, chunks):
+        # The latency is spread over the chunks
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield _FakeResponse(chunk)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            return self._astream(["[fake ", "answer]"])
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return _FakeResponse("[fake answer]")
+
+    async def _astream(self, chunks):
+        for chunk in chunks:
+            if self.latency:
+                await asyncio.sleep(self.latency / len(chunks))
+            yield _FakeResponse(chunk)
+
+def _load_embedding_model(name, **config):
+    return MultiModalEmbeddingModel.from_pretrained(name)
+
+def _load_llm_model(name, **config):
+    return GenerativeModel(name, **config)
+
+def _load_fake_embedding_model(name, **config):
+    return FakeEmbeddingModel()
+
+def _load_fake_llm_model(name, **config):
+    return FakeLLMModel()
+
+if FAKE_MODELS:
+    _factories = {"embedding": _load_fake_embedding_model, "llm": _load_fake_llm_model}
+else:
+    _factories = {"embedding": _load_embedding_model, "llm": _load_llm_model}
+
+_models = {}
+_lock = threading.Lock()
+
+def get_model(kind, name, **config):
+    """Return a cached model handle, creating it on first use."""
+    key = (kind, name, repr(sorted(config.items())))
+
+    model = _models.get(key)
+    if model is None:
+        # Streamlit runs scripts on several threads, create each handle once
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = _factories[kind](name, **config)
+                _models[key] = model
+
+    return model
+
+def get_embedding_model(name=EMBEDDING_MODEL):
+    """Return the shared multimodal embedding model."""
+    return get_model("embedding", name)
+
+def get_llm_model(name=LLM_MODEL, **config):
+    """Return the shared generative model."""
+    return get_model("llm", name, **config)
+
+def set_model_factory(kind, factory):
+    """Replace how models of a kind are created, e.g. with a local fake. Returns the old factory."""
+    with _lock:
+        previous = _factories[kind]
+        _factories[kind] = factory
+        # Drop handles created by the previous factory
+        for key in [key for key in _models if key[0] == kind]:
+            del _models[key]
+
+    return previous
+
+def reset_models():
+    """Drop every cached model handle."""
+    with _lock:
+        _models.clear()
@@ -0,0 +1,218 @@
+"""
+Ingestion pipeline
+------------------
+Streams a PDF through extraction, embedding and index writing. The stages run
+concurrently and are connected by bounded queues, so memory stays flat as
+documents grow and embedding starts as soon as the first pages are extracted.
+"""
+import queue
+import threading
+import time
+import pymupdf
+
+from config import PIPELINE_QUEUE_SIZE, EMBEDDING_CONCURRENCY, EXTRACTION_WORKERS
+from modules.extraction import iter_extract_pages, document_id_for
+from modules.image_filter import ImageFilter, format_filter_stats
+from modules.embedding import iter_embeddings
+from modules.index_format import new_segment_writer, commit_segment
+from modules.retrieval import writable_index_path
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class StageStats:
+    """Throughput and queue-depth counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self.queue_depth_max = 0
+        self._queue_depth_total = 0
+        self._queue_samples = 0
+
+    def sample_queue(self, depth):
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+        self._queue_depth_total += depth
+        self._queue_samples += 1
+
+    def as_dict(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started if self.started else 0.0
+        return {
+            "items": self.items,
+            "seconds": elapsed,
+            "busy_seconds": self.busy_seconds,
+            "items_per_second": self.items / elapsed if elapsed > 0 else 0.0,
+            "queue_depth_max": self.queue_depth_max,
+            "queue_depth_mean": self._queue_depth_total / self._queue_samples if self._queue_samples else 0.0,
+        }
+
+class IngestionPipeline:
+    """Extract, embed and index a PDF with the stages connected by bounded queues."""
+
+    def __init__(self, pdf_path, index_path=None, document_id=None, queue_size=PIPELINE_QUEUE_SIZE,
+                 extraction_workers=EXTRACTION_WORKERS, embedding_concurrency=EMBEDDING_CONCURRENCY):
+        self.pdf_path = pdf_path
+        self.index_path = writable_index_path(index_path)
+        self.document_id = document_id or document_id_for(pdf_path)
+        self.extraction_workers = extraction_workers
+        self.embedding_concurrency = embedding_concurrency
+
+        self.extracted = queue.Queue(maxsize=queue_size)
+        self.embedded = queue.Queue(maxsize=queue_size)
+        self.stages = {name: StageStats(name) for name in ("extract", "embed", "index")}
+
+        with pymupdf.open(pdf_path) as doc:
+            self.page_count = doc.page_count
+        self.pages = 0
+        self.counts = {"text": 0, "image": 0, "failed": 0}
+        self.image_filter = ImageFilter()
+        self._stop = threading.Event()
+        self._errors = []
+        self._extracted_all = False
+
+    def _put(self, q, item):
+        # Give up when another stage has failed instead of blocking forever
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, stats):
+        while True:
+            stats.sample_queue(q.qsize())
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _DONE
+
+    def _run_stage(self, target, output):
+        try:
+            target()
+        except Exception as e:
+            # Recorded before the end is signalled, so the index stage never mistakes a failure for the end
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            self._put(output, _DONE)
+
+    def _extract(self):
+        stats = self.stages["extract"]
+        stats.started = time.perf_counter()
+        try:
+            last = time.perf_counter()
+            for _, page_items in iter_extract_pages(self.pdf_path, workers=self.extraction_workers,
+                                                    document_id=self.document_id, image_filter=self.image_filter):
+                stats.busy_seconds += time.perf_counter() - last
+                self.pages += 1
+                for item in page_items:
+                    stats.items += 1
+                    if not self._put(self.extracted, item):
+                        return
+                last = time.perf_counter()
+            self._extracted_all = True
+        finally:
+            stats.finished = time.perf_counter()
+
+    def _extracted_items(self):
+        while True:
+            item = self._get(self.extracted, self.stages["embed"])
+            if item is _DONE:
+                return
+            yield item
+
+    def _embed(self):
+        stats = self.stages["embed"]
+        stats.started = time.perf_counter()
+        try:
+            last = time.perf_counter()
+            for item in iter_embeddings(self._extracted_items(), concurrency=self.embedding_concurrency):
+                stats.busy_seconds += time.perf_counter() - last
+                stats.items += 1
+                if not self._put(self.embedded, item):
+                    return
+                last = time.perf_counter()
+        finally:
+            stats.finished = time.perf_counter()
+
+    def run(self, progress=None):
+        """Run the pipeline and return per-stage stats. progress(pipeline) is called per indexed item."""
+        print(f"Ingesting PDF: {self.pdf_path}")
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._extract, self.extracted), name="extract", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._embed, self.embedded), name="embed", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        stats = self.stages["index"]
+        stats.started = time.perf_counter()
+        try:
+            # The document goes into a new segment, replacing any earlier version
+            with new_segment_writer(self.index_path) as writer:
+                while True:
+                    item = self._get(self.embedded, stats)
+                    if item is _DONE:
+                        break
+
+                    start = time.perf_counter()
+                    if item.get("embedding") is None:
+                        self.counts["failed"] += 1
+                    else:
+                        writer.add(item, item.pop("embedding"))
+                        self.counts[item["type"]] += 1
+                        stats.items += 1
+                    stats.busy_seconds += time.perf_counter() - start
+
+                    if progress is not None:
+                        progress(self)
+
+                # A truncated document must not replace the indexed version
+                if self._errors:
+                    raise self._errors[0]
+                if not self._extracted_all:
+                    raise RuntimeError(f"Extraction of '{self.document_id}' stopped before the last page")
+            commit_segment(self.index_path, writer, documents=[self.document_id])
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            stats.finished = time.perf_counter()
+
+        print(f"Indexed {stats.items} items ({self.counts['text']} text chunks and {self.counts['image']} images) "
+              f"from {self.pages} pages of '{self.document_id}' to {self.index_path}")
+        if self.image_filter.enabled:
+            print(format_filter_stats(self.image_filter.stats()))
+        if self.counts["failed"]:
+            print(f"Dropped {self.counts['failed']} items that could not be embedded")
+        return self.stats()
+
+    def stats(self):
+        """Return per-stage throughput and queue-depth stats."""
+        return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+    def image_stats(self):
+        """Return how many images were skipped or deduplicated, and the embedding calls saved."""
+        return self.image_filter.stats()
+
+def format_stats(stats):
+    """Return a text table of pipeline stats."""
+    lines = ["stage     items   seconds   items/s   busy(s)   queue max   queue mean"]
+    for name, stage in stats.items():
+        lines.append(
+            f"{name:<8}{stage['items']:7d}{stage['seconds']:10.2f}{stage['items_per_second']:10.1f}"
+            f"{stage['busy_seconds']:10.2f}{stage['queue_depth_max']:12d}{stage['queue_depth_mean']:13.1f}"
+        )
+    return "\n".join(lines)
+
+def ingest_pdf(pdf_path, index_path=None, document_id=None, progress=None):
+    """Stream a PDF into an index as one document and return the pipeline with its stats."""
+    pipeline = IngestionPipeline(pdf_path, index_path=index_path, document_id=document_id)
+    pipeline.run(progress=progress)
+    return pipeline
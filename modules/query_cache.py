@@ -0,0 +1,161 @@
+"""
+Query embedding cache
+---------------------
+Process-wide LRU of question text -> normalized float32 embedding, shared by
+the CLI and Streamlit. Misses fall back to the persistent embedding cache
+(questions are embedded with the same request as text chunks) before calling
+the API, so a cached question reaches retrieval without any network round trip.
+"""
+import asyncio
+import json
+import threading
+import numpy as np
+
+from config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_DIM,
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_RATE_LIMIT,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_CACHE_ENABLED,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_PERSIST,
+)
+from modules.models import get_embedding_model
+from modules.embedding import embed_item
+from modules.embedding_cache import embedding_key, get_embedding_cache
+from utils.cache import LRUCache
+from utils.concurrency import retry_call_async, run_blocking, run_sync, shared_limiter
+
+def _normalized(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+class QueryEmbeddingCache:
+    """Bounded LRU of normalized question embeddings with an optional persistent tier."""
+
+    def __init__(self, max_items=QUERY_CACHE_SIZE, persistent=None):
+        self.memory = LRUCache(max_items=max_items)
+        self.persistent = persistent
+
+    @staticmethod
+    def key(question):
+        return embedding_key(EMBEDDING_MODEL, EMBEDDING_DIM, "text", question, "")
+
+    def get(self, question):
+        """Return the normalized embedding of a question, or None."""
+        vector = self.memory.get(question)
+        if vector is None and self.persistent is not None:
+            vector = self.persistent.get(self.key(question))
+            if vector is not None:
+                vector = _normalized(vector)
+                self.memory.put(question, vector)
+        return vector
+
+    def put(self, question, embedding):
+        """Cache a question embedding and return it normalized."""
+        if self.persistent is not None:
+            self.persistent.put(self.key(question), embedding)
+        vector = _normalized(embedding)
+        self.memory.put(question, vector)
+        return vector
+
+    def __len__(self):
+        return len(self.memory)
+
+    def stats(self):
+        """Return hit/miss counters of the in-memory tier."""
+        return self.memory.stats()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_query_cache():
+    """Return the shared query embedding cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            persistent = get_embedding_cache() if EMBEDDING_CACHE_ENABLED and QUERY_CACHE_PERSIST else None
+            _cache = QueryEmbeddingCache(persistent=persistent)
+        return _cache
+
+async def aembed_questions(questions, concurrency=EMBEDDING_CONCURRENCY, rate_limit=EMBEDDING_RATE_LIMIT,
+                           max_retries=EMBEDDING_MAX_RETRIES, model=None, cache=None):
+    """Async embed_questions: misses are embedded concurrently on the shared thread pool."""
+    cache = get_query_cache() if cache is None else cache
+    # Misses in memory read the persistent tier (SQLite), which must not block the loop
+    embeddings = await run_blocking(lambda: [cache.get(question) for question in questions])
+    missing = list(dict.fromkeys(q for q, embedding in zip(questions, embeddings) if embedding is None))
+    if not missing:
+        return embeddings
+
+    if model is None:
+        model = get_embedding_model()
+    limiter = shared_limiter("embedding", rate_limit)
+    # The embedding API has no async client, each call holds a pool thread
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed(question):
+        async with semaphore:
+            try:
+                embedding = await retry_call_async(
+                    lambda: run_blocking(embed_item, model, {"type": "text"}, question, ""),
+                    max_retries=max_retries,
+                    limiter=limiter
+                )
+                return await run_blocking(cache.put, question, embedding)
+            except Exception as e:
+                print(f"Error embedding question '{question}': {e}")
+                return None
+
+    embedded = dict(zip(missing, await asyncio.gather(*(embed(q) for q in missing))))
+    return [embedded[q] if embedding is None else embedding for q, embedding in zip(questions, embeddings)]
+
+async def aembed_question(question, cache=None):
+    """Async embed_question."""
+    embedding = (await aembed_questions([question], cache=cache))[0]
+    if embedding is None:
+        raise RuntimeError(f"Could not embed question: {question}")
+    return embedding
+
+def embed_questions(questions, concurrency=EMBEDDING_CONCURRENCY, rate_limit=EMBEDDING_RATE_LIMIT,
+                    max_retries=EMBEDDING_MAX_RETRIES, model=None, cache=None):
+    """Return normalized embeddings of questions in input order (None on failure), calling the API only for misses."""
+    cache = get_query_cache() if cache is None else cache
+    # All hits need neither the API nor the event loop
+    embeddings = [cache.get(question) for question in questions]
+    if all(embedding is not None for embedding in embeddings):
+        return embeddings
+    return run_sync(aembed_questions(questions, concurrency=concurrency, rate_limit=rate_limit,
+                                     max_retries=max_retries, model=model, cache=cache))
+
+def embed_question(question, cache=None):
+    """Return the normalized embedding of one question, from the cache when possible."""
+    embedding = embed_questions([question], cache=cache)[0]
+    if embedding is None:
+        raise RuntimeError(f"Could not embed question: {question}")
+    return embedding
+
+def load_questions(path):
+    """Read questions from a .jsonl file ({"question": ...} objects or strings) or a text file, one per line."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                line = record if isinstance(record, str) else record["question"]
+            questions.append(line)
+    return questions
+
+def warm_up(questions, concurrency=EMBEDDING_CONCURRENCY):
+    """Pre-embed expected questions so their first query needs no API call. Returns the number embedded."""
+    cache = get_query_cache()
+    questions = list(dict.fromkeys(questions))
+    embeddings = embed_questions(questions, concurrency=concurrency, cache=cache)
+    ready = sum(embedding is not None for embedding in embeddings)
+    print(f"Warmed up query cache with {ready} of {len(questions)} questions")
+    return ready
@@ -1,106 +1,516 @@
 import os
-import json
+import mmap
 import numpy as np
-from PIL import Image as PILImage
-import base64
-
-from config import INDEX_DIR
-
-def find_similar_items(query_embedding, items, top_k=5):
-    """Find most similar items using cosine similarity."""
-
-    # Calculate cosine similarity manually
-    def cosine_similarity(v1, v2):
-        # Dot product
-        dot_product = np.dot(v1, v2)
-        # Magnitudes
-        norm_v1 = np.linalg.norm(v1)
-        norm_v2 = np.linalg.norm(v2)
-        # Avoid division by zero
-        if norm_v1 == 0 or norm_v2 == 0:
-            return 0
-        # Cosine similarity
-        return dot_product / (norm_v1 * norm_v2)
-
-    # Calculate similarity for each item
-    similarities = []
-    for idx, item in enumerate(items):
-        if "embedding" in item and item["embedding"] is not None:
-            sim = cosine_similarity(query_embedding, item["embedding"])
-            similarities.append((idx, sim))
-
-    # Sort by similarity (highest first)
-    similarities.sort(key=lambda x: x[1], reverse=True)
-
-    # Return top k matches
-    results = []
-    for idx, sim in similarities[:top_k]:
-        item_copy = items[idx].copy()
-        item_copy["similarity"] = float(sim)
-        results.append(item_copy)
-
-    return results
-
-def save_index(items, filename=None):
+
+from config import (
+    DEFAULT_INDEX_PATH,
+    ANN_ENABLED,
+    ANN_MIN_ITEMS,
+    ANN_N_LISTS,
+    ANN_NPROBE,
+    EMBEDDING_STORE,
+    PQ_SUBSPACES,
+    RERANK_FACTOR,
+    RETRIEVAL_MODE,
+    HYBRID_DEPTH,
+    RRF_K,
+    BM25_K1,
+    BM25_B,
+)
+from modules.ann import IVFIndex
+from modules.lexical import BM25Index
+from modules.item_store import ItemStore, SegmentedMatrix, TYPES
+from modules.quantization import build_store, save_store, load_store
+from modules.index_format import (
+    ANN_FILE,
+    LEXICAL_FILE,
+    MANIFEST_FILE,
+    commit_segment,
+    compact,
+    delete_documents,
+    is_index_dir,
+    live_documents,
+    manifest_fingerprint,
+    migrate_index,
+    new_segment_writer,
+    read_index_dir,
+    read_manifest,
+    write_index_dir,
+)
+
+def is_memory_mapped(array):
+    """Check whether an array's data comes from a memory-mapped file."""
+    if isinstance(array, SegmentedMatrix):
+        return all(is_memory_mapped(matrix) for matrix in array.matrices)
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+def select_top_k(scores, top_k, rows=None):
+    """Return (row, score) pairs of the top_k scores, highest first. rows maps scores to index rows."""
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return []
+
+    # Select the top k without sorting every score
+    if k < len(scores):
+        positions = np.argpartition(-scores, k - 1)[:k]
+    else:
+        positions = np.arange(len(scores))
+    if rows is None:
+        rows = np.arange(len(scores))
+
+    # Order the selection by similarity, ties by position in the index
+    positions = positions[np.lexsort((rows[positions], -scores[positions]))]
+    return [(int(rows[pos]), float(scores[pos])) for pos in positions]
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# Upper bound on the (rows x queries) score block of a batched search
+BATCH_SCORE_ELEMENTS = 1 << 24
+
+def reciprocal_rank_fusion(rankings, top_k, k=RRF_K):
+    """Fuse (row, score) rankings by summing 1 / (k + rank) per row; returns (row, fused score) pairs."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    # Highest fused score first, ties by position in the index
+    return sorted(fused.items(), key=lambda pair: (-pair[1], pair[0]))[:top_k]
+
+class VectorIndex:
+    """Embeddings of indexed items held in one contiguous float32 matrix, or a SegmentedMatrix over memory-mapped segments."""
+
+    def __init__(self, items, matrix=None, norms=None):
+        # Items live in a columnar store whose matrix rows line up with them
+        if not isinstance(items, ItemStore):
+            items = ItemStore.from_items(items, matrix, norms)
+        self.items = items
+        # Segments read from disk stay memory-mapped behind a SegmentedMatrix
+        matrix = items.matrix
+        self.matrix = matrix if isinstance(matrix, SegmentedMatrix) else np.ascontiguousarray(matrix)
+        norms = items.norms
+
+        # Norms are computed once here instead of on every query
+        if norms is None:
+            norms = np.linalg.norm(np.asarray(self.matrix), axis=1)
+        norms = np.asarray(norms, dtype=np.float32)
+        self.inv_norms = np.zeros_like(norms)
+        np.divide(1.0, norms, out=self.inv_norms, where=norms > 0)
+
+        # Image rows repeating an earlier image; searches fetch this many more rows, then collapse them
+        self.repeated_images = len(items.repeated_image_rows())
+
+        # Optional approximate search structure (see build_ann)
+        self.ann = None
+        # Optional compressed embeddings scored instead of the matrix (see compress)
+        self.store = None
+        # BM25 index over the text items, loaded or built on first lexical search
+        self.lexical = None
+        # Index directory and manifest fingerprint, when loaded from disk
+        self.path = None
+        self.version = None
+        # Called when a structure is attached after loading, so a cache holding the index can re-measure it
+        self.on_resize = None
+
+    def _resized(self):
+        if self.on_resize is not None:
+            self.on_resize()
+
+    def build_ann(self, n_lists=None, fingerprint=""):
+        """Build an IVF index so queries score only the closest clusters."""
+        self.ann = IVFIndex.build(self.matrix, self.inv_norms, n_lists=n_lists, fingerprint=fingerprint)
+        self._resized()
+        return self.ann
+
+    def compress(self, mode, **params):
+        """Build a float16, int8 or product-quantized copy of the embeddings for scoring."""
+        self.store = build_store(mode, self.matrix, self.inv_norms, **params)
+        self._resized()
+        return self.store
+
+    def build_lexical(self, fingerprint=""):
+        """Build the BM25 inverted index over the text items."""
+        self.lexical = BM25Index.build(self.items, k1=BM25_K1, b=BM25_B, fingerprint=fingerprint)
+        self._resized()
+        return self.lexical
+
+    def lexical_index(self):
+        """Return the BM25 index, loading (or building and saving) it on first use."""
+        if self.lexical is None:
+            if self.path is not None:
+                attach_lexical(self, self.path)
+            else:
+                self.build_lexical()
+        return self.lexical
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def memory_bytes(self):
+        """Approximate memory held by the index."""
+        ann_bytes = self.ann.list_rows.nbytes + self.ann.centroids.nbytes if self.ann is not None else 0
+        store_bytes = self.store.nbytes if self.store is not None else 0
+        store_bytes += self.lexical.nbytes if self.lexical is not None else 0
+        # A memory-mapped matrix lives in the page cache, not in process memory
+        matrix_bytes = 0 if is_memory_mapped(self.matrix) else self.matrix.nbytes
+        return matrix_bytes + self.inv_norms.nbytes + self.items.nbytes + ann_bytes + store_bytes
+
+    def scores(self, query_embedding):
+        """Cosine similarity of the query against every item."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if len(self.items) == 0 or query_norm == 0:
+            return np.zeros(len(self.items), dtype=np.float32)
+
+        # One matrix-vector product scores the whole index
+        return (self.matrix @ query) * self.inv_norms / query_norm
+
+    def top_k(self, query_embedding, top_k=5, nprobe=None, rerank=None, rows=None):
+        """Return (row, similarity) pairs for the best matches, highest first. rows restricts the search."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if len(self.items) == 0 or query_norm == 0:
+            if rows is None:
+                return select_top_k(self.scores(query), top_k)
+            return select_top_k(np.zeros(len(rows), dtype=np.float32), top_k, rows)
+        if rows is not None and len(rows) == 0:
+            return []
+
+        # With an ANN index only the rows of the closest clusters are scored,
+        # unless a filter already leaves few enough rows to score exactly
+        nprobe = nprobe or ANN_NPROBE
+        if self.ann is not None and nprobe < self.ann.n_lists and (rows is None or len(rows) >= ANN_MIN_ITEMS):
+            candidates = np.sort(self.ann.candidates(query / query_norm, nprobe))
+            rows = candidates if rows is None else np.intersect1d(candidates, rows, assume_unique=True)
+
+        if self.store is None:
+            return select_top_k(self.exact_scores(query, query_norm, rows), top_k, rows)
+
+        # Score the compressed codes, then re-rank a short list exactly
+        approx = self.store.scores(query / query_norm, rows)
+        rerank = RERANK_FACTOR if rerank is None else rerank
+        if not rerank:
+            return select_top_k(approx, top_k, rows)
+
+        shortlist = np.array([row for row, _ in select_top_k(approx, top_k * rerank, rows)], dtype=np.int64)
+        return select_top_k(self.exact_scores(query, query_norm, shortlist), top_k, shortlist)
+
+    def exact_scores(self, query, query_norm, rows=None):
+        """Cosine similarity of a non-zero query against all rows, or only the given rows."""
+        if rows is None:
+            return (self.matrix @ query) * self.inv_norms / query_norm
+        return (self.matrix[rows] @ query) * self.inv_norms[rows] / query_norm
+
+    def top_k_batch(self, query_embeddings, top_k=5, nprobe=None, rerank=None, rows=None):
+        """top_k for many queries; exact search scores a block of queries with one matrix-matrix product."""
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        # ANN and compressed stores pick different rows per query, so those are searched one by one
+        if self.ann is not None or self.store is not None or len(self.items) == 0:
+            return [self.top_k(query, top_k, nprobe=nprobe, rerank=rerank, rows=rows) for query in queries]
+        if rows is not None and len(rows) == 0:
+            return [[] for _ in queries]
+
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        inv_norms = self.inv_norms if rows is None else self.inv_norms[rows]
+        query_norms = np.linalg.norm(queries, axis=1)
+        inv_query_norms = np.zeros_like(query_norms)
+        np.divide(1.0, query_norms, out=inv_query_norms, where=query_norms > 0)
+
+        # Bound the score block so large indexes do not need (rows x all queries) floats
+        block = max(1, BATCH_SCORE_ELEMENTS // max(len(matrix), 1))
+        results = []
+        for start in range(0, len(queries), block):
+            scores = matrix @ queries[start:start + block].T
+            scores *= inv_norms[:, None]
+            scores *= inv_query_norms[None, start:start + block]
+            results.extend(select_top_k(np.ascontiguousarray(column), top_k, rows) for column in scores.T)
+        return results
+
+    def collapse_images(self, ranked, top_k):
+        """Keep the best ranked row of each image (rows sharing an image path), then the first top_k."""
+        if not self.repeated_images:
+            return ranked[:top_k]
+        image = TYPES.index("image")
+        seen = set()
+        collapsed = []
+        for row, score in ranked:
+            if self.items.types[row] == image and self.items.path_table[self.items.paths[row]]:
+                path = self.items.paths[row]
+                if path in seen:
+                    continue
+                seen.add(path)
+            collapsed.append((row, score))
+            if len(collapsed) == top_k:
+                break
+        return collapsed
+
+    def lexical_top_k(self, query_text, top_k=5, rows=None):
+        """Return (row, BM25 score) pairs for the best lexical matches; no embedding is needed."""
+        scores = self.lexical_index().scores(query_text, len(self.items))
+        # Only rows sharing a term with the query are candidates
+        rows = np.flatnonzero(scores) if rows is None else rows[scores[rows] > 0]
+        return select_top_k(scores[rows], top_k, rows)
+
+    def search(self, query_embedding, top_k=5, nprobe=None, rerank=None, filters=None, query_text=None, mode="vector"):
+        """Return views of the most similar items carrying their similarity.
+
+        filters ({"type", "document", "pages"}, see ItemStore.filter_rows) limit scoring to matching rows.
+        mode "lexical" ranks by BM25 on query_text alone (query_embedding may be None), "hybrid"
+        fuses the vector and BM25 rankings by reciprocal rank; similarity is then the fused score.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of: {', '.join(RETRIEVAL_MODES)}")
+
+        rows = self.items.filter_rows(filters)
+        # Repeated images rank right after the image they repeat and are collapsed into it
+        extra = self.repeated_images
+        if mode == "vector":
+            ranked = self.collapse_images(
+                self.top_k(query_embedding, top_k + extra, nprobe=nprobe, rerank=rerank, rows=rows), top_k)
+        elif mode == "lexical":
+            ranked = self.lexical_top_k(query_text, top_k, rows=rows)
+        else:
+            depth = max(top_k, HYBRID_DEPTH)
+            ranked = reciprocal_rank_fusion([
+                self.collapse_images(
+                    self.top_k(query_embedding, depth + extra, nprobe=nprobe, rerank=rerank, rows=rows), depth),
+                self.lexical_top_k(query_text, depth, rows=rows),
+            ], top_k)
+
+        return [self.items.view(row, similarity=sim) for row, sim in ranked]
+
+    def search_batch(self, query_embeddings, top_k=5, nprobe=None, rerank=None, filters=None, query_texts=None,
+                     mode="vector"):
+        """search for many queries at once; query_embeddings may be None in lexical mode."""
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of: {', '.join(RETRIEVAL_MODES)}")
+
+        rows = self.items.filter_rows(filters)
+        extra = self.repeated_images
+        if mode == "vector":
+            rankings = [self.collapse_images(ranked, top_k) for ranked in
+                        self.top_k_batch(query_embeddings, top_k + extra, nprobe=nprobe, rerank=rerank, rows=rows)]
+        elif mode == "lexical":
+            rankings = [self.lexical_top_k(text, top_k, rows=rows) for text in query_texts]
+        else:
+            depth = max(top_k, HYBRID_DEPTH)
+            vector = self.top_k_batch(query_embeddings, depth + extra, nprobe=nprobe, rerank=rerank, rows=rows)
+            rankings = [reciprocal_rank_fusion([self.collapse_images(ranked, depth),
+                                                self.lexical_top_k(text, depth, rows=rows)], top_k)
+                        for ranked, text in zip(vector, query_texts)]
+
+        return [[self.items.view(row, similarity=sim) for row, sim in ranked] for ranked in rankings]
+
+def find_similar_items(query_embedding, items, top_k=5, nprobe=None, filters=None, query_text=None, mode="vector"):
+    """Find most similar items using cosine similarity, BM25 (mode="lexical") or both (mode="hybrid")."""
+    # Build the matrix on the fly when given a plain list of items
+    if not isinstance(items, VectorIndex):
+        items = VectorIndex(items)
+
+    return items.search(query_embedding, top_k=top_k, nprobe=nprobe, filters=filters,
+                        query_text=query_text, mode=mode)
+
+def index_dir_for(filename):
+    """Map an index filename, including legacy .json names, to its index directory."""
+    if filename.endswith(".json"):
+        return os.path.splitext(filename)[0]
+    return filename
+
+def index_exists(filename=None):
+    """Check whether a binary or legacy JSON index exists."""
+    if filename is None:
+        filename = DEFAULT_INDEX_PATH
+    path = index_dir_for(filename)
+    return is_index_dir(path) or os.path.isfile(path + ".json")
+
+def resolve_index_path(filename=None):
+    """Return the binary index directory for a filename, migrating legacy JSON if needed."""
+    if filename is None:
+        filename = DEFAULT_INDEX_PATH
+    path = index_dir_for(filename)
+    legacy_path = path + ".json"
+
+    # Migrate a legacy JSON index that is missing or newer than its binary copy
+    if os.path.isfile(legacy_path):
+        if not is_index_dir(path) or os.path.getmtime(legacy_path) > os.path.getmtime(os.path.join(path, MANIFEST_FILE)):
+            migrate_index(legacy_path, path)
+
+    if not is_index_dir(path):
+        raise FileNotFoundError(f"No index found at {path}")
+
+    return path
+
+def writable_index_path(filename=None):
+    """Return the index directory to write to, migrating a legacy JSON index first."""
+    path = index_dir_for(filename or DEFAULT_INDEX_PATH)
+    if os.path.isfile(path + ".json"):
+        path = resolve_index_path(path)
+    return path
+
+def save_index(items, filename=None, dtype="float32"):
     """Save indexed items to disk."""
     if filename is None:
-        filename = os.path.join(INDEX_DIR, "rag_index.json")
-        
-    # Create a copy without large data
-    save_items = []
+        filename = DEFAULT_INDEX_PATH
+    path = index_dir_for(filename)
+
+    # Reuse the matrix of an existing index, otherwise stack the item embeddings
+    if not isinstance(items, VectorIndex):
+        items = VectorIndex(items)
+
+    # Embeddings live in the matrix, everything else goes to the metadata
+    write_index_dir(path, items.items, items.matrix, dtype=dtype)
 
-    for item in items:
-        save_item = item.copy()
+    print(f"Saved index with {len(items)} items to {path}")
 
-        # Convert numpy array to list for JSON serialization
-        if "embedding" in save_item:
-            save_item["embedding"] = save_item["embedding"].tolist()
+def upsert_document(items, document_id, filename=None, dtype="float32"):
+    """Add a document's items to an index, replacing any earlier version of the document."""
+    path = writable_index_path(filename)
 
-        # Replace base64 with placeholder to save space
-        if save_item["type"] == "image" and "content" in save_item:
-            save_item["content"] = "[BASE64_IMAGE]"
+    if not isinstance(items, VectorIndex):
+        items = VectorIndex(items)
 
-        save_items.append(save_item)
+    # Only the new segment and the manifest are written
+    with new_segment_writer(path, dtype=dtype) as writer:
+        writer.add_many(items.items.relabel(document_id), items.matrix)
+    commit_segment(path, writer, documents=[document_id])
 
-    # Save to JSON
-    with open(filename, "w") as f:
-        json.dump(save_items, f)
+    print(f"Indexed {writer.count} items of document '{document_id}' in {path}")
 
-    print(f"Saved index with {len(save_items)} items to {filename}")
+def delete_document(document_id, filename=None):
+    """Remove a document from an index without rewriting the other documents."""
+    path = resolve_index_path(filename)
+    removed = delete_documents(path, [document_id])
 
-def load_index(filename=None):
+    print(f"Deleted {removed} items of document '{document_id}' from {path}")
+    return removed
+
+def list_documents(filename=None):
+    """Return {document id: item count} for the documents in an index."""
+    return live_documents(read_manifest(resolve_index_path(filename)))
+
+def compact_index(filename=None):
+    """Merge an index's segments and drop deleted rows."""
+    compact(resolve_index_path(filename))
+
+def attach_ann(index, path, rebuild=False):
+    """Load the persisted ANN index of an index directory, building it if missing or stale."""
+    fingerprint = manifest_fingerprint(path)
+    ann_path = os.path.join(path, ANN_FILE)
+
+    if not rebuild and os.path.isfile(ann_path):
+        ann = IVFIndex.load(ann_path)
+        if ann.fingerprint == fingerprint:
+            index.ann = ann
+            index._resized()
+            return ann
+
+    # Missing, or written for an older version of the index
+    print(f"Building ANN index over {len(index)} items...")
+    ann = index.build_ann(n_lists=ANN_N_LISTS, fingerprint=fingerprint)
+    ann.save(ann_path)
+    return ann
+
+def store_file(mode):
+    """File name of a persisted compressed store."""
+    return f"store_{mode}.npz"
+
+def attach_store(index, path, mode, rebuild=False):
+    """Load the persisted compressed store of an index directory, building it if missing or stale."""
+    fingerprint = manifest_fingerprint(path)
+    store_path = os.path.join(path, store_file(mode))
+
+    if not rebuild and os.path.isfile(store_path):
+        store, stored_fingerprint = load_store(store_path)
+        if stored_fingerprint == fingerprint:
+            index.store = store
+            index._resized()
+            return store
+
+    print(f"Building {mode} embedding store over {len(index)} items...")
+    store = index.compress(mode, subspaces=PQ_SUBSPACES)
+    save_store(store, store_path, fingerprint)
+    return store
+
+def attach_lexical(index, path, rebuild=False):
+    """Load the persisted BM25 index of an index directory, building it if missing or stale."""
+    fingerprint = manifest_fingerprint(path)
+    lexical_path = os.path.join(path, LEXICAL_FILE)
+
+    if not rebuild and os.path.isfile(lexical_path):
+        lexical = BM25Index.load(lexical_path)
+        if lexical.fingerprint == fingerprint:
+            index.lexical = lexical
+            index._resized()
+            return lexical
+
+    print(f"Building BM25 index over {len(index)} items...")
+    lexical = index.build_lexical(fingerprint=fingerprint)
+    lexical.save(lexical_path)
+    return lexical
+
+def build_ann_index(filename=None):
+    """Build (or rebuild) and persist the ANN index of an index directory."""
+    path = resolve_index_path(filename)
+    index = load_index(path, ann=False, store="float32")
+    ann = attach_ann(index, path, rebuild=True)
+
+    print(f"Built ANN index with {ann.n_lists} lists for {len(index)} items in {path}")
+    return index
+
+def load_index(filename=None, ann=None, store=None, lexical=None):
     """Load indexed items from disk."""
-    if filename is None:
-        filename = os.path.join(INDEX_DIR, "rag_index.json")
-        
-    with open(filename, "r") as f:
-        items = json.load(f)
+    path = resolve_index_path(filename)
+
+    # Image items keep a placeholder, their bytes are resolved from item["path"] (a blob
+    # store reference, or a file for older indexes) on demand
+    index = VectorIndex(read_index_dir(path))
+    index.path = path
+    index.version = manifest_fingerprint(path)
+
+    # Large indexes use approximate search unless disabled
+    if ann is None:
+        ann = ANN_ENABLED and len(index) >= ANN_MIN_ITEMS
+    if ann and len(index):
+        attach_ann(index, path)
 
-    # Convert lists back to numpy arrays
-    for item in items:
-        if "embedding" in item:
-            item["embedding"] = np.array(item["embedding"])
+    # Score compressed embeddings when configured ("float32" keeps exact scoring only)
+    store = EMBEDDING_STORE if store is None else store
+    if store and store != "float32" and len(index):
+        attach_store(index, path, store)
 
-        # Reload images if needed
-        if item["type"] == "image" and item["content"] == "[BASE64_IMAGE]":
-            try:
-                with open(item["path"], "rb") as f:
-                    item["content"] = base64.b64encode(f.read()).decode("utf-8")
-            except Exception as e:
-                print(f"Error reloading image {item['path']}: {e}")
+    # The BM25 index is loaded up front when lexical search is the default
+    if lexical is None:
+        lexical = RETRIEVAL_MODE != "vector"
+    if lexical and len(index):
+        attach_lexical(index, path)
 
-    print(f"Loaded index with {len(items)} items")
-    return items
+    print(f"Loaded index with {len(index)} items")
+    return index
 
 def show_item(item):
     """Return a text representation of an item (non-display version)."""
     output = []
     output.append(f"ID: {item['id']} | Type: {item['type']} | Page: {item['page']+1}")
+    if item.get("document"):
+        output.append(f"Document: {item['document']}")
 
     if item["type"] == "text":
         output.append("\nContent:")
         output.append(item["content"])
     elif item["type"] == "image":
         output.append(f"\nImage path: {item['path']}")
+        if item.get("caption"):
+            output.append(f"Caption: {item['caption']}")
+    if item.get("bbox"):
+        output.append(f"Region: {', '.join(f'{v:.0f}' for v in item['bbox'])}")
         
     return "\n".join(output)
\ No newline at end of file
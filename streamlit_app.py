@@ -2,13 +2,19 @@ import streamlit as st
 import os
 import time
 import json
-from PIL import Image
+import shutil
 
 from utils.auth import setup_google_auth
-from modules.extraction import extract_from_pdf
-from modules.embedding import create_embeddings
-from modules.retrieval import save_index, load_index
-from modules.generation import query_rag_system
+from modules.pipeline import ingest_pdf, format_stats
+from modules.image_filter import format_filter_stats
+from modules.extraction import document_id_for
+from modules.retrieval import index_exists, list_documents, delete_document
+from modules.index_cache import get_index, get_image_bytes
+from modules.generation import stream_rag_system
+from modules.context import describe_context_stats
+from modules.layout import crop_region
+from modules.answer_cache import get_answer_cache
+from modules.query_cache import load_questions, warm_up
 import config
 
 # Page configuration
@@ -21,6 +27,14 @@ st.set_page_config(
 # Initialize Google Cloud authentication
 setup_google_auth(config.KEY_PATH)
 
+@st.cache_resource
+def warm_up_query_cache(path):
+    """Pre-embed expected questions once per server process."""
+    return warm_up(load_questions(path))
+
+if config.WARMUP_QUESTIONS_PATH:
+    warm_up_query_cache(config.WARMUP_QUESTIONS_PATH)
+
 # Custom CSS
 st.markdown("""
 <style>
@@ -64,9 +78,12 @@ def main():
     if 'index_path' not in st.session_state:
         st.session_state.index_path = None
     if 'has_index' not in st.session_state:
-        st.session_state.has_index = os.path.exists(config.DEFAULT_INDEX_PATH)
+        st.session_state.has_index = index_exists(config.DEFAULT_INDEX_PATH)
     if 'processed_items' not in st.session_state:
         st.session_state.processed_items = 0
+    if 'pdf_paths' not in st.session_state:
+        # Uploaded PDFs by document id, to crop evidence regions from
+        st.session_state.pdf_paths = {}
     
     # Create tabs for Upload and Query
     tab1, tab2 = st.tabs(["Upload Document", "Ask Questions"])
@@ -91,52 +108,72 @@ def main():
                 status_text = st.empty()
                 
                 try:
-                    # Extract content
-                    status_text.text("Extracting content from PDF...")
-                    progress_bar.progress(10)
-                    
-                    pdf_path = os.path.join(config.DATA_DIR, "temp.pdf")
-                    extracted_items = extract_from_pdf(pdf_path)
+                    status_text.text("Extracting and embedding content from PDF...")
                     
-                    progress_bar.progress(40)
-                    status_text.text(f"Generated {len(extracted_items)} items. Creating embeddings...")
+                    # Create a unique ID for this session, its index collects every uploaded document
+                    if st.session_state.session_id is None:
+                        st.session_state.session_id = int(time.time())
+                    session_id = st.session_state.session_id
                     
-                    # Generate embeddings
-                    indexed_items = create_embeddings(extracted_items)
+                    # Stream the document into the session index, replacing an earlier upload of it
+                    def show_progress(pipeline):
+                        progress_bar.progress(min(99, int(100 * pipeline.pages / max(1, pipeline.page_count))))
+                        status_text.text(f"Page {pipeline.pages}/{pipeline.page_count}: indexed {pipeline.stages['index'].items} items...")
                     
-                    progress_bar.progress(80)
-                    status_text.text("Saving index...")
-                    
-                    # Create a unique ID for this session
-                    session_id = int(time.time())
-                    st.session_state.session_id = session_id
+                    pdf_path = os.path.join(config.DATA_DIR, "temp.pdf")
+                    index_path = os.path.join(config.INDEX_DIR, f"index_{session_id}")
+                    document_id = document_id_for(uploaded_file.name)
+                    pipeline = ingest_pdf(pdf_path, index_path=index_path, document_id=document_id, progress=show_progress)
                     
-                    # Save with session ID in filename
-                    index_path = os.path.join(config.INDEX_DIR, f"index_{session_id}.json")
-                    save_index(indexed_items, filename=index_path)
+                    indexed_count = pipeline.stages["index"].items
                     st.session_state.index_path = index_path
                     st.session_state.has_index = True
-                    st.session_state.processed_items = len(indexed_items)
+                    st.session_state.processed_items = sum(list_documents(index_path).values())
+                    
+                    # Keep a copy of the PDF, the next upload overwrites temp.pdf
+                    upload_dir = os.path.join(config.DATA_DIR, "uploads")
+                    os.makedirs(upload_dir, exist_ok=True)
+                    kept_path = os.path.join(upload_dir, f"{document_id}.pdf")
+                    shutil.copyfile(pdf_path, kept_path)
+                    st.session_state.pdf_paths[document_id] = kept_path
                     
                     progress_bar.progress(100)
                     status_text.text("")
                     
                     # Success message with item counts
-                    text_count = len([i for i in indexed_items if i['type'] == 'text'])
-                    image_count = len([i for i in indexed_items if i['type'] == 'image'])
+                    text_count = pipeline.counts["text"]
+                    image_count = pipeline.counts["image"]
                     
                     st.success(f"""
                     📄 Document processed successfully!
-                    - Total items: {len(indexed_items)}
+                    - Total items: {indexed_count}
                     - Text chunks: {text_count}
                     - Images: {image_count}
                     """)
                     
+                    with st.expander("Pipeline stats"):
+                        st.text(format_stats(pipeline.stats()))
+                        if pipeline.image_filter.enabled:
+                            st.text(format_filter_stats(pipeline.image_stats()))
+                    
                     # Add guidance to switch to the query tab
                     st.info("👉 Switch to the 'Ask Questions' tab to start querying your document.")
                     
                 except Exception as e:
                     st.error(f"Error processing document: {str(e)}")
+        
+        # Documents in the session index
+        if st.session_state.index_path and index_exists(st.session_state.index_path):
+            documents = list_documents(st.session_state.index_path)
+            st.subheader("Indexed Documents")
+            for document_id, count in sorted(documents.items()):
+                st.write(f"- {document_id}: {count} items")
+            
+            if documents:
+                to_remove = st.selectbox("Remove a document from the index", sorted(documents))
+                if st.button("Remove Document"):
+                    delete_document(to_remove, st.session_state.index_path)
+                    st.rerun()
     
     # Ask Questions Tab
     with tab2:
@@ -151,41 +188,74 @@ def main():
             # Submit button for the question
             if st.button("Submit Question"):
                 if question.strip():
-                    # Show a spinner while processing
-                    with st.spinner("Processing your question..."):
-                        try:
-                            # Determine which index to use
-                            if st.session_state.index_path:
-                                index_path = st.session_state.index_path
-                            else:
-                                index_path = config.DEFAULT_INDEX_PATH
-                            
-                            # Load index and process query
-                            indexed_items = load_index(index_path)
-                            result = query_rag_system(question, indexed_items)
-                            
-                            # Display results
-                            st.subheader("Answer")
-                            st.write(result["answer"])
-                            
-                            # Show supporting evidence
-                            st.markdown("---")
-                            st.subheader("Supporting Evidence")
-                            
-                            # Create columns for the evidence items
-                            for i, match in enumerate(result["top_matches"]):
-                                with st.expander(f"Evidence {i+1}: {match['type'].upper()} (Page {match['page']+1}, Similarity: {match['similarity']:.2f})"):
-                                    if match["type"] == "text":
-                                        st.markdown(f"{match['content']}")
-                                    else:  # Image type
+                    try:
+                        # Determine which index to use
+                        if st.session_state.index_path:
+                            index_path = st.session_state.index_path
+                        else:
+                            index_path = config.DEFAULT_INDEX_PATH
+                        
+                        # Show a spinner until the evidence is retrieved
+                        with st.spinner("Retrieving relevant content..."):
+                            indexed_items = get_index(index_path)
+                            events = stream_rag_system(question, indexed_items)
+                            top_matches = next(events)["top_matches"]
+                        
+                        # The answer streams into a placeholder above the evidence
+                        st.subheader("Answer")
+                        answer_box = st.empty()
+                        answer_info = st.empty()
+                        
+                        # Show supporting evidence
+                        st.markdown("---")
+                        st.subheader("Supporting Evidence")
+                        
+                        # Create columns for the evidence items
+                        for i, match in enumerate(top_matches):
+                            with st.expander(f"Evidence {i+1}: {match['type'].upper()} ({match.get('document', 'document')}, Page {match['page']+1}, Similarity: {match['similarity']:.2f})"):
+                                if match["type"] == "text":
+                                    st.markdown(f"{match['content']}")
+                                    # The region of the page the chunk was read from, when layout extraction recorded it
+                                    pdf_path = st.session_state.pdf_paths.get(match.get("document"))
+                                    if match.get("bbox") and pdf_path:
                                         try:
-                                            img = Image.open(match["path"])
-                                            st.image(img, caption=f"Image from page {match['page']+1}", use_column_width=True)
+                                            st.image(crop_region(pdf_path, match["page"], match["bbox"]),
+                                                     caption=f"Region on page {match['page']+1}", use_column_width=True)
                                         except Exception as e:
-                                            st.error(f"Error loading image: {str(e)}")
+                                            st.error(f"Error rendering region: {str(e)}")
+                                else:  # Image type
+                                    try:
+                                        # Resolved through the blob store (legacy image files still work)
+                                        img = bytes(get_image_bytes(match["path"]))
+                                        st.image(img, caption=match.get("caption") or f"Image from page {match['page']+1}",
+                                                 use_column_width=True)
+                                    except Exception as e:
+                                        st.error(f"Error loading image: {str(e)}")
                         
-                        except Exception as e:
-                            st.error(f"Error processing question: {str(e)}")
+                        # Render answer tokens as they arrive
+                        answer = ""
+                        for event in events:
+                            if event["type"] == "token":
+                                answer += event["text"]
+                                answer_box.markdown(answer + "▌")
+                            elif event["type"] == "done":
+                                result = event["result"]
+                        answer_box.markdown(result["answer"])
+                        
+                        timings = result["timings"]
+                        info = (f"First token after {timings['first_token_seconds']:.2f}s, "
+                                f"complete after {timings['total_seconds']:.2f}s")
+                        if result.get("cached"):
+                            info = f"Reused a cached answer ({result['cached']} match). " + info
+                        if result.get("context_stats"):
+                            info += ". " + describe_context_stats(result["context_stats"])
+                        answer_info.caption(info)
+                        if config.ANSWER_CACHE_ENABLED:
+                            with st.expander("Answer cache"):
+                                st.json(get_answer_cache().stats())
+                    
+                    except Exception as e:
+                        st.error(f"Error processing question: {str(e)}")
                 else:
                     st.warning("Please enter a question.")
 
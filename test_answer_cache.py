@@ -0,0 +1,17 @@
+"""Tests for the answer cache."""
+from modules.answer_cache import AnswerCache, answer_scope
+
+def record(answer):
+    return {"question": "q", "answer": answer, "text_context": "", "matches": []}
+
+def test_exact_tier_is_scoped_by_index_version_top_k_and_settings(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite"))
+    scope = answer_scope("vector", top_k=5, model_name="llm", settings={"store": None})
+    cache.put("v1", scope, "What is RAG?", "context", None, record("five"))
+
+    assert cache.get_exact("v1", scope, "what is rag")["answer"] == "five"
+    assert cache.get_exact("v2", scope, "What is RAG?") is None
+    assert cache.get_exact("v1", answer_scope("vector", top_k=10, model_name="llm", settings={"store": None}),
+                           "What is RAG?") is None
+    assert cache.get_exact("v1", answer_scope("vector", top_k=5, model_name="llm", settings={"store": "pq"}),
+                           "What is RAG?") is None
@@ -0,0 +1,45 @@
+"""Tests for the packed image blob store."""
+from modules.blob_store import BlobWriter, read_blob, blob_version
+
+def test_refs_survive_reingesting_a_document(tmp_path):
+    blob_dir = str(tmp_path)
+    # The same document name ingested for one index, then again (other bytes) for another
+    with BlobWriter("paper", blob_dir) as blobs:
+        first = blobs.put(b"first image bytes")
+    before = blob_version(first, blob_dir)
+    with BlobWriter("paper", blob_dir) as blobs:
+        second = blobs.put(b"second image bytes")
+
+    assert first != second
+    assert bytes(read_blob(first, blob_dir)) == b"first image bytes"
+    assert bytes(read_blob(second, blob_dir)) == b"second image bytes"
+    assert blob_version(first, blob_dir) == before
+
+def test_identical_bytes_are_stored_once(tmp_path):
+    with BlobWriter("paper", str(tmp_path)) as blobs:
+        refs = {blobs.put(b"same bytes") for _ in range(3)}
+    assert len(refs) == 1
+    assert (blobs.written, blobs.reused) == (1, 2)
+
+def test_table_has_one_digest_column_and_reads_older_lines(tmp_path):
+    import hashlib
+    from modules.blob_store import blob_paths, blob_ref
+
+    blob_dir = str(tmp_path)
+    with BlobWriter("paper", blob_dir) as blobs:
+        ref = blobs.put(b"new bytes")
+    data_path, table_path = blob_paths("paper", blob_dir)
+    digest = hashlib.sha256(b"new bytes").hexdigest()
+    with open(table_path, encoding="utf-8") as f:
+        assert f.read() == f"{digest}\t0\t9\n"
+
+    # A line written by an earlier version, keyed by item id with its digest in a fourth column
+    old_digest = hashlib.sha256(b"old bytes").hexdigest()
+    with open(data_path, "ab") as f:
+        f.write(b"old bytes")
+    with open(table_path, "a", encoding="utf-8") as f:
+        f.write(f"image_0_0\t9\t9\t{old_digest}\n")
+
+    assert bytes(read_blob(blob_ref("paper", "image_0_0"), blob_dir)) == b"old bytes"
+    assert blob_version(blob_ref("paper", "image_0_0"), blob_dir) == (9, 9, old_digest)
+    assert blob_version(ref, blob_dir) == (0, 9, digest)
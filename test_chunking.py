@@ -0,0 +1,101 @@
+"""Property tests for the offset-based chunker: size, coverage, overlap and chunks spanning pages."""
+import random
+import re
+
+import pytest
+
+from modules.chunking import chunk_spans, chunk_text, count_tokens, PageChunker, PAGE_SEPARATOR, _TOKEN, _token_offsets
+
+def random_document(chars, seed):
+    """Text with paragraphs, sentences of varied length, runs of spaces and a few very long words."""
+    rng = random.Random(seed)
+    vocabulary = [f"w{i}" * rng.randint(1, 4) for i in range(300)]
+    parts, size = [], 0
+    while size < chars:
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(3, 40))]
+        if rng.random() < 0.01:
+            words.append("x" * rng.randint(500, 3000))
+        sentence = " ".join(words) + rng.choice([". ", "? ", "! ", ", ", ".\n", "  ", "\t"])
+        if rng.random() < 0.1:
+            sentence += "\n\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:chars]
+
+def random_case(seed):
+    rng = random.Random(seed)
+    text = random_document(rng.randint(0, 30000), seed)
+    unit = rng.choice(["chars", "tokens"])
+    chunk_size = rng.randint(20, 1200) if unit == "chars" else rng.randint(5, 300)
+    overlap = rng.randint(0, chunk_size - 1)
+    max_chars = rng.choice([1000, 10 ** 9])
+    return text, chunk_size, overlap, unit, max_chars
+
+def units(text, unit):
+    return count_tokens(text) if unit == "tokens" else len(text)
+
+@pytest.mark.parametrize("seed", range(60))
+def test_spans_within_budget_cover_text_and_overlap(seed):
+    text, chunk_size, overlap, unit, max_chars = random_case(seed)
+    spans = chunk_spans(text, chunk_size, overlap, unit, max_chars)
+
+    covered_to = 0
+    for n, (start, end) in enumerate(spans):
+        assert start < end
+        assert units(text[start:end], unit) <= chunk_size
+        assert end - start <= max_chars
+        # No text is skipped between chunks
+        assert not text[covered_to:start].strip()
+        if n:
+            previous_start, previous_end = spans[n - 1]
+            assert start > previous_start
+            if start < previous_end:
+                assert units(text[start:previous_end], unit) <= overlap
+            # Only a word longer than the budget may be cut
+            if start == previous_end and not text[start - 1].isspace() and not text[start].isspace():
+                assert not re.search(r"\s", text[previous_start:previous_end].strip())
+        covered_to = max(covered_to, end)
+    assert not text[covered_to:].strip()
+
+@pytest.mark.parametrize("seed", range(20))
+def test_page_chunker_matches_joined_pages(seed):
+    text, chunk_size, overlap, unit, max_chars = random_case(seed)
+    pages = [text[i:i + 3000] for i in range(0, len(text), 3000)]
+    chunker = PageChunker(chunk_size, overlap, unit, max_chars)
+    spanned = [chunk for n, page in enumerate(pages) for chunk in chunker.feed(n, page)] + chunker.finish()
+
+    joined = PAGE_SEPARATOR.join(pages)
+    assert [chunk for _, _, chunk in spanned] == chunk_text(joined, chunk_size, overlap, unit, max_chars)
+    # A chunk belongs to the page it starts on, numbered in order on that page
+    assert [page for page, _, _ in spanned] == sorted(page for page, _, _ in spanned)
+
+def test_chunk_ends_at_sentence_and_keeps_words_whole():
+    text = "First sentence here. Second sentence follows it. " * 20
+    chunks = chunk_text(text, 120, 30, "chars")
+    assert all(chunk.endswith(".") for chunk in chunks[:-1])
+    assert all(len(chunk) <= 120 for chunk in chunks)
+
+def test_tokens_count_words_as_one_token():
+    # A long word is one token, never split to fill the budget
+    chunks = chunk_text("alpha " * 3 + "b" * 50, 4, 1, "tokens")
+    assert chunks == ["alpha alpha alpha " + "b" * 50]
+
+def test_invalid_budget():
+    with pytest.raises(ValueError):
+        chunk_spans("text", 10, 10)
+    with pytest.raises(ValueError):
+        chunk_spans("text", 10, 0, "words")
+
+def test_non_ascii_text_is_chunked_like_ascii():
+    text = random_document(20000, seed=3)
+    accented = text.replace("w1", "é1")
+    assert chunk_spans(accented, 300, 50, "chars") == chunk_spans(accented.replace("é", "e"), 300, 50, "chars")
+
+@pytest.mark.parametrize("seed", range(5))
+def test_token_offsets_match_the_token_pattern(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice(["word", "_x9", " ", "\n", "\t", ".", ",", "\x1c", "\x00", "-"]) for _ in range(2000))
+    for variant in (text, text + " é"):
+        matches = list(_TOKEN.finditer(variant))
+        starts, ends = _token_offsets(variant)
+        assert (list(starts), list(ends)) == ([m.start() for m in matches], [m.end() for m in matches])
@@ -0,0 +1,16 @@
+"""Tests for context packing."""
+from modules.context import dedupe_passages
+
+SHORT = "the model is trained on image and text pairs from the web"
+LONG = SHORT + " and then fine tuned with human preference data on a smaller curated set of prompts"
+
+def passage(text):
+    return {"text": text}
+
+def test_dedupe_keeps_longer_passage_containing_a_higher_ranked_one():
+    kept = dedupe_passages([passage(SHORT), passage(LONG)], threshold=0.8)
+    assert [p["text"] for p in kept] == [SHORT, LONG]
+
+def test_dedupe_drops_passage_contained_in_a_higher_ranked_one():
+    kept = dedupe_passages([passage(LONG), passage(SHORT)], threshold=0.8)
+    assert [p["text"] for p in kept] == [LONG]
@@ -0,0 +1,71 @@
+"""Tests for embedding generation and its cache."""
+import modules.embedding as embedding
+
+def text_items(count):
+    return [{"id": f"text_0_{i}", "type": "text", "content": f"chunk number {i}", "page": 0, "path": ""}
+            for i in range(count)]
+
+def test_create_embeddings_without_cache(monkeypatch):
+    def shared_cache():
+        raise AssertionError("cache=False used the shared embedding cache")
+    monkeypatch.setattr(embedding, "get_embedding_cache", shared_cache)
+
+    embedded = embedding.create_embeddings(text_items(3), cache=False)
+    assert len(embedded) == 3
+    assert all(item["embedding"] is not None for item in embedded)
+
+def test_iter_embeddings_uses_given_cache(tmp_path):
+    from modules.embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    list(embedding.iter_embeddings(text_items(2), cache=cache))
+    list(embedding.iter_embeddings(text_items(2), cache=cache))
+    assert cache.hits == 2
+
+def test_cache_hits_are_written_in_batches_and_still_order_eviction(tmp_path):
+    from modules.embedding_cache import EmbeddingCache
+    vector = [0.5] * 4
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=3 * 16)
+    for key in ("a", "b", "c"):
+        cache.put(key, vector)
+
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    assert cache.get("a") is not None
+    assert not any(statement.startswith("UPDATE") for statement in statements)
+
+    # The pending hit on "a" is written before the put evicts, so "b" is the oldest
+    cache.put("d", vector)
+    assert cache.get("a") is not None and cache.get("b") is None
+    cache.close()
+
+def test_concurrent_embedding_keeps_order_retries_and_reports_failures(monkeypatch):
+    import threading
+    import time
+    from google.api_core import exceptions as api_exceptions
+    import utils.concurrency as concurrency
+    monkeypatch.setattr(concurrency, "backoff_delay", lambda attempt, base_delay=1.0: 0.0)
+
+    class FlakyModel:
+        def __init__(self):
+            self.calls = {}
+            self.lock = threading.Lock()
+
+        def get_embeddings(self, image, contextual_text, dimension):
+            with self.lock:
+                self.calls[contextual_text] = self.calls.get(contextual_text, 0) + 1
+                attempt = self.calls[contextual_text]
+            number = int(contextual_text.rsplit(" ", 1)[1])
+            # Later items finish first, so results arrive out of order
+            time.sleep(0.002 * (10 - number))
+            if number == 3 and attempt == 1:
+                raise api_exceptions.ServiceUnavailable("try again")
+            if number == 7:
+                raise ValueError("bad item")
+            return type("Result", (), {"text_embedding": [float(number)] * 4})()
+
+    model = FlakyModel()
+    embedded = list(embedding.iter_embeddings(text_items(10), concurrency=4, rate_limit=0, model=model, cache=False))
+    assert [item["id"] for item in embedded] == [f"text_0_{i}" for i in range(10)]
+    assert [None if item["embedding"] is None else item["embedding"][0] for item in embedded] == \
+           [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, None, 8.0, 9.0]
+    assert model.calls["chunk number 3"] == 2
@@ -0,0 +1,56 @@
+"""Tests for PDF extraction on a process pool."""
+import numpy as np
+import pymupdf
+
+from modules.extraction import iter_extract_pages
+
+def write_pdf(path, pages):
+    rng = np.random.default_rng(0)
+    doc = pymupdf.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {n} text. " * 20)
+        # Noise does not compress, so the image stays above the filter's byte minimum
+        pixels = rng.integers(0, 255, (96, 96, 3), dtype=np.uint8).tobytes()
+        pixmap = pymupdf.Pixmap(pymupdf.csRGB, 96, 96, pixels, False)
+        page.insert_image(pymupdf.Rect(72, 200, 168, 296), pixmap=pixmap)
+    doc.save(str(path))
+    return str(path)
+
+def comparable(pages):
+    return [(page_num, [{key: value for key, value in item.items() if key != "image"} for item in items])
+            for page_num, items in pages]
+
+def test_parallel_extraction_matches_serial(tmp_path):
+    pdf_path = write_pdf(tmp_path / "paper.pdf", 7)
+    serial = comparable(iter_extract_pages(pdf_path, workers=1, document_id="test_extraction"))
+    parallel = comparable(iter_extract_pages(pdf_path, workers=2, pages_per_task=2, document_id="test_extraction"))
+
+    assert [page_num for page_num, _ in parallel] == list(range(7))
+    assert parallel == serial
+    assert all(any(item["type"] == "image" for item in items) for _, items in serial)
+    assert any(item["type"] == "text" for _, items in serial for item in items)
+
+def test_image_items_carry_a_lazy_handle_instead_of_base64(tmp_path):
+    from modules.blob_store import ImageHandle, image_handle
+    from modules.item_store import IMAGE_PLACEHOLDER, ItemStore
+
+    pdf_path = write_pdf(tmp_path / "paper.pdf", 3)
+    images = [item for _, items in iter_extract_pages(pdf_path, workers=1, document_id="test_image_handles")
+              for item in items if item["type"] == "image"]
+    with pymupdf.open(pdf_path) as doc:
+        expected = [doc.extract_image(xref)["image"] for page in doc for xref, *_ in page.get_images()]
+
+    assert len(images) == len(expected) == 3
+    for item, data in zip(images, expected):
+        assert item["content"] == IMAGE_PLACEHOLDER and "data" not in item
+        assert isinstance(item["image"], ImageHandle) and item["image"].nbytes == len(data)
+        assert bytes(item["image"].read()) == data
+
+    # Index rows derive the same handle from their path, items from before handles fall back to it
+    for n, item in enumerate(images):
+        item["embedding"] = np.full(4, n + 1, dtype=np.float32)
+    store = ItemStore.from_items(images)
+    assert [store[row]["image"] for row in range(3)] == [item["image"] for item in images]
+    legacy = {key: value for key, value in images[0].items() if key != "image"}
+    assert bytes(image_handle(legacy).read()) == expected[0]
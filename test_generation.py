@@ -0,0 +1,83 @@
+"""Tests for answering questions against an index with the fake models."""
+import numpy as np
+
+from config import EMBEDDING_DIM
+from modules.generation import query_batch, query_rag_system, stream_answer, stream_rag_system
+from modules.models import FakeEmbeddingModel, FakeLLMModel
+from modules.retrieval import VectorIndex
+
+def text_index(count=30):
+    model = FakeEmbeddingModel()
+    items = []
+    for i in range(count):
+        content = f"Section {i} explains topic {i % 7}."
+        embedding = model.get_embeddings(contextual_text=content, dimension=EMBEDDING_DIM).text_embedding
+        items.append({"id": f"text_{i}_0", "type": "text", "content": content, "page": i, "path": "",
+                      "document": "doc", "embedding": np.array(embedding, dtype=np.float32)})
+    return VectorIndex(items)
+
+def summary(result):
+    return (result["question"], result["answer"], result["text_context"],
+            [(match["id"], round(match["similarity"], 5)) for match in result["top_matches"]])
+
+def test_query_batch_matches_sequential_queries():
+    index = text_index()
+    questions = [f"Section {i} explains topic {i % 7}." for i in range(0, 30, 3)] + ["unrelated question"]
+
+    for mode in ["vector", "lexical", "hybrid"]:
+        batched = list(query_batch(questions + [{"question": "topic 3", "id": "custom"}], index, mode=mode,
+                                   top_k=4, concurrency=3, batch_size=4))
+        # Every question is answered once, under its position or its own id
+        by_id = {result["id"]: result for result in batched}
+        assert len(batched) == len(by_id) and set(by_id) == set(range(len(questions))) | {"custom"}
+        for position, question in enumerate(questions):
+            expected = query_rag_system(question, index, mode=mode, cache=False, top_k=4)
+            assert summary(by_id[position]) == summary(expected)
+        if mode != "lexical":
+            assert by_id[1]["top_matches"][0]["id"] == "text_3_0"
+        assert summary(by_id["custom"]) == summary(query_rag_system("topic 3", index, mode=mode, cache=False,
+                                                                    top_k=4))
+
+def test_stream_yields_evidence_then_tokens_then_the_result():
+    index = text_index()
+    events = list(stream_rag_system("Section 4 explains topic 4.", index, cache=False, top_k=3))
+
+    assert [event["type"] for event in events] == ["evidence", "token", "token", "done"]
+    result = events[-1]["result"]
+    assert events[0]["top_matches"] == result["top_matches"] and len(result["top_matches"]) == 3
+    assert "".join(event["text"] for event in events[1:-1]) == result["answer"] == "[fake answer]"
+    timings = result["timings"]
+    assert 0 <= timings["retrieval_seconds"] <= timings["first_token_seconds"] <= timings["total_seconds"]
+
+class FailingLLMModel(FakeLLMModel):
+    """Streams the given chunks, then fails; later calls stream normally."""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        if self.calls > 1:
+            return self._astream(["text only"])
+
+        async def failing():
+            async for chunk in await FakeLLMModel.generate_content_async(self, contents, stream=True):
+                if chunk.text not in self.chunks:
+                    raise RuntimeError("stream broke")
+                yield chunk
+        return failing()
+
+def test_stream_errors_keep_the_text_already_sent():
+    matches = text_index().search(np.ones(EMBEDDING_DIM, dtype=np.float32), top_k=2)
+
+    # Cut short after the first token: no retry, the answer says so
+    events = list(stream_answer("question", matches, FailingLLMModel(["[fake "])))
+    tokens = [event["text"] for event in events if event["type"] == "token"]
+    assert tokens[0] == "[fake " and "cut short" in tokens[-1]
+    assert events[-1]["result"]["answer"] == "".join(tokens) and events[-1]["result"]["error"] == "stream broke"
+
+    # Failing before any text falls back to a text-only request
+    events = list(stream_answer("question", matches, FailingLLMModel([])))
+    tokens = [event["text"] for event in events if event["type"] == "token"]
+    assert tokens[0] == "text only" and "error" not in events[-1]["result"]
@@ -0,0 +1,69 @@
+"""Tests for image filtering at extraction and repeated images at search time."""
+import numpy as np
+import pymupdf
+
+from modules.extraction import extract_page
+from modules.image_filter import ImageFilter
+from modules.retrieval import VectorIndex
+
+def image_item(item_id, path, page=0, width=100, height=100, hashes=(0, 0), xref=None):
+    return {"id": item_id, "type": "image", "content": "", "page": page, "path": path, "document": "doc",
+            "xref": xref, "width": width, "height": height, "data": b"x" * 1024, "hashes": hashes}
+
+def test_image_without_height_is_admitted():
+    image_filter = ImageFilter(enabled=True, min_width=0, min_height=0, min_bytes=0)
+    assert image_filter.admit(image_item("image_0_0", "blob:doc/a", height=0))
+    assert image_filter.admit(image_item("image_0_1", "blob:doc/b", height=0))
+    assert image_filter.similar == 0
+
+def page_with_images(sizes):
+    doc = pymupdf.open()
+    page = doc.new_page()
+    for n, size in enumerate(sizes):
+        pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, size, size), False)
+        pixmap.set_rect(pixmap.irect, (200, 10 + size, 10))
+        top = 72 + 100 * n
+        page.insert_image(pymupdf.Rect(72, top, 72 + size, top + size), pixmap=pixmap)
+    return doc, page
+
+def test_small_images_are_skipped_by_dimensions_only():
+    doc, page = page_with_images([16, 64])
+    options = ImageFilter(enabled=True, min_width=32, min_height=32).extract_options()
+    images = [item for item in extract_page(doc, page, 0, "doc", **options) if item["type"] == "image"]
+    # The small image is left for the filter without extracting its bytes, the large one is extracted
+    assert sorted((item["width"], bool(item["data"])) for item in images) == [(16, False), (64, True)]
+    assert all("hashes" in item for item in images if item["data"])
+
+def test_disabled_filter_extracts_every_image():
+    doc, page = page_with_images([16, 64])
+    options = ImageFilter(enabled=False).extract_options()
+    images = [item for item in extract_page(doc, page, 0, "doc", **options) if item["type"] == "image"]
+    assert all(item["data"] and "hashes" not in item for item in images) and len(images) == 2
+
+def test_similar_images_are_found_through_hash_bands():
+    image_filter = ImageFilter(enabled=True, min_width=0, min_height=0, min_bytes=0, max_distance=4)
+    first = 0x0123456789ABCDEF
+    assert image_filter.admit(image_item("image_0_0", "blob:doc/a", hashes=(first, first), xref=1))
+    assert image_filter.admit(image_item("image_1_0", "blob:doc/b", hashes=(~first & (2 ** 64 - 1), 0), xref=2))
+    # Four flipped bits, one in each of four of the five bands
+    close = first ^ (1 | 1 << 20 | 1 << 40 | 1 << 60)
+    near = image_item("image_2_0", "blob:doc/c", hashes=(close, first), xref=3)
+    far = image_item("image_3_0", "blob:doc/d", hashes=(close ^ 1 << 30, first), xref=4)
+    assert image_filter.admit(near) and image_filter.admit(far)
+    assert near["duplicate_of"] == "image_0_0"
+    assert "duplicate_of" not in far
+
+def test_search_collapses_repeated_images():
+    rng = np.random.default_rng(0)
+    logo = rng.standard_normal(8).astype(np.float32)
+    items = [dict(image_item(f"image_{page}_0", "blob:doc/logo", page=page), embedding=logo) for page in range(5)]
+    items += [{"id": f"text_{i}_0", "type": "text", "content": f"text {i}", "page": i, "path": "", "document": "doc",
+               "embedding": logo + rng.standard_normal(8).astype(np.float32)} for i in range(3)]
+    index = VectorIndex(items)
+
+    results = index.search(logo, top_k=3)
+    assert [item["id"] for item in results][0] == "image_0_0"
+    assert [item["type"] for item in results].count("image") == 1
+    assert len(results) == 3
+    assert [[item["id"] for item in batch] for batch in index.search_batch([logo], top_k=3)] == \
+           [[item["id"] for item in results]]
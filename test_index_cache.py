@@ -0,0 +1,37 @@
+"""Tests for the process-wide index registry."""
+import modules.index_cache as index_cache
+from modules.index_format import write_index_dir
+from modules.item_store import ItemStore
+from test_index_format import document_items
+
+def test_lazily_attached_structures_are_counted(tmp_path):
+    path = str(tmp_path / "index")
+    store = ItemStore.from_items(document_items("paper", 50, 0))
+    write_index_dir(path, store, store.matrix)
+    index_cache.clear_caches()
+
+    index = index_cache.get_index(path)
+    loaded = index_cache.cache_stats()["indexes"]["bytes"]
+    assert index.lexical is None
+
+    index.lexical_index()
+    assert index_cache.cache_stats()["indexes"]["bytes"] == loaded + index.lexical.nbytes == index.memory_bytes()
+    index.compress("int8")
+    assert index_cache.cache_stats()["indexes"]["bytes"] == index.memory_bytes()
+    index_cache.clear_caches()
+
+def test_index_is_shared_until_its_manifest_changes(tmp_path):
+    from modules.retrieval import upsert_document
+
+    path = str(tmp_path / "index")
+    store = ItemStore.from_items(document_items("paper", 10, 0))
+    write_index_dir(path, store, store.matrix)
+    index_cache.clear_caches()
+
+    first = index_cache.get_index(path)
+    assert index_cache.get_index(path) is first
+    upsert_document(document_items("other", 5, 1), "other", filename=path)
+    reloaded = index_cache.get_index(path)
+    assert reloaded is not first and len(reloaded) == 15
+    assert index_cache.cache_stats()["indexes"]["entries"] == 1
+    index_cache.clear_caches()
@@ -0,0 +1,64 @@
+"""Tests for the segmented index format."""
+import numpy as np
+
+from modules.index_format import compact, delete_documents, read_index_dir, write_index_dir
+from modules.item_store import ItemStore
+from modules.retrieval import VectorIndex, is_memory_mapped, upsert_document
+
+def document_items(document_id, count, seed):
+    rng = np.random.default_rng(seed)
+    return [{"id": f"text_0_{i}", "type": "text", "content": f"{document_id} chunk {i}", "page": 0, "path": "",
+             "document": document_id, "embedding": rng.standard_normal(16).astype(np.float32)}
+            for i in range(count)]
+
+def build_index(path):
+    """Three segments, the first holding two documents so a deletion leaves a tombstone in it."""
+    store = ItemStore.from_items(document_items("first", 20, 0) + document_items("second", 20, 1))
+    write_index_dir(str(path), store, store.matrix)
+    for seed, document_id in enumerate(["third", "fourth"], start=2):
+        upsert_document(document_items(document_id, 20, seed), document_id, filename=str(path))
+
+def search_ids(index, queries):
+    return [[index.items[row]["id"] + "@" + index.items[row]["document"] for row, _ in index.top_k(query, 10)]
+            for query in queries]
+
+def test_segments_stay_memory_mapped(tmp_path):
+    path = tmp_path / "index"
+    build_index(path)
+    delete_documents(str(path), ["second"])
+
+    index = VectorIndex(read_index_dir(str(path)))
+    assert len(index) == 60
+    assert is_memory_mapped(index.matrix)
+
+    queries = np.random.default_rng(7).standard_normal((5, 16)).astype(np.float32)
+    before = search_ids(index, queries)
+    batch = index.top_k_batch(queries, 10)
+    filtered = index.top_k(queries[0], 5, rows=index.items.filter_rows({"document": "third"}))
+
+    compact(str(path))
+    compacted = VectorIndex(read_index_dir(str(path)))
+    assert search_ids(compacted, queries) == before
+    assert [[row for row, _ in result] for result in batch] == \
+           [[row for row, _ in compacted.top_k(query, 10)] for query in queries]
+    assert filtered == compacted.top_k(queries[0], 5, rows=compacted.items.filter_rows({"document": "third"}))
+    np.testing.assert_array_equal(np.asarray(index.matrix), compacted.matrix)
+
+def test_legacy_json_index_is_migrated_on_load(tmp_path):
+    import json
+    from modules.retrieval import load_index
+
+    items = document_items("doc", 12, 3)
+    items[0]["type"], items[0]["content"], items[0]["path"] = "image", "[BASE64_IMAGE]", "images/page_0.png"
+    # Items without an embedding were never searchable and are dropped
+    legacy = [dict(item, embedding=item["embedding"].tolist()) for item in items] + \
+             [{"id": "text_9_9", "type": "text", "content": "lost", "page": 9, "path": "", "embedding": None}]
+    legacy_path = tmp_path / "rag_index.json"
+    legacy_path.write_text(json.dumps(legacy))
+
+    index = load_index(str(legacy_path), ann=False, store="float32", lexical=False)
+    assert [item["id"] for item in index.items] == [item["id"] for item in items]
+    assert [item["content"] for item in index.items][1:] == [item["content"] for item in items][1:]
+    assert index.items[0]["type"] == "image" and index.items[0]["path"] == "images/page_0.png"
+    np.testing.assert_array_equal(np.asarray(index.matrix), np.stack([item["embedding"] for item in items]))
+    assert (tmp_path / "rag_index" / "manifest.json").is_file()
@@ -0,0 +1,46 @@
+"""Tests for the columnar item store and its row views."""
+import numpy as np
+
+from modules.item_store import ItemStore
+
+def items(document_id, count, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = [{"id": f"text_{i}_0", "type": "text", "content": f"{document_id} chunk {i} — ü", "page": i,
+             "path": "", "document": document_id, "embedding": rng.standard_normal(8).astype(np.float32)}
+            for i in range(count)]
+    rows.append({"id": "image_0_0", "type": "image", "content": "", "page": 0, "path": f"blob:{document_id}/abc",
+                 "document": document_id, "caption": "Figure 1", "embedding": rng.standard_normal(8).astype(np.float32)})
+    return rows
+
+def plain(item):
+    return {key: item[key] for key in ("id", "type", "page", "path", "document")}
+
+def test_views_read_like_the_original_dicts():
+    source = items("paper", 5)
+    store = ItemStore.from_items(source)
+    assert len(store) == 6
+    assert [plain(item) for item in store] == [plain(item) for item in source]
+    assert [store[i]["content"] for i in range(5)] == [item["content"] for item in source[:5]]
+    image = store[-1]
+    assert image["caption"] == "Figure 1" and image["image"].path == "blob:paper/abc"
+    assert store[0]["caption"] is None and store[0].get("missing", "default") == "default"
+    np.testing.assert_array_equal(store.matrix, np.stack([item["embedding"] for item in source]))
+
+def test_result_views_carry_their_own_similarity():
+    store = ItemStore.from_items(items("paper", 3))
+    first, second = store.view(1, similarity=0.5), store.view(1, similarity=0.9)
+    assert (first["similarity"], second["similarity"]) == (0.5, 0.9)
+    assert dict(first)["content"] == "paper chunk 1 — ü" and "similarity" in dict(first)
+    assert "similarity" not in dict(store[1])
+
+def test_take_and_concatenate_keep_rows_and_tables():
+    first, second = ItemStore.from_items(items("a", 3, 0)), ItemStore.from_items(items("b", 2, 1))
+    joined = ItemStore.concatenate([first, second])
+    assert [item["document"] for item in joined] == ["a"] * 4 + ["b"] * 3
+    assert [item["content"] for item in joined] == [item["content"] for item in first] + \
+           [item["content"] for item in second]
+
+    kept = joined.take(~joined.document_mask(["a"]))
+    assert [plain(item) for item in kept] == [plain(item) for item in second]
+    np.testing.assert_array_equal(kept.matrix, second.matrix)
+    assert {item["document"] for item in joined.relabel("c")} == {"c"}
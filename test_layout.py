@@ -0,0 +1,29 @@
+"""Tests for layout-aware extraction."""
+import pymupdf
+
+import modules.layout as layout
+
+def text_page():
+    doc = pymupdf.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Figure 1: a caption")
+    page.insert_text((72, 120), "Body text of the page.")
+    return doc, page
+
+def test_tables_are_not_detected_by_default(monkeypatch):
+    def find_tables(page):
+        raise AssertionError("table detection ran without EXTRACTION_TABLES=1")
+    monkeypatch.setattr(layout, "find_tables", find_tables)
+
+    doc, page = text_page()
+    blocks = layout.page_blocks(page)
+    assert [block["kind"] for block in blocks] == ["caption", "text"]
+    assert all(len(block["bbox"]) == 4 for block in blocks)
+
+def test_plain_text_is_the_default_mode():
+    from modules.extraction import extract_page
+    doc, page = text_page()
+    plain = extract_page(doc, page, 0, "doc", span_pages=False)
+    layout_items = extract_page(doc, page, 0, "doc", span_pages=False, mode="layout")
+    assert plain and not any("bbox" in item for item in plain)
+    assert all("bbox" in item for item in layout_items)
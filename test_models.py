@@ -0,0 +1,27 @@
+"""Tests for the shared model provider."""
+import threading
+
+from modules.models import get_embedding_model, get_model, set_model_factory
+
+def test_each_model_is_created_once_across_threads():
+    created = []
+
+    def factory(name, **config):
+        created.append((name, config))
+        return object()
+
+    previous = set_model_factory("embedding", factory)
+    try:
+        handles = []
+        threads = [threading.Thread(target=lambda: handles.append(get_embedding_model("embedder")))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(created) == 1 and all(handle is handles[0] for handle in handles)
+        # Other settings are a different handle
+        assert get_model("embedding", "embedder", temperature=0) is not handles[0]
+        assert len(created) == 2
+    finally:
+        set_model_factory("embedding", previous)
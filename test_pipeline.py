@@ -0,0 +1,64 @@
+"""Tests for the streaming ingestion pipeline."""
+import time
+
+import pymupdf
+import pytest
+
+import modules.embedding as embedding
+import modules.pipeline as pipeline
+from modules.index_format import live_documents, read_index_dir, read_manifest
+
+def write_pdf(path, pages):
+    doc = pymupdf.open()
+    for n in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {n} of the paper. " * 5)
+    doc.save(str(path))
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def no_shared_cache(monkeypatch):
+    monkeypatch.setattr(embedding, "EMBEDDING_CACHE_ENABLED", False)
+
+def document_rows(index_path, document_id):
+    store = read_index_dir(index_path)
+    return sorted(item["id"] for item in store if item["document"] == document_id)
+
+def test_failed_extraction_keeps_previous_version(tmp_path, monkeypatch):
+    index_path = str(tmp_path / "index")
+    pdf_path = write_pdf(tmp_path / "paper.pdf", 4)
+    pipeline.ingest_pdf(pdf_path, index_path=index_path, document_id="paper")
+    before = document_rows(index_path, "paper")
+    assert before
+
+    extract = pipeline.iter_extract_pages
+    def failing_extract(*args, **kwargs):
+        for page_num, items in extract(*args, **kwargs):
+            if page_num == 2:
+                raise RuntimeError("page 2 is broken")
+            yield page_num, items
+    monkeypatch.setattr(pipeline, "iter_extract_pages", failing_extract)
+
+    class SlowErrors(list):
+        """Records errors late, as a descheduled stage thread would."""
+        def append(self, error):
+            time.sleep(0.5)
+            super().append(error)
+
+    ingest = pipeline.IngestionPipeline(pdf_path, index_path=index_path, document_id="paper")
+    ingest._errors = SlowErrors()
+    with pytest.raises(RuntimeError):
+        ingest.run()
+    assert document_rows(index_path, "paper") == before
+    assert live_documents(read_manifest(index_path))["paper"] == len(before)
+
+def test_reingesting_replaces_the_document(tmp_path):
+    index_path = str(tmp_path / "index")
+    pipeline.ingest_pdf(write_pdf(tmp_path / "other.pdf", 2), index_path=index_path, document_id="other")
+    pipeline.ingest_pdf(write_pdf(tmp_path / "paper.pdf", 5), index_path=index_path, document_id="paper")
+    other = document_rows(index_path, "other")
+
+    pipeline.ingest_pdf(write_pdf(tmp_path / "paper.pdf", 2), index_path=index_path, document_id="paper")
+    store = read_index_dir(index_path)
+    assert sorted({item["page"] for item in store if item["document"] == "paper"}) == [0, 1]
+    assert document_rows(index_path, "other") == other
+    assert live_documents(read_manifest(index_path)) == {"other": len(other), "paper": len(document_rows(index_path, "paper"))}
@@ -0,0 +1,50 @@
+"""Tests for the compressed embedding stores."""
+import numpy as np
+
+from modules.quantization import build_store
+
+def normalized(rows, dim, seed):
+    matrix = np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+    return matrix, 1.0 / np.linalg.norm(matrix, axis=1)
+
+def test_float16_and_int8_score_like_their_codes():
+    matrix, inv_norms = normalized(3000, 300, 0)
+    query = matrix[7] * inv_norms[7]
+    float16 = build_store("float16", matrix, inv_norms)
+    int8 = build_store("int8", matrix, inv_norms)
+
+    np.testing.assert_allclose(float16.scores(query), float16.codes.astype(np.float32) @ query, atol=1e-6)
+    np.testing.assert_allclose(int8.scores(query), (int8.codes.astype(np.float32) @ query) * int8.scales, atol=1e-6)
+    rows = np.array([9, 7, 2999])
+    np.testing.assert_allclose(float16.scores(query, rows), float16.scores(query)[rows], atol=1e-6)
+    assert np.argmax(float16.scores(query)) == np.argmax(int8.scores(query)) == 7
+
+def test_float16_widening_keeps_zeros_signs_and_subnormals():
+    codes = np.array([[0.0, -0.0, 1e-6, -1e-6, 6e-5, -2.5, 65000.0, 0.1]], dtype=np.float16)
+    store = build_store("float16", np.ones((1, 8), dtype=np.float32), np.ones(1, dtype=np.float32))
+    store.codes = codes
+    for axis in range(8):
+        query = np.eye(8, dtype=np.float32)[axis]
+        assert store.scores(query)[0] == np.float32(codes[0, axis])
+
+def test_pq_with_small_sample_uses_trained_centroids_only():
+    matrix, inv_norms = normalized(500, 64, 1)
+    store = build_store("pq", matrix, inv_norms, subspaces=8, sample_size=16)
+    # Only 16 centroids were trained per subspace; the zero padding is never assigned
+    assert store.codes.max() < 16
+
+def test_compressed_search_with_rerank_returns_exact_scores():
+    from modules.retrieval import VectorIndex
+
+    matrix, _ = normalized(2000, 64, 2)
+    index = VectorIndex([{"id": f"text_0_{i}", "type": "text", "content": "", "page": 0, "path": ""}
+                         for i in range(2000)], matrix=matrix)
+    queries = np.random.default_rng(3).standard_normal((5, 64)).astype(np.float32)
+    exact = [index.top_k(query, 5) for query in queries]
+    for mode in ("float16", "int8", "pq"):
+        index.compress(mode, subspaces=8)
+        reranked = [index.top_k(query, 5, rerank=50) for query in queries]
+        assert [[row for row, _ in result] for result in reranked] == [[row for row, _ in result] for result in exact]
+        # Re-ranked scores come from the float32 matrix
+        np.testing.assert_allclose([score for result in reranked for _, score in result],
+                                   [score for result in exact for _, score in result], rtol=1e-5)
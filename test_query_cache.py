@@ -0,0 +1,38 @@
+"""Tests for the question embedding cache."""
+import threading
+
+import modules.query_cache as query_cache
+from modules.query_cache import QueryEmbeddingCache, aembed_questions
+from utils.concurrency import run_sync
+
+def test_calls_share_one_rate_limiter(monkeypatch):
+    limiters = []
+    real_retry = query_cache.retry_call_async
+
+    async def recording_retry(fn, max_retries, limiter):
+        limiters.append(limiter)
+        return await real_retry(fn, max_retries=max_retries)
+    monkeypatch.setattr(query_cache, "retry_call_async", recording_retry)
+
+    cache = QueryEmbeddingCache()
+    run_sync(aembed_questions(["first question"], rate_limit=5, cache=cache))
+    run_sync(aembed_questions(["second question"], rate_limit=5, cache=cache))
+    assert len(limiters) == 2 and limiters[0] is limiters[1] is not None
+
+def test_cache_reads_and_writes_stay_off_the_event_loop():
+    class RecordingCache(QueryEmbeddingCache):
+        def get(self, question):
+            threads.append(threading.current_thread().name)
+            return super().get(question)
+
+        def put(self, question, embedding):
+            threads.append(threading.current_thread().name)
+            return super().put(question, embedding)
+
+    threads = []
+    cache = RecordingCache()
+    embeddings = run_sync(aembed_questions(["a question", "a question"], cache=cache))
+    run_sync(aembed_questions(["a question"], cache=cache))
+    assert embeddings[0] is not None and embeddings[0] is embeddings[1]
+    assert len(threads) == 4
+    assert all(name.startswith("rag-blocking") for name in threads)
@@ -4,14 +4,15 @@ Run this to verify everything works before deployment.
 """
 import os
 import sys
+import shutil
 from utils.auth import setup_google_auth
 from modules.extraction import extract_from_pdf
 from modules.embedding import create_embeddings
-from modules.retrieval import save_index, load_index
+from modules.retrieval import save_index, load_index, index_exists, index_dir_for
 from modules.generation import query_rag_system, show_query_result
 import config
 
-def test_complete_pipeline(pdf_path, question):
+def run_complete_pipeline(pdf_path, question):
     """Test the complete pipeline from PDF to answer."""
     print("=== Testing Complete Pipeline ===")
     print(f"PDF: {pdf_path}")
@@ -51,7 +52,7 @@ def test_complete_pipeline(pdf_path, question):
     
     return result
 
-def test_load_and_query(question):
+def run_load_and_query(question):
     """Test loading an existing index and querying it."""
     print("=== Testing Load and Query ===")
     print(f"Question: {question}")
@@ -78,24 +79,25 @@ def test_load_and_query(question):
 
 # Modify this part in test_rag.py
 if __name__ == "__main__":
-    import json
-    
-    # Delete any existing empty index
-    if os.path.exists(config.DEFAULT_INDEX_PATH):
+    # Delete any existing empty or invalid index
+    if index_exists(config.DEFAULT_INDEX_PATH):
         try:
-            with open(config.DEFAULT_INDEX_PATH, 'r') as f:
-                index_data = json.load(f)
-                if len(index_data) == 0:
-                    print("Found empty index file. Deleting it to reprocess PDF...")
-                    os.remove(config.DEFAULT_INDEX_PATH)
-        except (json.JSONDecodeError, FileNotFoundError):
-            print("Found invalid index file. Deleting it to reprocess PDF...")
-            os.remove(config.DEFAULT_INDEX_PATH)
+            reprocess = len(load_index(config.DEFAULT_INDEX_PATH)) == 0
+            if reprocess:
+                print("Found empty index. Deleting it to reprocess PDF...")
+        except (ValueError, OSError):
+            reprocess = True
+            print("Found invalid index. Deleting it to reprocess PDF...")
+
+        if reprocess:
+            shutil.rmtree(index_dir_for(config.DEFAULT_INDEX_PATH), ignore_errors=True)
+            if os.path.exists(config.DEFAULT_INDEX_PATH + ".json"):
+                os.remove(config.DEFAULT_INDEX_PATH + ".json")
     
     # Check if index exists
-    if os.path.exists(config.DEFAULT_INDEX_PATH):
+    if index_exists(config.DEFAULT_INDEX_PATH):
         # If it does, just test querying
-        test_load_and_query("What is flow matching ?")
+        run_load_and_query("What is flow matching ?")
     else:
         # Otherwise, test the complete pipeline
         print(f"Running complete pipeline with PDF: {config.PDF_PATH}")
@@ -107,4 +109,4 @@ if __name__ == "__main__":
             print("Or run with: PDF_FILE_PATH=/path/to/pdf python test_rag.py")
             exit(1)
         
-        test_complete_pipeline(config.PDF_PATH, "What are the key improvements in Stable Diffusion 3?")
\ No newline at end of file
+        run_complete_pipeline(config.PDF_PATH, "What are the key improvements in Stable Diffusion 3?")
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Tests for vector, filtered, approximate and lexical retrieval."""
+import numpy as np
+
+from modules.retrieval import VectorIndex
+
+def random_items(count, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"id": f"text_{i // 10}_{i % 10}", "type": "text", "content": f"chunk {i}", "page": i // 10, "path": "",
+             "document": "doc", "embedding": rng.standard_normal(dim).astype(np.float32)} for i in range(count)]
+
+def loop_top_k(items, query, top_k):
+    """Reference search: cosine similarity of each item in turn, as before vectorization."""
+    scored = []
+    for row, item in enumerate(items):
+        embedding = item["embedding"]
+        scored.append((row, float(np.dot(query, embedding) / (np.linalg.norm(query) * np.linalg.norm(embedding)))))
+    return sorted(scored, key=lambda pair: (-pair[1], pair[0]))[:top_k]
+
+def test_top_k_matches_a_per_item_loop():
+    items = random_items(200)
+    index = VectorIndex(items)
+    queries = np.random.default_rng(1).standard_normal((10, 16)).astype(np.float32)
+    for query in queries:
+        expected = loop_top_k(items, query, 7)
+        result = index.top_k(query, 7)
+        assert [row for row, _ in result] == [row for row, _ in expected]
+        np.testing.assert_allclose([score for _, score in result], [score for _, score in expected], rtol=1e-5)
+    for batched, query in zip(index.top_k_batch(queries, 7), queries):
+        assert [row for row, _ in batched] == [row for row, _ in index.top_k(query, 7)]
+    assert [item["id"] for item in index.search(queries[0], top_k=3)] == \
+           [items[row]["id"] for row, _ in loop_top_k(items, queries[0], 3)]
+
+def test_zero_query_and_empty_index():
+    index = VectorIndex(random_items(5))
+    assert [score for _, score in index.top_k(np.zeros(16, dtype=np.float32), 3)] == [0.0, 0.0, 0.0]
+    assert VectorIndex([]).search(np.ones(16, dtype=np.float32)) == []
+
+def clustered_items(count, clusters=20, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)) * 4
+    items = random_items(count, dim, seed)
+    for n, item in enumerate(items):
+        item["embedding"] = (centers[n % clusters] + rng.standard_normal(dim)).astype(np.float32)
+    return items
+
+def test_ann_search_finds_the_exact_neighbours(tmp_path):
+    from modules.ann import IVFIndex
+
+    items = clustered_items(2000)
+    index = VectorIndex(items)
+    queries = np.stack([items[n]["embedding"] for n in range(0, 2000, 97)]) + 0.1
+    exact = [index.top_k(query, 10) for query in queries]
+
+    index.build_ann(n_lists=20)
+    assert sorted(index.ann.list_rows.tolist()) == list(range(2000))
+    # Probing every list is exact search
+    assert [index.top_k(query, 10, nprobe=20) for query in queries] == exact
+    found = sum(len({row for row, _ in index.top_k(query, 10, nprobe=3)} & {row for row, _ in truth})
+                for query, truth in zip(queries, exact))
+    assert found / (10 * len(queries)) >= 0.9
+    assert index.top_k_batch(queries, 10, nprobe=3) == [index.top_k(query, 10, nprobe=3) for query in queries]
+
+    path = str(tmp_path / "ann.npz")
+    index.ann.save(path)
+    loaded = IVFIndex.load(path)
+    np.testing.assert_array_equal(loaded.list_rows, index.ann.list_rows)
+    np.testing.assert_array_equal(loaded.candidates(queries[0], 3), index.ann.candidates(queries[0], 3))
+
+def mixed_items(count=120, seed=0):
+    items = random_items(count, seed=seed)
+    for n, item in enumerate(items):
+        item["document"] = ["a", "b", "c"][n % 3]
+        if n % 4 == 0:
+            item.update(type="image", content="", path=f"images/{n}.png")
+    return items
+
+def matches(item, filters):
+    """Reference filter: check every condition on the item itself."""
+    for key, value in filters.items():
+        if value is None:
+            continue
+        if key == "pages":
+            first, last = (value, value) if isinstance(value, int) else value
+            if not first <= item["page"] <= last:
+                return False
+        elif item[key] not in ([value] if isinstance(value, str) else value):
+            return False
+    return True
+
+def test_filters_select_the_matching_rows():
+    import pytest
+
+    items = mixed_items()
+    index = VectorIndex(items)
+    query = np.random.default_rng(2).standard_normal(16).astype(np.float32)
+    for filters in [{"type": "image"}, {"document": ["a", "c"], "type": "text"}, {"pages": (3, 7), "document": "b"},
+                    {"pages": 5}, {"document": "missing"}, {"type": None}]:
+        expected = [row for row, item in enumerate(items) if matches(item, filters)]
+        rows = index.items.filter_rows(filters)
+        assert (list(range(len(items))) if rows is None else rows.tolist()) == expected
+
+        ranked = loop_top_k([items[row] for row in expected], query, 5)
+        assert [item["id"] for item in index.search(query, top_k=5, filters=filters)] == \
+               [items[expected[n]]["id"] for n, _ in ranked]
+
+    with pytest.raises(ValueError):
+        index.items.filter_rows({"colour": "red"})
+
+def bm25_reference(texts, query, k1=1.2, b=0.75):
+    """BM25 of each text for a query, term by term."""
+    from collections import Counter
+    from modules.lexical import tokenize
+
+    documents = [Counter(tokenize(text)) for text in texts]
+    average = sum(sum(counts.values()) for counts in documents) / len(documents)
+    scores = []
+    for counts in documents:
+        length, score = sum(counts.values()), 0.0
+        for term in set(tokenize(query)):
+            df = sum(term in other for other in documents)
+            if counts[term]:
+                idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+                score += idf * counts[term] * (k1 + 1) / (counts[term] + k1 * (1 - b + b * length / average))
+        scores.append(score)
+    return scores
+
+def test_bm25_ranks_like_the_formula():
+    rng = np.random.default_rng(3)
+    vocabulary = [f"term{i}" for i in range(40)]
+    items = random_items(60)
+    for item in items:
+        item["content"] = " ".join(rng.choice(vocabulary, rng.integers(3, 30)))
+    items[10]["content"] += " Zebra"
+    # Images carry no text to match, whatever their content field holds
+    items[20].update(type="image", content="zebra zebra", path="images/20.png")
+    index = VectorIndex(items)
+    texts = [item["content"] for item in items[:20] + items[21:]]
+
+    for query in ["term1 term7", "zebra term3", "ZEBRA", "nothing matches"]:
+        expected = bm25_reference(texts, query)
+        expected.insert(20, 0.0)
+        ranked = sorted((row for row, score in enumerate(expected) if score > 0), key=lambda row: (-expected[row], row))
+        result = index.lexical_top_k(query, 10)
+        assert [row for row, _ in result] == ranked[:10]
+        np.testing.assert_allclose([score for _, score in result], [expected[row] for row in ranked[:10]], rtol=1e-5)
+    # The rare term outweighs any common one
+    assert index.lexical_top_k("zebra term3", 1)[0][0] == 10
+    assert [item["id"] for item in index.search(None, 3, query_text="zebra", mode="lexical")] == [items[10]["id"]]
+
+def test_reciprocal_rank_fusion_and_hybrid_search():
+    from config import HYBRID_DEPTH
+    from modules.retrieval import reciprocal_rank_fusion
+
+    fused = reciprocal_rank_fusion([[(5, 0.9), (2, 0.8), (7, 0.1)], [(2, 3.0), (9, 1.0)]], 3, k=60)
+    assert [row for row, _ in fused] == [2, 5, 9]
+    np.testing.assert_allclose([score for _, score in fused], [1 / 62 + 1 / 61, 1 / 61, 1 / 62])
+    # Equal fused scores keep index order
+    assert [row for row, _ in reciprocal_rank_fusion([[(4, 1.0)], [(1, 1.0)]], 2)] == [1, 4]
+
+    items = random_items(80)
+    for n, item in enumerate(items):
+        item["content"] = f"chunk {n} " + ("apple" if n % 7 == 0 else "pear")
+    index = VectorIndex(items)
+    query = np.random.default_rng(5).standard_normal(16).astype(np.float32)
+    expected = reciprocal_rank_fusion([index.top_k(query, HYBRID_DEPTH), index.lexical_top_k("apple", HYBRID_DEPTH)], 5)
+    hybrid = index.search(query, 5, query_text="apple", mode="hybrid")
+    assert [item["id"] for item in hybrid] == [items[row]["id"] for row, _ in expected]
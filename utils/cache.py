@@ -0,0 +1,93 @@
+# Cache utilities
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by total size and/or number of entries."""
+
+    def __init__(self, max_bytes=None, max_items=None, sizeof=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.sizeof = sizeof or (lambda value: 1)
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it as recently used."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries over budget."""
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            self._evict()
+
+    def resize(self, key):
+        """Re-measure an entry whose value grew or shrank in place, evicting others if now over budget."""
+        with self._lock:
+            if key not in self._entries:
+                return
+            value, size = self._entries[key]
+            new_size = self.sizeof(value)
+            self._entries[key] = (value, new_size)
+            self.total_bytes += new_size - size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove a value from the cache."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            or (self.max_items is not None and len(self._entries) > self.max_items)
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,168 @@
+# Concurrency utilities: rate limiting and retries for API calls, and the shared
+# event loop and thread pool behind the async query path
+import asyncio
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as api_exceptions
+
+from config import ASYNC_WORKERS
+
+# Errors worth retrying: quota, overload and timeouts
+TRANSIENT_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available, without waiting. Returns the wait needed otherwise."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Wait for tokens without blocking the event loop."""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def shared_limiter(name, rate):
+    """Return the process-wide TokenBucket for a named quota, or None when rate is 0.
+
+    Callers drawing on the same API quota share one bucket, so concurrent
+    calls cannot each take a full burst.
+    """
+    if not rate:
+        return None
+    with _limiters_lock:
+        key = (name, float(rate))
+        if key not in _limiters:
+            _limiters[key] = TokenBucket(rate)
+        return _limiters[key]
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """Exponential backoff with jitter for a 0-based retry attempt."""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+def retry_call(fn, max_retries=5, base_delay=1.0, limiter=None, retry_on=TRANSIENT_ERRORS):
+    """Call fn, retrying transient errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn()
+        except retry_on:
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay))
+
+async def retry_call_async(fn, max_retries=5, base_delay=1.0, limiter=None, retry_on=TRANSIENT_ERRORS):
+    """Await fn(), retrying transient errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire_async()
+        try:
+            return await fn()
+        except retry_on:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt, base_delay))
+
+_executor = None
+_loop = None
+_loop_thread = None
+_pool_lock = threading.Lock()
+
+def get_executor():
+    """Return the thread pool shared by blocking calls made from async code."""
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="rag-blocking")
+        return _executor
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the shared thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+def get_event_loop():
+    """Return the shared event loop, running on a daemon thread, that sync wrappers submit to.
+
+    Every sync caller (CLI, Streamlit sessions, batch threads) shares this loop, so
+    their network calls wait concurrently and reuse the same async clients.
+    """
+    global _loop, _loop_thread
+    executor = get_executor()
+    with _pool_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop.set_default_executor(executor)
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="rag-event-loop", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+def _check_not_on_loop():
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("Sync wrapper called from the shared event loop, await the async function instead")
+
+def run_sync(coro):
+    """Run a coroutine on the shared event loop and block until it finishes."""
+    loop = get_event_loop()
+    _check_not_on_loop()
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+def iter_sync(agen):
+    """Iterate an async generator from sync code, one item at a time, on the shared event loop."""
+    loop = get_event_loop()
+    _check_not_on_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # Also runs when the consumer stops early, e.g. a Streamlit rerun
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
@@ -2,6 +2,7 @@
 import os
 import json
 import base64
+import io
 from PIL import Image as PILImage
 
 def ensure_directory(dir_path):
@@ -27,4 +28,34 @@ def base64_to_image(base64_data, output_path):
     """Convert base64 data to an image file."""
     image_data = base64.b64decode(base64_data)
     with open(output_path, "wb") as f:
-        f.write(image_data)
\ No newline at end of file
+        f.write(image_data)
+
+def downsize_image(image_bytes, max_pixels):
+    """Shrink an image to at most max_pixels and re-encode it compactly. Returns (bytes, mime type).
+
+    Images with transparency stay PNG, others become JPEG when that is smaller.
+    Images already within budget are returned unchanged if re-encoding does not help.
+    """
+    with PILImage.open(io.BytesIO(image_bytes)) as image:
+        original_mime = PILImage.MIME.get(image.format, "image/png")
+        width, height = image.size
+        resized = width * height > max_pixels > 0
+        if resized:
+            scale = (max_pixels / (width * height)) ** 0.5
+            image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), PILImage.LANCZOS)
+
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        output = io.BytesIO()
+        if has_alpha:
+            image.save(output, format="PNG", optimize=True)
+            mime_type = "image/png"
+        else:
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(output, format="JPEG", quality=85)
+            mime_type = "image/jpeg"
+
+    data = output.getvalue()
+    if not resized and len(data) >= len(image_bytes):
+        return image_bytes, original_mime
+    return data, mime_type